@@ -1,4 +1,5 @@
 from pipeline import generate_story, apply_tweak
+from flows import preset_tweak
 import os
 import json
 from dotenv import load_dotenv
@@ -36,13 +37,6 @@ def main():
             f"  Round {r['round']}: pass={v.get('pass')} avg={avg} scores={scores}")
 
     # ---- Tweak loop ----
-    preset_map = {
-        "shorter": "Reduce to ~450 words. Simplify sentences further.",
-        "calmer": "Lower stakes, slower cadence, extra reassurance in the last two paragraphs.",
-        "more-dialogue": "Add gentle dialogue between characters with simple tags.",
-        "new-moral": "Change the moral to 'kindness and sharing' clearly in the final line."
-    }
-
     while True:
         tweak = input(
             "\nWould you like to make changes? Type ANY tweak (e.g., 'make the cat shyer and add a lullaby ending').\n"
@@ -53,7 +47,7 @@ def main():
             print("Okay! Good night and sweet dreams. 🌟")
             break
 
-        tweak_text = preset_map.get(tweak.lower(), tweak)
+        tweak_text = preset_tweak(tweak)
 
         print("\nApplying your tweak and regenerating...\n")
         new_story, new_verdict = apply_tweak(
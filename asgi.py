@@ -0,0 +1,248 @@
+from pipeline import agenerate_story_events, pool_story
+from flows import astart_story, atweak_story, anext_chapter
+import asyncio
+import os
+from dotenv import load_dotenv
+from quart import (
+    Quart, Response, render_template, request, redirect, url_for, session, flash
+)
+
+import jobs
+import metrics
+import pool
+import ratelimit
+import serving
+import sessions
+import speculative
+from serving import sse
+
+load_dotenv()
+
+# Async serving mode: the same routes as webapp.py on Quart, for an ASGI
+# server (`uvicorn asgi:app`). Pipeline runs are tasks on the event loop
+# driving the async OpenAI client, so one process holds hundreds of
+# in-flight stories instead of one per sync worker.
+
+
+async def _generate(payload):
+    with ratelimit.priority("interactive"):
+        return await astart_story(payload["prompt"], payload.get("mode", "short"))
+
+
+# Job kinds the speculator may run before the click (see speculative.py)
+SPECULATIVE_FLOWS = {
+    "tweak": lambda p: atweak_story(p["state"], p["tweak"]),
+    "next_chapter": lambda p: anext_chapter(p["state"], end_now=p.get("end_now", False)),
+}
+
+
+async def _tweak(payload):
+    with ratelimit.priority("tweak"):
+        return await SPECULATIVE_FLOWS["tweak"](payload)
+
+
+async def _next_chapter(payload):
+    with ratelimit.priority("interactive"):
+        return await SPECULATIVE_FLOWS["next_chapter"](payload)
+
+
+# Background job kinds -> coroutine handlers (payload dict in, new session state out)
+JOB_HANDLERS = {
+    "generate": _generate,
+    "tweak": _tweak,
+    "next_chapter": _next_chapter,
+}
+
+
+def _event_stream(events) -> Response:
+    response = Response(events, mimetype="text/event-stream", headers=serving.SSE_HEADERS)
+    # A story can take longer than Quart's default 60 s response timeout
+    response.timeout = None
+    return response
+
+
+def create_asgi_app():
+    app = Quart(__name__)
+    app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-for-local-only")
+    app.config["LIVE_STREAM"] = True
+    sessions.init_async_app(app)
+    speculator = speculative.AsyncSpeculator(SPECULATIVE_FLOWS) if speculative.SPECULATE_ENABLED else None
+    job_queue = jobs.AsyncJobQueue(speculator.wrap(JOB_HANDLERS) if speculator else JOB_HANDLERS)
+    app.extensions["job_queue"] = job_queue
+    serving.register_gauges(job_queue)
+
+    @app.before_serving
+    async def startup():
+        job_queue.start()
+        if pool.POOL_ENABLED:
+            app.extensions["pool_filler"] = pool.PoolFiller(pool_story).start()
+
+    @app.after_serving
+    async def shutdown():
+        await job_queue.stop()
+        if speculator:
+            await speculator.stop()
+        if "pool_filler" in app.extensions:
+            app.extensions["pool_filler"].stop()
+
+    def deliver(state):
+        session["state"] = state
+        if speculator:
+            speculator.speculate(state)
+
+    def wants_json():
+        return serving.wants_json(request.accept_mimetypes)
+
+    async def notify(notice):
+        if notice:
+            await flash(*notice)
+        return redirect(url_for("index"))
+
+    async def enqueue(job):
+        """Same contract as webapp.create_app's enqueue: redirect, 202 or 429."""
+        if not isinstance(job, serving.Job):
+            return await notify(job)
+        if speculator and job.kind in speculator.flows and not wants_json():
+            hit = await speculator.take(job.kind, job.payload)
+            if hit is not None:
+                session.pop("failed_job", None)
+                deliver(hit)
+                return redirect(url_for("index"))
+
+        try:
+            # The job row is a SQLite write: keep it off the event loop
+            job_id = await asyncio.to_thread(job_queue.submit, job.kind, job.payload)
+            session.pop("failed_job", None)
+        except jobs.QueueFull as e:
+            if wants_json():
+                return {"error": str(e)}, 429
+            await flash(str(e), "warning")
+            return await render_template("index.html", state=session.get("state"), job=None), 429
+
+        if wants_json():
+            return {"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}, 202
+        serving.job_started(session, job, job_id)
+        return redirect(url_for("index"))
+
+    async def end_story(notice, *keys):
+        if speculator:
+            await speculator.discard(session.get("state"))
+        return await notify(serving.end_story(session, notice, *keys))
+
+    @app.route("/", methods=["GET"])
+    async def index():
+        return await render_template("index.html", state=session.get("state"), job=session.get("job"),
+                                     failed_job=session.get("failed_job"))
+
+    @app.route("/generate", methods=["POST"])
+    async def generate():
+        return await enqueue(serving.generate_job(await request.form))
+
+    @app.route("/generate/stream", methods=["GET"])
+    async def generate_stream():
+        """Short-story flow as Server-Sent Events (see webapp.py)."""
+        prompt = request.args.get("prompt", "").strip()
+        error = serving.stream_error(prompt)
+        if error:
+            return Response(sse("failed", {"message": error}), mimetype="text/event-stream")
+
+        async def events():
+            # A closed connection cancels this generator, and the pipeline with it
+            try:
+                with ratelimit.priority("interactive"):
+                    async for event, data in agenerate_story_events(prompt, max_rounds=2):
+                        yield serving.stream_event(app.secret_key, prompt, event, data)
+            except Exception as e:
+                yield sse("failed", {"message": f"Error generating: {e}"})
+
+        return _event_stream(events())
+
+    @app.route("/generate/commit", methods=["POST"])
+    async def generate_commit():
+        """Store a streamed story (signed by /generate/stream) in the session."""
+        state = serving.streamed_state(app.secret_key, (await request.form).get("token", ""))
+        if isinstance(state, tuple):
+            return await notify(state)
+        deliver(state)
+        return redirect(url_for("index"))
+
+    @app.route("/tweak", methods=["POST"])
+    async def tweak():
+        return await enqueue(serving.tweak_job(session.get("state"), await request.form))
+
+    @app.route("/arc/next", methods=["POST"])
+    async def arc_next():
+        return await enqueue(serving.chapter_job(session.get("state"), end_now=False))
+
+    @app.route("/arc/end_next", methods=["POST"])
+    async def arc_end_next():
+        """Generate the FINAL chapter now, then show only 'End Now' on the page."""
+        return await enqueue(serving.chapter_job(session.get("state"), end_now=True))
+
+    @app.route("/arc/end_now", methods=["POST"])
+    async def arc_end_now():
+        return await end_story(("Story ended. Start a new one!", "info"))
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    async def job_status(job_id):
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        return serving.job_view(job_id, job), 404 if job is None else 200
+
+    @app.route("/jobs/<job_id>/events", methods=["GET"])
+    async def job_events(job_id):
+        """Subscribe to a job's status changes as Server-Sent Events."""
+        async def events():
+            last = None
+            while True:
+                job = await asyncio.to_thread(job_queue.get, job_id)
+                status, data, running = serving.job_event(job_id, job)
+                if status != last:
+                    yield sse("status", data)
+                    last = status
+                if not running:
+                    return
+                await asyncio.sleep(1.0)
+
+        return _event_stream(events())
+
+    @app.route("/jobs/<job_id>/finish", methods=["POST"])
+    async def job_finish(job_id):
+        """Move a finished job's result into this user's session."""
+        pending = session.get("job")
+        if not pending or pending.get("id") != job_id:
+            return redirect(url_for("index"))
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        state, notice = serving.job_finished(session, job_id, job)
+        if state is not None:
+            deliver(state)
+        return await notify(notice)
+
+    @app.route("/jobs/<job_id>/retry", methods=["POST"])
+    async def job_retry(job_id):
+        """Re-run a failed job under the same id, skipping its completed stages."""
+        try:
+            retried = await asyncio.to_thread(job_queue.retry, job_id)
+        except jobs.QueueFull as e:
+            if wants_json():
+                return {"error": str(e)}, 429
+            return await notify((str(e), "warning"))
+        if wants_json():
+            return serving.retry_json(job_id, retried, url_for("job_status", job_id=job_id))
+        return await notify(serving.job_retried(session, job_id, retried))
+
+    @app.route("/metrics", methods=["GET"])
+    async def metrics_endpoint():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/cache/stats", methods=["GET"])
+    async def cache_stats():
+        return await asyncio.to_thread(serving.cache_stats)
+
+    @app.route("/reset", methods=["POST"])
+    async def reset():
+        return await end_story(("Cleared session. Start fresh!", "info"), "failed_job")
+
+    return app
+
+
+app = create_asgi_app()
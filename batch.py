@@ -0,0 +1,169 @@
+"""
+Batch story generation from a JSONL file of requests.
+
+    python batch.py requests.jsonl -o stories.jsonl --workers 4
+    python batch.py requests.jsonl -o arcs.jsonl --mode arc --chapters 4
+    python batch.py requests.jsonl -o arcs.jsonl --mode outline --chapters 6
+
+Each input line is a JSON object with an id (`request_id` or `id`) and a
+prompt (`prompt` or `request`); optional `mode`/`chapters` override the CLI
+defaults per line. "outline" mode writes the same multi-chapter story as
+"arc", but plans it first and writes all its chapters at once. Results are
+appended to the output as they finish, so a crashed run can be re-started
+with the same arguments: requests that already have an "ok" line in the
+output are skipped, and failed ones resume from the stages they finished
+(checkpointed under "batch:<request_id>").
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Set
+
+from dotenv import load_dotenv
+
+import checkpoints
+import dedup
+import ratelimit
+from flows import start_story, next_chapter
+from pipeline import generate_story, generate_outlined_arc
+from llm import track_usage
+
+load_dotenv()
+
+
+def read_requests(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream request records from a JSONL file, skipping blank/invalid lines."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[batch] skipping invalid JSON on line {line_no}", file=sys.stderr)
+                continue
+            record.setdefault("request_id", record.get("id") or f"line-{line_no}")
+            yield record
+
+
+def completed_ids(path: str) -> Set[str]:
+    """Request ids that already have a successful result in the output file."""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            if record.get("status") == "ok":
+                done.add(str(record.get("request_id")))
+    return done
+
+
+def run_one(record: Dict[str, Any], mode: str, chapters: int, max_rounds: int) -> Dict[str, Any]:
+    prompt = (record.get("prompt") or record.get("request") or "").strip()
+    mode = record.get("mode", mode)
+    chapters = int(record.get("chapters", chapters))
+    out: Dict[str, Any] = {"request_id": record["request_id"], "prompt": prompt, "mode": mode}
+    timings: Dict[str, float] = {}
+    t0 = time.perf_counter()
+    run_id = f"batch:{record['request_id']}"
+    with track_usage() as usage, checkpoints.run(run_id), ratelimit.priority("batch"), dedup.read_only():
+        try:
+            if not prompt:
+                raise ValueError("empty prompt")
+            if mode == "outline":
+                result = generate_outlined_arc(prompt, chapters=chapters)
+                out.update(brief=result["brief"], outline=result["outline"], chapters=result["chapters"],
+                           history=result["history"], continuity_edits=result["continuity_edits"])
+            elif mode == "arc":
+                state = start_story(prompt, mode="arc")
+                timings["chapter-1"] = round(time.perf_counter() - t0, 3)
+                for i in range(2, chapters + 1):
+                    t = time.perf_counter()
+                    state = next_chapter(state, end_now=(i == chapters))
+                    timings[f"chapter-{i}"] = round(time.perf_counter() - t, 3)
+                out.update(brief=state["brief"], chapters=state["chapters"],
+                           history=state["history"])
+            else:
+                result = generate_story(prompt, max_rounds=max_rounds)
+                out.update(brief=result["brief"], story=result["story"],
+                           history=result["history"], passed=result.get("passed", False))
+            out["status"] = "ok"
+            checkpoints.clear(run_id)
+        except Exception as e:
+            out.update(status="error", error=f"{type(e).__name__}: {e}")
+    timings["total"] = round(time.perf_counter() - t0, 3)
+    out["timings"] = timings
+    out["usage"] = dict(usage)
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Batch-generate bedtime stories from a JSONL file.")
+    parser.add_argument("input", help="JSONL file of requests")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="concurrent flows")
+    parser.add_argument("--mode", choices=["short", "arc", "outline"], default="short")
+    parser.add_argument("--chapters", type=int, default=3, help="chapters per story in arc/outline mode")
+    parser.add_argument("--max-rounds", type=int, default=2, help="judge/edit rounds in short mode")
+    args = parser.parse_args(argv)
+
+    if not os.getenv("OPENAI_API_KEY"):
+        print("WARNING: OPENAI_API_KEY not set. Create .env and add OPENAI_API_KEY, or export it.")
+        return 1
+
+    skip = completed_ids(args.output)
+    if skip:
+        print(f"[batch] resuming: {len(skip)} request(s) already done")
+
+    ok = failed = 0
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    with open(args.output, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=args.workers) as pool:
+
+        def write(result: Dict[str, Any]) -> None:
+            nonlocal ok, failed
+            with lock:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                if result["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+                print(f"[batch] {result['request_id']}: {result['status']} "
+                      f"in {result['timings']['total']}s ({ok} ok, {failed} failed)")
+
+        # Keep at most 2x workers requests in memory; the input is streamed
+        slots = threading.BoundedSemaphore(args.workers * 2)
+
+        def finished(fut) -> None:
+            try:
+                write(fut.result())
+            finally:
+                slots.release()
+
+        for record in read_requests(args.input):
+            if str(record["request_id"]) in skip:
+                continue
+            slots.acquire()
+            pool.submit(run_one, record, args.mode, args.chapters,
+                        args.max_rounds).add_done_callback(finished)
+
+    elapsed = time.perf_counter() - started
+    rate = ok / (elapsed / 60) if elapsed > 0 else 0.0
+    print(f"[batch] done: {ok} ok, {failed} failed in {elapsed:.1f}s ({rate:.2f} stories/min)")
+    return 0 if failed == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Near-duplicate request index: match quality, lookup cost and LLM calls saved.
+
+    python benchmarks/bench_dedup.py
+    python benchmarks/bench_dedup.py --entries 20000 --threshold 0.7 --stories
+
+Builds prompts from (animal, moral) pairs phrased several ways. Phrasings of
+the same pair should match each other and nothing else. Reports precision
+and recall, lookup latency as the index grows, and generate_story calls and
+wall time against the fake server for a stream of repeated requests.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+
+ANIMALS = ["bunny", "hedgehog", "dragon", "owl", "kitten", "puppy", "turtle", "fox", "bear", "penguin",
+           "elephant", "squirrel", "duckling", "mouse", "giraffe", "otter", "lamb", "robin", "frog", "panda"]
+MORALS = [("shares", "sharing"), ("is brave", "bravery"), ("waits patiently", "patience"),
+          ("tells the truth", "honesty"), ("helps a friend", "helping friends"),
+          ("says sorry", "saying sorry"), ("tries again", "trying again"), ("is kind", "kindness")]
+PHRASINGS = [
+    "a story about a {animal} who {verb}",
+    "{animal} learning about {noun}",
+    "A bedtime story about a little {animal} who {verb}",
+    "Please write a tale where a {animal} {verb}",
+    "{noun} story with a {animal}",
+]
+
+
+def prompts(rng: random.Random, n: int) -> List[Tuple[Tuple[str, str], str]]:
+    out = []
+    for _ in range(n):
+        animal = rng.choice(ANIMALS)
+        verb, noun = rng.choice(MORALS)
+        out.append(((animal, noun), rng.choice(PHRASINGS).format(animal=animal, verb=verb, noun=noun)))
+    return out
+
+
+def quality(threshold: float, rng: random.Random) -> None:
+    import dedup
+
+    path = os.path.join(tempfile.mkdtemp(), "index.sqlite3")
+    index = dedup.RequestIndex(path=path, threshold=threshold)
+    seen = {}
+    tp = fp = fn = 0
+    for label, text in prompts(rng, 2000):
+        match = index.lookup(text)
+        if match is None:
+            fn += label in seen
+            index.remember(text, {"label": list(label)})
+            seen.setdefault(label, text)
+        elif tuple(match["brief"]["label"]) == label:
+            tp += 1
+        else:
+            fp += 1
+    print(f"quality @ threshold {threshold}: {tp} correct reuses, {fp} wrong, {fn} missed "
+          f"(precision {tp / max(1, tp + fp):.3f}, recall {tp / max(1, tp + fn):.3f}), "
+          f"{index.stats()['entries']} entries")
+
+
+def lookup_cost(entries: int, rng: random.Random) -> None:
+    import dedup
+
+    path = os.path.join(tempfile.mkdtemp(), "index.sqlite3")
+    index = dedup.RequestIndex(path=path, max_entries=entries)
+    words = [f"w{i}" for i in range(5000)]
+    checkpoints = sorted({min(entries, n) for n in (1000, 10000, entries)})
+    added = 0
+    for size in checkpoints:
+        while added < size:
+            index.remember(" ".join(rng.sample(words, 5)), {"n": added})
+            added += 1
+        probes = [" ".join(rng.sample(words, 5)) for _ in range(300)]
+        t0 = time.perf_counter()
+        for p in probes:
+            index.lookup(p)
+        per = (time.perf_counter() - t0) / len(probes)
+        print(f"lookup with {size:>6} entries: {per * 1e6:.0f} us")
+
+
+def end_to_end(args, rng: random.Random) -> None:
+    server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ["LLM_CACHE_STAGES"] = ""
+
+    import dedup
+    import llm
+    import pipeline
+    llm.reset_clients()
+    dedup.REUSE_STORIES = args.stories
+    stream = [text for _, text in prompts(rng, args.requests)]
+
+    for enabled in (False, True):
+        dedup.INDEX_ENABLED = enabled
+        dedup._index = dedup.RequestIndex(path=os.path.join(tempfile.mkdtemp(), "index.sqlite3"))
+        with llm.track_usage() as usage:
+            t0 = time.perf_counter()
+            for text in stream:
+                pipeline.generate_story(text)
+            wall = time.perf_counter() - t0
+        label = "index on" + (" (+stories)" if args.stories else "") if enabled else "index off"
+        print(f"{label:<20} {len(stream)} requests: {usage['calls'] / len(stream):.2f} calls/request, "
+              f"{wall / len(stream) * 1000:.0f} ms/request, hit rate {dedup.stats()['hit_rate']:.2f}")
+    server.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the near-duplicate request index.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--entries", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200, help="generate_story calls in the end-to-end run")
+    parser.add_argument("--stories", action="store_true", help="also reuse passing stories")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed or 1)
+    quality(args.threshold, rng)
+    lookup_cost(args.entries, rng)
+    end_to_end(args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+End-to-end pipeline benchmarks against the local fake OpenAI server.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py -n 20 --latency lognormal:0.4:0.5 --judge-script fail,pass,pass
+
+For each flow (generate_story, apply_tweak, starting an arc, a 5-chapter arc
+written chapter by chapter and the same arc outline-first) reports LLM calls
+per run, wall-time p50/p95 and the Python-side overhead, plus runs that
+raised. No API key or network access needed.
+
+Overhead is the CPU time of the thread running the flow (time.thread_time):
+waiting on the API costs none of it, and it stays meaningful for flows that
+overlap their LLM calls, where wall time minus summed LLM time does not. The
+in-process fake server runs on its own threads and isn't counted; neither is
+SQLite work handed to worker threads.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+
+PROMPT = "A gentle story about a hedgehog who learns to be patient"
+TWEAK = "Make the hedgehog shyer and add a lullaby ending."
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def measure(name: str, fn: Callable[[], object], iterations: int) -> Dict[str, float]:
+    from llm import track_usage
+
+    walls, calls, cpu, out_tokens = [], [], [], []
+    failed = 0
+    for _ in range(iterations):
+        with track_usage() as usage:
+            t0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                fn()
+            except Exception:
+                failed += 1
+            wall = time.perf_counter() - t0
+            cpu.append(time.thread_time() - c0)
+        walls.append(wall)
+        calls.append(usage["calls"])
+        out_tokens.append(usage["completion_tokens"])
+    return {
+        "flow": name,
+        "runs": iterations,
+        "failed": failed,
+        "calls_per_run": sum(calls) / len(calls),
+        "completion_tokens_per_run": sum(out_tokens) / len(out_tokens),
+        "wall_p50_s": percentile(walls, 50),
+        "wall_p95_s": percentile(walls, 95),
+        "wall_mean_s": sum(walls) / len(walls),
+        "py_cpu_mean_ms": 1000 * sum(cpu) / len(cpu),
+    }
+
+
+def build_flows(arc_chapters: int) -> Dict[str, Callable[[], object]]:
+    from flows import start_story, next_chapter
+    from pipeline import generate_story, apply_tweak, generate_outlined_arc
+
+    seed = generate_story(PROMPT)
+
+    def arc():
+        state = start_story(PROMPT, mode="arc")
+        for i in range(2, arc_chapters + 1):
+            state = next_chapter(state, end_now=(i == arc_chapters))
+        return state
+
+    return {
+        "generate_story": lambda: generate_story(PROMPT),
+        "apply_tweak": lambda: apply_tweak(seed["brief"], seed["story"], TWEAK),
+        "arc_start": lambda: start_story(PROMPT, mode="arc"),
+        f"arc-{arc_chapters}": arc,
+        f"outline-{arc_chapters}": lambda: generate_outlined_arc(PROMPT, chapters=arc_chapters),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark pipeline flows against a fake OpenAI server.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("--arc-chapters", type=int, default=5)
+    parser.add_argument("--flows", default="",
+                        help="comma-separated subset of flows to run (default: all)")
+    parser.add_argument("--cache", action="store_true",
+                        help="keep the LLM response cache on (off by default for comparable runs)")
+    parser.add_argument("--edit-mode", choices=["full", "patch"], default=None,
+                        help="override EDIT_MODE for the editor stage")
+    parser.add_argument("--judge-mode", choices=["separate", "fused"], default=None,
+                        help="override JUDGE_MODE for the judge/edit loop")
+    parser.add_argument("--confirm", choices=["llm", "local"], default=None,
+                        help="override FUSED_CONFIRM (final check in fused mode)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    if not args.cache:
+        os.environ["LLM_CACHE_STAGES"] = ""
+
+    import llm
+    import pipeline
+    llm.reset_clients()
+    if args.edit_mode:
+        pipeline.EDIT_MODE = args.edit_mode
+    if args.judge_mode:
+        pipeline.JUDGE_MODE = args.judge_mode
+    if args.confirm:
+        pipeline.FUSED_CONFIRM = args.confirm
+
+    flows = build_flows(args.arc_chapters)
+    wanted = [f for f in args.flows.split(",") if f] or list(flows)
+    results = [measure(name, flows[name], args.iterations) for name in wanted]
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"fake upstream: latency={args.latency} tokens/s={args.tokens_per_sec or 'inf'} "
+          f"judge={args.judge_script} bad-json={args.bad_json_rate} edit={pipeline.EDIT_MODE} "
+          f"loop={pipeline.JUDGE_MODE}{'/' + pipeline.FUSED_CONFIRM if pipeline.JUDGE_MODE == 'fused' else ''}")
+    print(f"{'flow':<16} {'runs':>4} {'fail':>4} {'calls':>6} {'tok out':>8} {'p50 s':>8} {'p95 s':>8} {'mean s':>8} {'py cpu ms':>10}")
+    for r in results:
+        print(f"{r['flow']:<16} {r['runs']:>4} {r['failed']:>4} {r['calls_per_run']:>6.1f} {r['completion_tokens_per_run']:>8.0f} "
+              f"{r['wall_p50_s']:>8.3f} {r['wall_p95_s']:>8.3f} {r['wall_mean_s']:>8.3f} {r['py_cpu_mean_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
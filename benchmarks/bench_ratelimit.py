@@ -0,0 +1,121 @@
+"""
+Shared rate limiter: 429s, throughput and latency per priority class.
+
+    python benchmarks/bench_ratelimit.py
+    python benchmarks/bench_ratelimit.py --rpm-limit 300 --workers 4 --seconds 20
+
+Runs the fake server with an account RPM/TPM quota, then several worker
+processes sharing one limiter database, each firing interactive and batch
+llm.chat calls from a few threads. Runs once with the limiter off (workers
+find the quota through 429s and retries) and once with it on, and reports
+the server's 429 count plus completed calls and p50/p95 latency per class.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+
+MESSAGES = {
+    "interactive": [{"role": "user", "content": "Tell me a short story about a sleepy owl."}],
+    "batch": [{"role": "user", "content": "Write a long bedtime story about a brave turtle and a lost map."}],
+}
+MAX_TOKENS = {"interactive": 200, "batch": 600}
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def worker(env: Dict[str, str], seconds: float, threads: int, think: float, out) -> None:
+    os.environ.update(env)
+    import llm
+    import ratelimit
+
+    results: List[Tuple[str, float, bool]] = []
+    lock = threading.Lock()
+    stop_at = time.time() + seconds
+
+    def loop(name: str) -> None:
+        with ratelimit.priority(name):
+            while time.time() < stop_at:
+                t0 = time.perf_counter()
+                try:
+                    llm.chat(MESSAGES[name], max_tokens=MAX_TOKENS[name], stage="story", cache=False)
+                    ok = True
+                except Exception:
+                    ok = False
+                with lock:
+                    results.append((name, time.perf_counter() - t0, ok))
+                if name == "interactive":
+                    time.sleep(think)  # a person reading, not a tight loop
+
+    pool = [threading.Thread(target=loop, args=(name,)) for name in MESSAGES for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    out.put(results)
+
+
+def run(label: str, base_url: str, args, limited: bool) -> None:
+    env = {
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "fake",
+        "LLM_CACHE_STAGES": "",
+        "LLM_RPM": str(args.rpm_limit if limited else 0),
+        "LLM_TPM": str(args.tpm_limit if limited else 0),
+        "LLM_LIMIT_BURST": str(args.limit_burst),
+        "LLM_LIMIT_PATH": os.path.join(tempfile.mkdtemp(), "ratelimit.sqlite3"),
+        "LLM_BREAKER_FAILURES": "1000000",
+    }
+    before = json.load(urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats"))["rate_limited"]
+    out = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker, args=(env, args.seconds, args.threads, args.think, out))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    results = [r for _ in procs for r in out.get()]
+    for p in procs:
+        p.join()
+    after = json.load(urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats"))["rate_limited"]
+
+    print(f"{label}: {after - before} x 429 from the server")
+    for name in MESSAGES:
+        done = [lat for n, lat, ok in results if n == name and ok]
+        failed = sum(1 for n, _, ok in results if n == name and not ok)
+        print(f"  {name:<12} {len(done) / args.seconds:6.2f} calls/s, {failed:3d} failed, "
+              f"p50 {_pct(done, 50) * 1000:6.0f} ms, p95 {_pct(done, 95) * 1000:6.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the shared rate limiter.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--workers", type=int, default=3, help="processes sharing the quota")
+    parser.add_argument("--threads", type=int, default=3, help="threads per priority class per process")
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--think", type=float, default=1.0, help="pause between interactive calls")
+    parser.set_defaults(rpm_limit=600.0, tpm_limit=150000.0, limit_burst=2.0)
+    args = parser.parse_args()
+
+    server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+    run("limiter off", base_url, args, limited=False)
+    run("limiter on ", base_url, args, limited=True)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Retry / hedging / circuit-breaker behaviour against the local fake OpenAI server.
+
+    python benchmarks/bench_resilience.py
+    python benchmarks/bench_resilience.py -n 300 --workers 16 --error-rate 0.1 --hang-rate 0.03
+
+Runs the same batch of judge calls under several `resilience` settings and
+reports success rate, latency p50/p95/p99 and how many requests reached the
+upstream. A last scenario takes the upstream down completely and shows how
+fast calls fail once the breaker opens.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+from bench_pipeline import percentile  # noqa: E402
+
+MESSAGES = [
+    {"role": "system", "content": "You are a Children's Literature Judge."},
+    {"role": "user", "content": "Judge this story."},
+]
+
+SCENARIOS = [
+    ("no-retry", {"MAX_RETRIES": 0, "HEDGE": False}),
+    ("retry", {"MAX_RETRIES": 3, "HEDGE": False}),
+    ("retry+hedge", {"MAX_RETRIES": 3, "HEDGE": True}),
+]
+
+
+def upstream_calls(base_url: str) -> int:
+    import httpx
+    stats = httpx.get(base_url.rsplit("/v1", 1)[0] + "/stats").json()
+    return sum(stats["calls"].values())
+
+
+def run_batch(n: int, workers: int, timeout: float) -> Dict[str, float]:
+    import llm
+
+    def one(_):
+        t0 = time.perf_counter()
+        try:
+            llm.chat(MESSAGES, max_tokens=50, timeout=timeout, stage="judge", cache=False)
+            return True, time.perf_counter() - t0
+        except Exception:
+            return False, time.perf_counter() - t0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, range(n)))
+    ok = [t for success, t in results if success]
+    return {
+        "ok_pct": 100 * len(ok) / n,
+        "p50": percentile(ok, 50),
+        "p95": percentile(ok, 95),
+        "p99": percentile(ok, 99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark llm resilience against a fake OpenAI server.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("-n", "--calls", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=2.0, help="per-request timeout")
+    parser.set_defaults(latency="lognormal:0.15:0.6", error_rate=0.1, retry_after=0.2,
+                        hang_rate=0.02, hang_seconds=3.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    import llm
+    import resilience
+
+    resilience.HEDGE_MIN_SECONDS = 0.0
+    resilience.BACKOFF_BASE = 0.1
+    resilience.breaker.threshold = 0  # keep the breaker out of the first scenarios
+
+    print(f"fake upstream: latency={args.latency} errors={args.error_rate} ({args.error_statuses}) "
+          f"hangs={args.hang_rate}x{args.hang_seconds}s timeout={args.timeout}s")
+    print(f"{'scenario':<12} {'ok %':>6} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'upstream':>9}")
+    rows: List[str] = []
+    for name, settings in SCENARIOS:
+        server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+        os.environ["OPENAI_BASE_URL"] = base_url
+        llm.reset_clients()
+        for attr, value in settings.items():
+            setattr(resilience, attr, value)
+        if settings["HEDGE"]:
+            # Warm the latency window so the p95 threshold is known
+            run_batch(resilience.HEDGE_MIN_SAMPLES, args.workers, args.timeout)
+        before = upstream_calls(base_url)
+        r = run_batch(args.calls, args.workers, args.timeout)
+        sent = upstream_calls(base_url) - before
+        server.shutdown()
+        rows.append(f"{name:<12} {r['ok_pct']:>6.1f} {r['p50']:>7.3f} {r['p95']:>7.3f} "
+                    f"{r['p99']:>7.3f} {sent:>9}")
+        print(rows[-1])
+
+    # Upstream down: every call is a 500. Compare time-to-failure with and without the breaker.
+    down = fake_openai.FakeConfig(error_rate=1.0, error_statuses="500")
+    server, base_url = fake_openai.start_server(down)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    llm.reset_clients()
+    resilience.HEDGE = False
+    for label, threshold in (("down", 0), ("down+breaker", 5)):
+        resilience.breaker = resilience.CircuitBreaker(threshold=threshold, cooldown=30)
+        before = upstream_calls(base_url)
+        t0 = time.perf_counter()
+        run_batch(50, 1, args.timeout)
+        elapsed = time.perf_counter() - t0
+        print(f"{label:<12} 50 calls failed in {elapsed:.2f}s, "
+              f"{upstream_calls(base_url) - before} reached the upstream")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
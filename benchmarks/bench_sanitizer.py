@@ -0,0 +1,140 @@
+"""
+Equivalence check and microbenchmark for the incremental story sanitizer.
+
+    python benchmarks/bench_sanitizer.py
+    python benchmarks/bench_sanitizer.py --cases 5000 --seed 7
+
+Builds a corpus of messy model outputs (markdown, 'Title:' labels, CRLF,
+stray whitespace, odd '*'/'_' runs, unicode line separators), checks that
+StorySanitizer gives exactly the same result as the previous whole-string
+implementation for every case under several chunkings, then times both.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from typing import Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sanitize import StorySanitizer, sanitize_story_text  # noqa: E402
+
+
+def legacy_sanitize(text: str) -> str:
+    """The original pipeline._sanitize_story_text, kept as the reference."""
+    if not text:
+        return text
+    text = text.replace("**", "").replace("__", "").replace("`", "")
+    lines = [ln.rstrip() for ln in text.strip().splitlines()]
+    first_idx = next((i for i, ln in enumerate(lines) if ln.strip()), None)
+    if first_idx is not None:
+        first = lines[first_idx].strip()
+        first = re.sub(r'^\s*#+\s*', '', first)
+        first = re.sub(r'^\s*title\s*[:\-]\s*', '', first, flags=re.I)
+        first = re.sub(r'^\s*title\s*$', '', first, flags=re.I)
+        first = first.strip(" *:_-")
+        lines[first_idx] = first
+    lines = [re.sub(r'^\s*#+\s*', '', ln) for ln in lines]
+    return "\n".join(lines).strip()
+
+
+WORDS = ("Pip", "the", "hedgehog", "watched", "stars", "softly", "and", "sleepy", "meadow",
+         "\"Goodnight,\"", "said", "Wren.", "moon", "glow", "cozy")
+TITLES = ("Title: The Sleepy Meadow", "**Title:** Pip's Night", "# Pip and the Moon",
+          "## Title - Stars", "TITLE", "  title:  Wren Sings  ", "*The Quiet Pond*",
+          "__Grandma Moss__", "`Fireflies`", "# ## # Heading", "Pip's Lullaby:")
+BREAKS = ("\n", "\n\n", "\r\n", "\r\n\r\n", "\r", "\n \n", "\n\t\n", " ", "\x0c", "\n\x85")
+NOISE = ("**", "__", "`", "*", "_", "***", "_**_", "*_*", "  ", "\t", "#", " # ", "\x1f")
+
+
+def messy_story(rng: random.Random) -> str:
+    parts: List[str] = []
+    if rng.random() < 0.3:
+        parts.append(rng.choice(["", " ", "\n", "\n\n  \n", "\r\n", "\t "]))
+    parts.append(rng.choice(TITLES))
+    for _ in range(rng.randint(0, 6)):
+        parts.append(rng.choice(BREAKS))
+        if rng.random() < 0.2:
+            parts.append(rng.choice(["# ", "## ", "  #", "#", " ", "   # # "]))
+        words = []
+        for _ in range(rng.randint(0, 40)):
+            word = rng.choice(WORDS)
+            if rng.random() < 0.15:
+                word = rng.choice(NOISE) + word + rng.choice(NOISE)
+            words.append(word)
+        parts.append(" ".join(words))
+        if rng.random() < 0.3:
+            parts.append(rng.choice(NOISE + (" ", "   ", "\t")))
+    if rng.random() < 0.3:
+        parts.append(rng.choice(["\n", "  \n\n", "\r", "**", "*", "__", " `"]))
+    return "".join(parts)
+
+
+def chunkings(text: str, rng: random.Random):
+    yield [text]
+    yield list(text)
+    sizes, i = [], 0
+    while i < len(text):
+        n = rng.randint(1, 12)
+        sizes.append(text[i:i + n])
+        i += n
+    yield sizes
+    # Token-like: split after spaces, like streamed deltas
+    yield re.findall(r"\S*\s*", text)
+
+
+def run_stream(chunks: List[str]) -> str:
+    sanitizer = StorySanitizer()
+    return "".join(sanitizer.feed(c) for c in chunks) + sanitizer.finish()
+
+
+def timeit(fn: Callable[[], object], repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check and time the incremental story sanitizer.")
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [messy_story(rng) for _ in range(args.cases)]
+    mismatches = 0
+    for text in corpus:
+        expected = legacy_sanitize(text)
+        if sanitize_story_text(text) != expected:
+            mismatches += 1
+            continue
+        for chunks in chunkings(text, rng):
+            if run_stream(chunks) != expected:
+                mismatches += 1
+                print("MISMATCH", repr(text), [len(c) for c in chunks][:10])
+                break
+    print(f"equivalence: {args.cases - mismatches}/{args.cases} cases identical under 4 chunkings")
+
+    # A realistic ~550-word story streamed as ~4-character deltas
+    story = "**Title:** Pip and the Sleepy Meadow\n\n" + "\n\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(90)) for _ in range(6))
+    deltas = [story[i:i + 4] for i in range(0, len(story), 4)]
+    whole_legacy = timeit(lambda: legacy_sanitize(story), args.repeat)
+    whole_new = timeit(lambda: sanitize_story_text(story), args.repeat)
+    streamed = timeit(lambda: run_stream(deltas), args.repeat)
+    rejoin = timeit(lambda: legacy_sanitize("".join(deltas[:len(deltas) // 2])), args.repeat)
+    print(f"whole story ({len(story)} chars): legacy {whole_legacy * 1e6:.0f} us, "
+          f"incremental one-shot {whole_new * 1e6:.0f} us")
+    print(f"streamed as {len(deltas)} deltas: {streamed * 1e6:.0f} us total, "
+          f"{streamed / len(deltas) * 1e6:.2f} us per chunk")
+    print(f"re-sanitizing the joined text per delta instead: ~{rejoin * 1e6:.0f} us per chunk")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Sync (gunicorn + Flask) against async (uvicorn + Quart) serving under load.
+
+    python benchmarks/bench_serving.py
+    python benchmarks/bench_serving.py --clients 200 --sync-workers 8 --latency const:2
+
+Starts the fake server in-process, then each deployment as a subprocess
+pointed at it, and opens `--clients` concurrent /generate/stream requests
+(the path that keeps a request open for the whole story). Reports streams
+finished, wall time, time-to-first-token and total latency p50/p95, and
+the server processes' resident memory.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def _rss_mb(pid: int) -> float:
+    """Resident memory of a process and its children (Linux /proc)."""
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if int(entry) != pid and ppid != pid:
+                continue
+            with open(f"/proc/{entry}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        except (OSError, StopIteration, ValueError):
+            continue
+    return total / 1024
+
+
+async def _stream(client: httpx.AsyncClient, i: int, timeout: float) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("GET", "/generate/stream", params={"prompt": f"a story about creature {i}"},
+                                 timeout=timeout) as resp:
+            async for line in resp.aiter_lines():
+                if first is None and line == "event: token":
+                    first = time.perf_counter() - t0
+                if line.startswith("event: done"):
+                    return {"ok": 1, "first": first or 0.0, "total": time.perf_counter() - t0}
+                if line.startswith("event: failed"):
+                    break
+    except httpx.HTTPError:
+        pass
+    return {"ok": 0, "first": 0.0, "total": time.perf_counter() - t0}
+
+
+async def _load(url: str, clients: int, timeout: float, pid: int) -> None:
+    limits = httpx.Limits(max_connections=clients + 10)
+    async with httpx.AsyncClient(base_url=url, limits=limits) as client:
+        peak = 0.0
+
+        async def watch():
+            nonlocal peak
+            while True:
+                peak = max(peak, _rss_mb(pid))
+                await asyncio.sleep(0.5)
+
+        watcher = asyncio.create_task(watch())
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(_stream(client, i, timeout) for i in range(clients)))
+        wall = time.perf_counter() - t0
+        watcher.cancel()
+    done = [r for r in results if r["ok"]]
+    first = [r["first"] for r in done]
+    total = [r["total"] for r in done]
+    print(f"  {len(done)}/{clients} streams in {wall:.1f}s ({len(done) / wall:.1f}/s), "
+          f"first token p50 {_pct(first, 50):.2f}s p95 {_pct(first, 95):.2f}s, "
+          f"total p50 {_pct(total, 50):.2f}s p95 {_pct(total, 95):.2f}s, peak RSS {peak:.0f} MB")
+
+
+def _serve(cmd: List[str], env: Dict[str, str], port: int) -> subprocess.Popen:
+    proc = subprocess.Popen(cmd, cwd=tempfile.mkdtemp(), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server on port {port} did not start: {' '.join(cmd)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare sync and async serving under concurrent streams.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--clients", type=int, default=100, help="concurrent /generate/stream requests")
+    parser.add_argument("--sync-workers", type=int, default=4, help="gunicorn sync workers")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-stream client timeout")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.set_defaults(latency="const:1.0", tokens_per_sec=400.0)
+    args = parser.parse_args()
+
+    server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="fake", PYTHONPATH=ROOT,
+               LLM_CACHE_STAGES="", REQUEST_INDEX="0", STORY_POOL="0",
+               LLM_MAX_IN_FLIGHT=str(args.clients * 2), LLM_MAX_CONNECTIONS=str(args.clients * 2))
+    url = f"http://127.0.0.1:{args.port}"
+    deployments = [
+        (f"sync: gunicorn, {args.sync_workers} workers",
+         ["gunicorn", "webapp:app", "-w", str(args.sync_workers), "--timeout", "120",
+          "-b", f"127.0.0.1:{args.port}"]),
+        ("async: uvicorn, 1 process",
+         ["uvicorn", "asgi:app", "--app-dir", ROOT, "--port", str(args.port), "--log-level", "warning"]),
+    ]
+    for label, cmd in deployments:
+        proc = _serve(cmd, env, args.port)
+        try:
+            print(label)
+            asyncio.run(_load(url, args.clients, args.timeout, proc.pid))
+        finally:
+            proc.terminate()
+            proc.wait()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Speculative prefetch: click latency, hit rate and wasted tokens.
+
+    python benchmarks/bench_speculative.py
+    python benchmarks/bench_speculative.py --users 8 --think 20 --tweak-rate 0.3 --latency lognormal:1:0.4
+
+Starts the fake server in-process, then runs the Flask app (in a scratch
+directory) once with SPECULATE=0 and once with SPECULATE=1. Simulated
+readers start a multi-arc story, read each chapter for `--think` seconds,
+then click next or end_next; with `--tweak-rate` they type a free-text
+tweak first, which no guess can match. Reports the time from click to the
+new chapter on the page (p50/p95), the hit rate, and the speculative
+tokens used by a click or wasted, plus LLM calls from the fake server.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def _wait_for_state(client, timeout: float = 300.0):
+    """Follow a click until the page shows its result: at once, or after its job."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with client.session_transaction() as sess:
+            job = sess.get("job")
+        if not job:
+            return True
+        status = client.get(f"/jobs/{job['id']}").get_json()["status"]
+        if status in ("done", "failed", "missing"):
+            client.post(f"/jobs/{job['id']}/finish")
+            return status == "done"
+        time.sleep(0.2)
+    return False
+
+
+def worker(env: Dict[str, str], args, out) -> None:
+    os.environ.update(env)
+    os.chdir(tempfile.mkdtemp())
+    import speculative
+    import webapp
+
+    clicks: List[float] = []
+    lock = threading.Lock()
+
+    def reader(i: int) -> None:
+        rng = random.Random(i)
+        client = webapp.app.test_client()
+        resp = client.post("/generate", data={"prompt": f"a story about a sleepy owl number {i}", "mode": "arc"})
+        if not _wait_for_state(client):
+            return
+        for chapter in range(args.chapters):
+            time.sleep(args.think)
+            if rng.random() < args.tweak_rate:
+                resp = client.post("/tweak", data={"tweak": "give the owl a tiny lantern"})
+                _wait_for_state(client)
+            final = chapter == args.chapters - 1
+            t0 = time.perf_counter()
+            resp = client.post("/arc/end_next" if final else "/arc/next")
+            ok = _wait_for_state(client)
+            with lock:
+                if ok:
+                    clicks.append(time.perf_counter() - t0)
+        client.post("/arc/end_now")
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    time.sleep(1.0)  # let cancelled guesses settle into the ledger
+    out.put({"clicks": clicks, "speculative": speculative.stats() if speculative.SPECULATE_ENABLED else None})
+
+
+def run(label: str, base_url: str, args, enabled: bool) -> None:
+    env = {
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "fake",
+        "LLM_CACHE_STAGES": "",
+        "REQUEST_INDEX": "0",
+        "STORY_POOL": "0",
+        "SPECULATE": "1" if enabled else "0",
+        "SPECULATE_WORKERS": str(args.speculate_workers),
+        "JOB_WORKERS": str(args.users),
+    }
+    stats_url = base_url.rsplit("/v1", 1)[0] + "/stats"
+    before = sum(json.load(urllib.request.urlopen(stats_url))["calls"].values())
+    out = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=worker, args=(env, args, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    calls = sum(json.load(urllib.request.urlopen(stats_url))["calls"].values()) - before
+
+    clicks = result["clicks"]
+    print(f"{label}: {len(clicks)} clicks, click-to-chapter p50 {_pct(clicks, 50):.2f}s "
+          f"p95 {_pct(clicks, 95):.2f}s, {calls} LLM calls")
+    st = result["speculative"]
+    if st:
+        print(f"  hit rate {st['hit_rate']:.0%} ({st['hits']} ready, {st['joined']} joined, {st['misses']} missed), "
+              f"speculative tokens used {st['tokens_used']}, wasted {st['tokens_wasted']} "
+              f"({st['waste_ratio']:.0%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark speculative prefetch of arc chapters.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--users", type=int, default=4, help="concurrent readers")
+    parser.add_argument("--chapters", type=int, default=3, help="clicks per reader (the last is end_next)")
+    parser.add_argument("--think", type=float, default=10.0, help="seconds spent reading each chapter")
+    parser.add_argument("--tweak-rate", type=float, default=0.0, help="chance of a free-text tweak before a click")
+    parser.add_argument("--speculate-workers", type=int, default=4)
+    parser.set_defaults(latency="const:0.5", tokens_per_sec=200.0)
+    args = parser.parse_args()
+
+    server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+    run("speculation off", base_url, args, enabled=False)
+    run("speculation on ", base_url, args, enabled=True)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Per-chapter prompt size: full STORY SO FAR vs rolling story memory.
+
+    python benchmarks/bench_story_memory.py                     # offline, synthetic chapters
+    python benchmarks/bench_story_memory.py --fake --budget 90  # offline arc, fake server
+    python benchmarks/bench_story_memory.py --live -n 6         # real arc (needs OPENAI_API_KEY)
+
+The default mode measures only prompt size. --fake and --live write the same
+arc both ways and also report judge scores per chapter. With --fake the fake
+server runs with --story-facts: each chapter finds a keepsake and calls back
+to earlier ones still in its prompt. The judge's consistency score is the
+share of callbacks made, so a memory budget too small to keep them shows.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache  # noqa: E402
+import fake_openai  # noqa: E402
+import llm  # noqa: E402
+from llm import estimate_tokens  # noqa: E402
+import pipeline  # noqa: E402
+
+BRIEF = {
+    "title_hint": "Pip and the Lantern Seeds",
+    "category": "adventure",
+    "setting": "a quiet meadow village",
+    "characters": ["Pip, a small hedgehog", "Wren, a kind wren", "Grandma Moss"],
+    "moral": "patience",
+    "tone": "gentle and soothing",
+    "length_words": 350,
+    "avoid_topics": ["adult themes", "bullying", "darkness", "fear", "violence", "weapons"],
+    "age_range": "5-10",
+}
+
+
+def _chapter_prompt_tokens(chapters, memory):
+    if memory is None:
+        story_so_far = pipeline._concat_chapters(chapters)
+    else:
+        story_so_far = pipeline._memory_context(memory, chapters[-1] if chapters else "")
+    messages = pipeline._chapter_messages(BRIEF, story_so_far, end_now=False)
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def _synthetic_chapter(i):
+    sentence = f"In chapter {i}, Pip and Wren walked slowly past the soft hills and counted the glowing seeds. "
+    return f"Chapter {i}\n\n" + sentence * 22
+
+
+def _synthetic_memory(chapters, budget):
+    memory = pipeline.empty_memory()
+    memory["characters"] = [{"name": "Pip", "traits": "small, curious hedgehog"},
+                            {"name": "Wren", "traits": "kind, patient bird"}]
+    memory["setting"] = BRIEF["setting"]
+    memory["open_threads"] = ["plant the lantern seeds before the festival"]
+    memory["summary"] = " ".join(
+        f"In chapter {i + 1}, Pip and Wren kept looking for lantern seeds." for i in range(len(chapters)))
+    memory = pipeline._fit_memory(memory, budget)
+    memory["chapters_folded"] = len(chapters)
+    return memory
+
+
+def run_offline(n, budget):
+    print(f"{'chapter':>7} {'full prompt':>12} {'memory prompt':>14}")
+    chapters = []
+    for i in range(1, n + 1):
+        memory = _synthetic_memory(chapters[:-1], budget)
+        full = _chapter_prompt_tokens(chapters, None)
+        rolling = _chapter_prompt_tokens(chapters, memory)
+        print(f"{i:>7} {full:>12} {rolling:>14}")
+        chapters.append(_synthetic_chapter(i))
+
+
+def _live_arc(n, use_memory, budget):
+    chapters, rows = [], []
+    memory = pipeline.empty_memory() if use_memory else None
+    for i in range(1, n + 1):
+        if use_memory:
+            for ch in chapters[memory["chapters_folded"]:-1]:
+                memory = pipeline.update_story_memory(memory, ch, budget_tokens=budget)
+        prompt_tokens = _chapter_prompt_tokens(chapters, memory)
+        t0 = time.perf_counter()
+        chapter, verdict = pipeline.generate_next_chapter(
+            BRIEF, chapters, end_now=(i == n), memory=memory)
+        scores = verdict.get("scores", {})
+        rows.append({"chapter": i, "prompt_tokens": prompt_tokens,
+                     "seconds": round(time.perf_counter() - t0, 2),
+                     "average": scores.get("average"),
+                     "consistency": scores.get("consistency"),
+                     "clarity": scores.get("clarity"),
+                     "requirements": scores.get("requirements_satisfaction")})
+        chapters.append(chapter)
+    return rows
+
+
+def run_live(n, budget):
+    for label, use_memory in (("full story so far", False), ("rolling memory", True)):
+        print(f"\n== {label} ==")
+        print(f"{'chapter':>7} {'prompt tok':>10} {'secs':>6} {'avg':>5} {'consist':>7} {'clarity':>7} {'reqs':>5}")
+        rows = _live_arc(n, use_memory, budget)
+        for r in rows:
+            print(f"{r['chapter']:>7} {r['prompt_tokens']:>10} {r['seconds']:>6} {str(r['average']):>5} "
+                  f"{str(r['consistency'] if r['consistency'] is not None else '-'):>7} "
+                  f"{str(r['clarity']):>7} {str(r['requirements']):>5}")
+        consistency = [r["consistency"] for r in rows if r["consistency"] is not None]
+        if consistency:
+            print(f"mean consistency {sum(consistency) / len(consistency):.2f}")
+
+
+def run_fake(args):
+    config = fake_openai.config_from_args(args)
+    config.story_facts = True
+    server, base_url = fake_openai.start_server(config)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    llm.reset_clients()
+    cache.CACHE_STAGES = set()  # identical chapters in the two runs must both reach the judge
+    run_live(args.chapters, args.budget)
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--chapters", type=int, default=8)
+    parser.add_argument("--budget", type=int, default=pipeline.MEMORY_TOKEN_BUDGET,
+                        help="story memory token budget")
+    parser.add_argument("--live", action="store_true",
+                        help="call the model (OPENAI_API_KEY / OPENAI_BASE_URL)")
+    parser.add_argument("--fake", action="store_true",
+                        help="write the arc against the in-process fake server (see fake_openai.py flags)")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+    if args.fake:
+        run_fake(args)
+    elif args.live:
+        run_live(args.chapters, args.budget)
+    else:
+        run_offline(args.chapters, args.budget)
+
+
+if __name__ == "__main__":
+    main()
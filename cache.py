@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Local store shared by every worker process on the machine
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Stages that read/write the cache. Low-temperature stages repeat exactly;
+# high-temperature storytelling is off by default so users still get variety.
+CACHE_STAGES = {
+    s.strip() for s in os.getenv("LLM_CACHE_STAGES", "classifier,judge").split(",")
+    if s.strip()
+}
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float) -> str:
+    """Stable content hash of everything that determines the completion."""
+    payload = json.dumps(
+        {"model": model, "messages": messages,
+            "max_tokens": max_tokens, "temperature": temperature},
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache with TTL expiry and LRU eviction bounded by
+    entry count and total bytes. WAL mode + busy timeout make it safe to
+    share between gunicorn workers; each thread gets its own connection.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn().execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            if row is not None:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count(hit=False)
+            return None
+        conn.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value.encode("utf-8")), now + self.ttl, now),
+        )
+        self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+        count, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # Drop least recently used rows until both bounds hold
+        over = 0
+        for size, in conn.execute("SELECT size FROM responses ORDER BY last_used"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            count -= 1
+            total -= size
+            over += 1
+        conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (over,))
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        count, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+# One cache per process (connections are per thread inside it)
+_cache = None
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
+
+
+def enabled_for(stage: str) -> bool:
+    return stage in CACHE_STAGES
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters for this process plus current store size."""
+    return get_cache().stats()
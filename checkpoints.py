@@ -0,0 +1,189 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+# Stage results of a run (job id, batch request id) are stored under its run
+# id; running it again with the same id replays them instead of calling the LLM
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS", "1") != "0"
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", ".cache/checkpoints.sqlite3")
+CHECKPOINT_RETENTION = float(os.getenv("CHECKPOINT_RETENTION", str(24 * 3600)))
+
+# Current run: {"id": run id, "seen": {step prefix: calls so far}}
+_run: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("checkpoint_run", default=None)
+# Branch of the run a concurrent task is in (see branch())
+_branch: contextvars.ContextVar[str] = contextvars.ContextVar("checkpoint_branch", default="")
+
+
+class CheckpointStore:
+    """
+    SQLite table of (run id, step) -> JSON result, shared by every worker on
+    the machine. Runs older than the retention are dropped on startup.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH, retention: float = CHECKPOINT_RETENTION):
+        self.path = path
+        self.retention = retention
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                run_id TEXT NOT NULL,
+                step TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (run_id, step)
+            )""")
+        conn.execute("DELETE FROM checkpoints WHERE created_at < ?", (time.time() - retention,))
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, run_id: str, step: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value FROM checkpoints WHERE run_id = ? AND step = ?", (run_id, step)).fetchone()
+        return row[0] if row else None
+
+    def put(self, run_id: str, step: str, value: str) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO checkpoints (run_id, step, value, created_at) VALUES (?, ?, ?, ?)",
+            (run_id, step, value, time.time()))
+
+    def steps(self, run_id: str) -> List[str]:
+        return [r[0] for r in self._conn().execute(
+            "SELECT step FROM checkpoints WHERE run_id = ? ORDER BY created_at", (run_id,))]
+
+    def delete(self, run_id: str) -> None:
+        self._conn().execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+
+
+# One store per process (connections are per thread inside it)
+_store = None
+
+
+def get_store() -> CheckpointStore:
+    global _store
+    if _store is None:
+        _store = CheckpointStore()
+    return _store
+
+
+# -------------------- Runs --------------------
+
+@contextlib.contextmanager
+def run(run_id: Optional[str]):
+    """
+    Checkpoint every stage called inside the block under `run_id`. Without
+    a run id (or with CHECKPOINTS=0) stages run normally. Nested runs reuse
+    the outer one.
+    """
+    if not run_id or not CHECKPOINTS_ENABLED or _run.get() is not None:
+        yield _run.get()
+        return
+    current = {"id": str(run_id), "seen": {}}
+    token = _run.set(current)
+    try:
+        yield current
+    finally:
+        _run.reset(token)
+
+
+@contextlib.contextmanager
+def branch(name: str):
+    """
+    Name the stages called inside the block as one of several concurrent
+    tasks (a candidate draft, a chapter written alongside others). Identical
+    calls in different branches then replay into the branch that made them,
+    however the tasks interleave.
+    """
+    token = _branch.set(f"{_branch.get()}/{name}")
+    try:
+        yield
+    finally:
+        _branch.reset(token)
+
+
+def clear(run_id: str) -> None:
+    """Drop a run's checkpoints (after it finished)."""
+    if CHECKPOINTS_ENABLED:
+        get_store().delete(str(run_id))
+
+
+def _step_key(current: Dict[str, Any], name: str, args: Tuple, kwargs: Dict[str, Any]) -> str:
+    # Same stage with the same inputs in the same branch -> same key; the
+    # counter tells identical calls in one branch apart
+    digest = hashlib.sha1(json.dumps([args, kwargs], sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    prefix = f"{name}:{digest}{_branch.get()}"
+    seen = current["seen"]
+    seen[prefix] = seen.get(prefix, 0) + 1
+    return f"{prefix}#{seen[prefix]}"
+
+
+def _load(current: Dict[str, Any], key: str) -> Tuple[bool, Any]:
+    raw = get_store().get(current["id"], key)
+    if raw is None:
+        return False, None
+    stored = json.loads(raw)
+    metrics.incr("checkpoint_steps_total", result="replayed")
+    value = stored["value"]
+    return True, tuple(value) if stored.get("tuple") else value
+
+
+def _save(current: Dict[str, Any], key: str, value: Any) -> None:
+    get_store().put(current["id"], key, json.dumps({"value": value, "tuple": isinstance(value, tuple)}))
+    metrics.incr("checkpoint_steps_total", result="recorded")
+
+
+def stage(name: str) -> Callable:
+    """
+    Decorator for a pipeline stage (sync or async) whose result is JSON
+    data: inside run() the result is stored, and replayed when the run is
+    invoked again with the same inputs.
+    """
+    def decorate(fn: Callable) -> Callable:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                current = _run.get()
+                if current is None:
+                    return await fn(*args, **kwargs)
+                key = _step_key(current, name, args, kwargs)
+                # SQLite reads/writes run in a thread so the event loop never waits on them
+                found, value = await asyncio.to_thread(_load, current, key)
+                if not found:
+                    value = await fn(*args, **kwargs)
+                    await asyncio.to_thread(_save, current, key, value)
+                return value
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            current = _run.get()
+            if current is None:
+                return fn(*args, **kwargs)
+            key = _step_key(current, name, args, kwargs)
+            found, value = _load(current, key)
+            if not found:
+                value = fn(*args, **kwargs)
+                _save(current, key, value)
+            return value
+        return wrapper
+    return decorate
@@ -0,0 +1,297 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
+
+# Near-duplicate request index: maps a new prompt to the brief (and optionally
+# the passing story) of an earlier prompt with nearly the same content words
+INDEX_ENABLED = os.getenv("REQUEST_INDEX", "1") != "0"
+INDEX_PATH = os.getenv("REQUEST_INDEX_PATH", ".cache/request_index.sqlite3")
+INDEX_THRESHOLD = float(os.getenv("REQUEST_INDEX_THRESHOLD", "0.8"))
+INDEX_MAX_ENTRIES = int(os.getenv("REQUEST_INDEX_MAX_ENTRIES", "20000"))
+INDEX_TTL = float(os.getenv("REQUEST_INDEX_TTL", str(30 * 24 * 3600)))
+# Serve a stored passing story as-is (off: only the classifier call is skipped)
+REUSE_STORIES = os.getenv("REQUEST_INDEX_STORIES", "0") == "1"
+
+# MinHash signature = BANDS x ROWS hashes; two requests become candidates when
+# any band matches. With 16x4 a pair at Jaccard 0.8 collides with p > 0.999,
+# one at 0.3 with p ~ 0.12. Candidates are then checked with exact Jaccard.
+BANDS = 16
+ROWS = 4
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # fixed: signatures must agree across processes
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(BANDS * ROWS)]
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+# Common words plus request boilerplate ("write a bedtime story about ...")
+_STOPWORDS = frozenset("""
+a an the and or but of to in on at for with without from by into onto over under about
+is are was were be been being am do does did has have had it its this that these those
+who whom which what when where why how there their they them he she his her him i me my
+we our you your us so very some any all just also really please can could would should
+will shall may might must let make makes made want wants like likes
+story stories tale tales bedtime write tell telling told kid kids child children little
+learn learns learning learned lesson lessons
+""".split())
+
+# Background producers (batch.py, the pool filler) read the index but don't
+# add their synthetic requests to it (see read_only)
+_read_only = contextvars.ContextVar("request_index_read_only", default=False)
+
+
+@contextlib.contextmanager
+def read_only():
+    """Requests handled inside the block may use the index but aren't remembered."""
+    token = _read_only.set(True)
+    try:
+        yield
+    finally:
+        _read_only.reset(token)
+
+
+def remembering() -> bool:
+    return not _read_only.get()
+
+
+# -------------------- Normalization --------------------
+
+def _stem(word: str) -> str:
+    """Crude suffix stripping so 'shares', 'sharing' and 'share' agree."""
+    if word.endswith("'s"):
+        word = word[:-2]
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 5 and word.endswith("ing"):
+        word = word[:-3]
+    elif len(word) > 4 and word.endswith("ed"):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    if len(word) > 3 and word[-1] == word[-2]:
+        word = word[:-1]
+    return word
+
+
+def features(text: str) -> FrozenSet[str]:
+    """Stemmed content words of a request."""
+    words = _WORD_RE.findall((text or "").lower())
+    return frozenset(_stem(w) for w in words if w not in _STOPWORDS and len(w) > 1)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _hash(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def buckets(feats: FrozenSet[str]) -> List[str]:
+    """LSH bucket ids ('band:hash') from the MinHash signature of `feats`."""
+    hashes = [_hash(f) for f in feats]
+    signature = [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+    return [
+        f"{band}:{hashlib.blake2b(repr(signature[band * ROWS:(band + 1) * ROWS]).encode(), digest_size=8).hexdigest()}"
+        for band in range(BANDS)
+    ]
+
+
+# -------------------- Index --------------------
+
+class RequestIndex:
+    """
+    SQLite-backed near-duplicate index shared by every worker on the machine.
+    Entries hold the normalized request, its brief and optionally a passing
+    story; LSH band buckets find candidates, exact Jaccard decides. Bounded
+    by entry count (LRU) and a TTL.
+    """
+
+    def __init__(self, path: str = INDEX_PATH, threshold: float = INDEX_THRESHOLD,
+                 max_entries: int = INDEX_MAX_ENTRIES, ttl: float = INDEX_TTL):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL,
+                features TEXT NOT NULL,
+                brief TEXT NOT NULL,
+                story TEXT,
+                history TEXT,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS requests_last_used ON requests (last_used)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS request_buckets (
+                bucket TEXT NOT NULL,
+                request_id INTEGER NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS request_buckets_bucket ON request_buckets (bucket)")
+        conn.execute("CREATE INDEX IF NOT EXISTS request_buckets_id ON request_buckets (request_id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, request: str) -> Optional[Dict[str, Any]]:
+        """
+        Closest stored request at or above the threshold, as {brief, story,
+        history, similarity}; story/history are None if no passing story is
+        stored. None on a miss.
+        """
+        feats = features(request)
+        if not feats:
+            self._count(hit=False)
+            return None
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT id, features, brief, story, history FROM requests "
+            "WHERE key = ? AND created_at >= ?", (_key(feats), now - self.ttl)).fetchone()
+        best, best_sim = (row, 1.0) if row else (None, 0.0)
+        if best is None:
+            keys = buckets(feats)
+            rows = conn.execute(
+                "SELECT id, features, brief, story, history FROM requests WHERE created_at >= ? AND id IN "
+                f"(SELECT request_id FROM request_buckets WHERE bucket IN ({','.join('?' * len(keys))}))",
+                [now - self.ttl] + keys).fetchall()
+            for row in rows:
+                sim = jaccard(feats, frozenset(json.loads(row[1])))
+                if sim >= self.threshold and sim > best_sim:
+                    best, best_sim = row, sim
+        if best is None:
+            self._count(hit=False)
+            return None
+        conn.execute("UPDATE requests SET hits = hits + 1, last_used = ? WHERE id = ?", (now, best[0]))
+        self._count(hit=True)
+        return {
+            "brief": json.loads(best[2]),
+            "story": best[3],
+            "history": json.loads(best[4]) if best[4] else None,
+            "similarity": round(best_sim, 3),
+        }
+
+    def remember(self, request: str, brief: Dict[str, Any], story: Optional[str] = None,
+                 history: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        Store the brief for `request`; with `story`, also the passing story
+        and its verdict history. An existing entry keeps its story unless a
+        new one is given.
+        """
+        feats = features(request)
+        if not feats:
+            return
+        now = time.time()
+        key = _key(feats)
+        conn = self._conn()
+        with self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT id FROM requests WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    cur = conn.execute(
+                        "INSERT INTO requests (key, features, brief, story, history, created_at, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (key, json.dumps(sorted(feats)), json.dumps(brief), story,
+                         json.dumps(history) if story else None, now, now))
+                    conn.executemany(
+                        "INSERT INTO request_buckets (bucket, request_id) VALUES (?, ?)",
+                        [(b, cur.lastrowid) for b in buckets(feats)])
+                elif story:
+                    conn.execute(
+                        "UPDATE requests SET brief = ?, story = ?, history = ?, created_at = ?, last_used = ? "
+                        "WHERE id = ?", (json.dumps(brief), story, json.dumps(history), now, now, row[0]))
+                else:
+                    conn.execute("UPDATE requests SET brief = ?, last_used = ? WHERE id = ?",
+                                 (json.dumps(brief), now, row[0]))
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        stale = [r[0] for r in conn.execute(
+            "SELECT id FROM requests WHERE created_at < ?", (now - self.ttl,))]
+        count = conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0] - len(stale)
+        if count > self.max_entries:
+            # Least recently used first
+            stale += [r[0] for r in conn.execute(
+                "SELECT id FROM requests WHERE created_at >= ? ORDER BY last_used LIMIT ?",
+                (now - self.ttl, count - self.max_entries))]
+        for i in range(0, len(stale), 500):
+            ids = stale[i:i + 500]
+            marks = ",".join("?" * len(ids))
+            conn.execute(f"DELETE FROM request_buckets WHERE request_id IN ({marks})", ids)
+            conn.execute(f"DELETE FROM requests WHERE id IN ({marks})", ids)
+
+    def clear(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM request_buckets")
+        conn.execute("DELETE FROM requests")
+
+    def stats(self) -> Dict[str, Any]:
+        count, stories = self._conn().execute(
+            "SELECT COUNT(*), COUNT(story) FROM requests").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": count,
+            "stories": stories,
+        }
+
+
+def _key(feats: FrozenSet[str]) -> str:
+    return " ".join(sorted(feats))
+
+
+# One index per process (connections are per thread inside it)
+_index = None
+
+
+def get_index() -> RequestIndex:
+    global _index
+    if _index is None:
+        _index = RequestIndex()
+    return _index
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters for this process plus current index size."""
+    return get_index().stats()
@@ -0,0 +1,536 @@
+"""
+Local stand-in for the OpenAI chat-completions API, for benchmarks and
+offline runs. Point the app at it with:
+
+    python fake_openai.py --port 8765 --latency uniform:0.3:1.2 --judge-script fail,pass
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake flask --app webapp run
+
+Responses are canned per pipeline stage (recognised from the system prompt):
+JSON briefs for the classifier, plain-text stories/chapters that pass the
+local pre-judge, and judge verdicts that follow a scripted pass/fail sequence.
+Latency, token rate, error injection, damaged JSON and account rate limits
+(RPM/TPM, answered with 429 + Retry-After) are configurable. --story-facts
+makes chapters carry facts forward and the judge score their consistency.
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+# System-prompt markers -> stage name
+ROLE_MARKERS = [
+    ("Story Brief Classifier", "classifier"),
+    ("Children's Literature Judge", "judge"),
+    ("Children's Story Editor", "editor"),
+    ("Children's Story Patch Editor", "editor_patch"),
+    ("Children's Story Judge-Editor", "judge_revise"),
+    ("Children's Chapter Storyteller", "chapter"),
+    ("Bedtime Storyteller", "storyteller"),
+    ("Story Memory Keeper", "memory"),
+    ("Story Outline Planner", "outline"),
+    ("Story Continuity Editor", "continuity"),
+]
+
+_SENTENCES = [
+    "Pip the little hedgehog liked to watch the stars come out.",
+    "Wren the kind bird sang a soft song from the apple tree.",
+    "The meadow was quiet and the grass smelled sweet.",
+    "\"Shall we count the fireflies?\" asked Pip.",
+    "\"Yes, let's count them slowly,\" said Wren.",
+    "They counted one, two, three, and then they lost count and laughed.",
+    "A gentle breeze rocked the flowers to sleep.",
+    "Grandma Moss brought warm milk and a cozy blanket.",
+    "Pip learned that waiting patiently made the night feel magic.",
+    "Everyone yawned a big, happy yawn.",
+]
+
+
+class FakeConfig:
+    """Knobs for the fake server (see the CLI flags for meaning)."""
+
+    def __init__(self, latency: str = "const:0", tokens_per_sec: float = 0.0,
+                 judge_script: str = "pass", error_rate: float = 0.0,
+                 error_statuses: str = "500", retry_after: float = 1.0,
+                 hang_rate: float = 0.0, hang_seconds: float = 30.0,
+                 bad_json_rate: float = 0.0, rpm_limit: float = 0.0, tpm_limit: float = 0.0,
+                 limit_burst: float = 10.0, story_facts: bool = False,
+                 story_words: int = 520, chapter_words: int = 330, seed: Optional[int] = None):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.judge_script = [s.strip() == "pass" for s in judge_script.split(",") if s.strip()]
+        self.error_rate = error_rate
+        self.error_statuses = [int(s) for s in error_statuses.split(",") if s.strip()]
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.bad_json_rate = bad_json_rate
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.limit_burst = limit_burst
+        self.story_facts = story_facts
+        self.story_words = story_words
+        self.chapter_words = chapter_words
+        self.rng = random.Random(seed)
+
+
+class FakeState:
+    """Mutable server state shared by handler threads."""
+
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self._judge_cycle = itertools.cycle(config.judge_script or [True])
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.rate_limited = 0
+        # Account quota: name -> [level, capacity, refill per second, last update]
+        self._quota: Dict[str, List[float]] = {}
+        for name, limit in (("requests", config.rpm_limit), ("tokens", config.tpm_limit)):
+            if limit > 0:
+                capacity = max(1.0, limit / 60 * config.limit_burst)
+                self._quota[name] = [capacity, capacity, limit / 60, time.monotonic()]
+
+    def next_judge_pass(self) -> bool:
+        with self.lock:
+            return next(self._judge_cycle)
+
+    def count(self, stage: str) -> None:
+        with self.lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def sample_latency(self) -> float:
+        kind, *params = self.config.latency.split(":")
+        p = [float(x) for x in params]
+        with self.lock:
+            rng = self.config.rng
+            if kind == "uniform":
+                return rng.uniform(p[0], p[1])
+            if kind == "lognormal":
+                # params: median seconds, sigma
+                return p[0] * math.exp(rng.gauss(0, p[1]))
+            if kind == "exp":
+                return rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+            return p[0] if p else 0.0
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.config.rng.random() < rate
+
+    def pick_status(self) -> int:
+        with self.lock:
+            return self.config.rng.choice(self.config.error_statuses or [500])
+
+    def spend_quota(self, tokens: float) -> float:
+        """Charge a request against the account quota; seconds to wait if it's over (0 = ok)."""
+        cost = {"requests": 1.0, "tokens": tokens}
+        with self.lock:
+            now = time.monotonic()
+            wait = 0.0
+            for name, bucket in self._quota.items():
+                bucket[0] = min(bucket[1], bucket[0] + (now - bucket[3]) * bucket[2])
+                bucket[3] = now
+                need = min(cost[name], bucket[1])
+                if bucket[0] < need:
+                    wait = max(wait, (need - bucket[0]) / bucket[2])
+            if wait:
+                self.rate_limited += 1
+                return wait
+            for name, bucket in self._quota.items():
+                bucket[0] -= min(cost[name], bucket[1])
+            return 0.0
+
+    def pick(self, options: List[Any]) -> Any:
+        with self.lock:
+            return self.config.rng.choice(options)
+
+
+# -------------------- Canned content --------------------
+
+def _stage_of(messages: List[Dict[str, Any]]) -> str:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    for marker, stage in ROLE_MARKERS:
+        if marker in system:
+            return stage
+    return "other"
+
+
+def _prose(words: int, title: str) -> str:
+    paragraphs, current, count = [], [], 0
+    for sentence in itertools.cycle(_SENTENCES):
+        current.append(sentence)
+        count += len(sentence.split())
+        if len(current) == 4:
+            paragraphs.append(" ".join(current))
+            current = []
+        if count >= words:
+            break
+    if current:
+        paragraphs.append(" ".join(current))
+    return title + "\n\n" + "\n\n".join(paragraphs)
+
+
+def _brief() -> Dict[str, Any]:
+    return {
+        "title_hint": "Pip and the Fireflies",
+        "category": "bedtime-calm",
+        "setting": "a quiet meadow",
+        "characters": ["Pip, a small hedgehog", "Wren, a kind bird"],
+        "moral": "patience",
+        "tone": "gentle and soothing",
+        "length_words": 520,
+        "avoid_topics": ["violence", "fear"],
+        "age_range": "5-10",
+    }
+
+
+def _verdict(passed: bool) -> Dict[str, Any]:
+    score = 9 if passed else 7
+    keys = ["age_fit", "tone", "structure", "clarity", "safety",
+            "bedtime_suitability", "requirements_satisfaction"]
+    return {
+        "scores": dict({k: score for k in keys}, average=float(score)),
+        "pass": passed,
+        "issues": [] if passed else ["Ending could be calmer."],
+        "edit_instructions": "" if passed else "Slow the ending and add a reassuring final line.",
+    }
+
+
+def _memory() -> Dict[str, Any]:
+    return {
+        "summary": "Pip and Wren counted fireflies in the meadow and learned to wait patiently.",
+        "characters": [{"name": "Pip", "traits": "small, curious hedgehog"},
+                       {"name": "Wren", "traits": "kind bird"}],
+        "setting": "a quiet meadow",
+        "open_threads": ["find the brightest firefly"],
+    }
+
+
+def _outline(chapters: int) -> Dict[str, Any]:
+    return {
+        "title": "Pip and the Fireflies",
+        "characters": [{"name": "Pip", "traits": "small, curious hedgehog"},
+                       {"name": "Wren", "traits": "kind bird"}],
+        "setting": "a quiet meadow",
+        "chapters": [{"title": f"Chapter {i}: The Meadow at Dusk",
+                      "beats": ["Pip and Wren wait for the fireflies", "they count the lights one by one"],
+                      "ends_with": "the meadow grows a little darker"}
+                     for i in range(1, chapters + 1)],
+        "ending": "Pip falls asleep under the glowing grass.",
+    }
+
+
+def _continuity() -> Dict[str, Any]:
+    # One small naming fix in the second chapter
+    return {"edits": [{"chapter": 2, "ops": [{"op": "replace", "p": 1, "text": " ".join(_SENTENCES[:4])}]}]}
+
+
+def _patch() -> Dict[str, Any]:
+    # A one-paragraph tweak, the common case for user edits
+    return {"ops": [{"op": "replace", "p": 1, "text": " ".join(_SENTENCES[:4])}]}
+
+
+# -------------------- Story facts --------------------
+# With --story-facts chapter k finds keepsake k and calls back to keepsakes
+# k-2, k-4, ... when it can see them in its prompt. Chapter k-1, which the
+# story memory keeps verbatim, never names those, so they reach chapter k only
+# through the full story or the memory's open threads. The judge adds a
+# "consistency" score: the share of those callbacks the chapter made.
+
+STORY_FACTS = [
+    "a blue button", "a silver acorn", "a paper boat", "a striped pebble", "a bell-shaped flower",
+    "an owl feather", "a jar of honey", "a tiny lantern", "a round red berry", "a spool of green thread",
+    "a smooth white shell", "a star-shaped leaf",
+]
+
+
+def _facts_in(text: str) -> List[int]:
+    return [i for i, fact in enumerate(STORY_FACTS) if fact in text]
+
+
+def _user_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+
+
+def _with_facts(prose: str, messages: List[Dict[str, Any]], find_new: bool) -> str:
+    seen = _facts_in(_user_text(messages))
+    if find_new:
+        new = seen[-1] + 1 if seen else 0
+        recalled = [i for i in seen if (new - i) % 2 == 0]
+    else:  # the editor keeps the keepsakes of the chapter it revises
+        new, recalled = (seen[-1], seen[:-1]) if seen else (len(STORY_FACTS), [])
+    lines = [f"Pip still kept {STORY_FACTS[i]} from before." for i in recalled]
+    if new < len(STORY_FACTS):
+        lines.append(f"Wren found {STORY_FACTS[new]} by the path.")
+    return prose + ("\n\n" + " ".join(lines) if lines else "")
+
+
+def _consistency(messages: List[Dict[str, Any]]) -> int:
+    found = _facts_in(_user_text(messages))
+    expected = found[-1] // 2 if found else 0
+    return 10 if not expected else round(10 * (len(found) - 1) / expected)
+
+
+def _fact_memory(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    memory = _memory()
+    memory["summary"] = "Pip and Wren have been collecting small keepsakes in the meadow."
+    memory["open_threads"] = [f"keep {STORY_FACTS[i]} safe" for i in _facts_in(_user_text(messages))]
+    return memory
+
+
+def _chapter_count(messages: List[Dict[str, Any]]) -> int:
+    system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+    found = re.search(r"chapters: array of exactly (\d+)", system)
+    return int(found.group(1)) if found else 4
+
+
+def render(stage: str, state: FakeState, messages: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Response text for a stage."""
+    cfg = state.config
+    messages = messages or []
+    if stage == "classifier":
+        return json.dumps(_brief())
+    if stage == "judge":
+        verdict = _verdict(state.next_judge_pass())
+        if cfg.story_facts:
+            verdict["scores"]["consistency"] = _consistency(messages)
+        return json.dumps(verdict)
+    if stage == "memory":
+        return json.dumps(_fact_memory(messages) if cfg.story_facts else _memory())
+    if stage == "chapter":
+        chapter = _prose(cfg.chapter_words, "Pip Counts the Fireflies")
+        return _with_facts(chapter, messages, find_new=True) if cfg.story_facts else chapter
+    if stage == "judge_revise":
+        verdict = _verdict(state.next_judge_pass())
+        verdict["revised_story"] = "" if verdict["pass"] else _prose(cfg.story_words, "Pip and the Sleepy Meadow")
+        return json.dumps(verdict)
+    if stage == "editor_patch":
+        return json.dumps(_patch())
+    if stage == "outline":
+        return json.dumps(_outline(_chapter_count(messages)))
+    if stage == "continuity":
+        return json.dumps(_continuity())
+    if stage == "editor" and cfg.story_facts:
+        return _with_facts(_prose(cfg.chapter_words, "Pip Counts the Fireflies"), messages, find_new=False)
+    if stage in ("storyteller", "editor"):
+        return _prose(cfg.story_words, "Pip and the Sleepy Meadow")
+    return "OK"
+
+
+# Stages whose replies are JSON objects (targets of --bad-json-rate)
+JSON_STAGES = ("classifier", "judge", "judge_revise", "memory", "outline", "continuity")
+
+
+def corrupt_json(text: str, kind: str) -> str:
+    """Damage a JSON reply the way models do."""
+    if kind == "truncate":
+        return text[: max(1, int(len(text) * 0.6))]
+    if kind == "single_quotes":
+        return text.replace('"', "'")
+    if kind == "trailing_comma":
+        return text[:-1] + ",}"
+    if kind == "fenced":
+        return "Here is the JSON you asked for:\n```json\n" + text + "\n```"
+    # "prose": nothing to repair, the stage has to be asked again
+    return "Sure! The story looks lovely and gentle overall."
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+# -------------------- HTTP handler --------------------
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up (timeout or cancelled hedge)
+
+    @property
+    def state(self) -> FakeState:
+        return self.server.fake_state  # type: ignore[attr-defined]
+
+    def _json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.state.lock:
+                return self._json(200, {"calls": dict(self.state.calls), "errors": self.state.errors,
+                                        "rate_limited": self.state.rate_limited})
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+
+        state = self.state
+        cfg = state.config
+        messages = body.get("messages", [])
+        stage = _stage_of(messages)
+        state.count(stage)
+
+        # Quota is charged like the real API: prompt tokens + max_tokens
+        over = state.spend_quota(sum(_tokens(m.get("content") or "") for m in messages)
+                                 + int(body.get("max_tokens") or 0))
+        if over:
+            return self._json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                              {"Retry-After": f"{over:.3f}"})
+
+        if state.roll(cfg.hang_rate):
+            time.sleep(cfg.hang_seconds)
+        if state.roll(cfg.error_rate):
+            status = state.pick_status()
+            with state.lock:
+                state.errors += 1
+            headers = {"Retry-After": str(cfg.retry_after)} if status == 429 else {}
+            kind = "rate_limit_exceeded" if status == 429 else "server_error"
+            return self._json(status, {"error": {"message": f"injected {status}", "type": kind}}, headers)
+
+        text = render(stage, state, messages)
+        if stage in JSON_STAGES and state.roll(cfg.bad_json_rate):
+            text = corrupt_json(text, state.pick(["truncate", "single_quotes", "trailing_comma",
+                                                 "fenced", "prose"]))
+        max_tokens = int(body.get("max_tokens") or 0)
+        if max_tokens and _tokens(text) > max_tokens:
+            text = text[: max_tokens * 4]
+        prompt_tokens = sum(_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = _tokens(text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        time.sleep(state.sample_latency())
+        if body.get("stream"):
+            return self._stream(body, text, usage)
+        if cfg.tokens_per_sec > 0:
+            time.sleep(completion_tokens / cfg.tokens_per_sec)
+        self._json(200, {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": usage,
+        })
+
+    def _stream(self, body: Dict[str, Any], text: str, usage: Dict[str, int]) -> None:
+        cfg = self.state.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        cid = "chatcmpl-" + uuid.uuid4().hex
+        base = {"id": cid, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "gpt-3.5-turbo")}
+
+        def send(payload: Any) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload)
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        pieces = [p + " " for p in text.split(" ")]
+        pieces[-1] = pieces[-1][:-1]
+        for i, piece in enumerate(pieces):
+            delta = {"content": piece} if i else {"role": "assistant", "content": piece}
+            send(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            if cfg.tokens_per_sec > 0:
+                time.sleep(_tokens(piece) / cfg.tokens_per_sec)
+        send(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(dict(base, choices=[], usage=usage))
+        send("[DONE]")
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections when hundreds of calls open at once
+    request_queue_size = 1024
+
+
+def start_server(config: Optional[FakeConfig] = None, host: str = "127.0.0.1",
+                 port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the fake server on a background thread; returns (server, base_url)."""
+    server = FakeServer((host, port), Handler)
+    server.fake_state = FakeState(config or FakeConfig())  # type: ignore[attr-defined]
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Fake-server flags, shared with the benchmark/load-test scripts."""
+    parser.add_argument("--latency", default="const:0.05",
+                        help="time to first token: const:S | uniform:A:B | lognormal:MEDIAN:SIGMA | exp:MEAN")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0,
+                        help="completion token rate (0 = instant)")
+    parser.add_argument("--judge-script", default="pass",
+                        help="comma-separated pass/fail sequence the judge cycles through")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--error-statuses", default="500,429", help="statuses used for injected errors")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="fraction of calls that stall")
+    parser.add_argument("--hang-seconds", type=float, default=30.0)
+    parser.add_argument("--bad-json-rate", type=float, default=0.0,
+                        help="fraction of JSON-stage replies that come back damaged")
+    parser.add_argument("--rpm-limit", type=float, default=0.0, help="account requests/minute (429 above it)")
+    parser.add_argument("--tpm-limit", type=float, default=0.0,
+                        help="account tokens/minute, counting prompt + max_tokens (429 above it)")
+    parser.add_argument("--limit-burst", type=float, default=10.0,
+                        help="seconds of quota that may be used at once")
+    parser.add_argument("--story-facts", action="store_true",
+                        help="chapters carry keepsakes forward and the judge scores consistency")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                      judge_script=args.judge_script, error_rate=args.error_rate,
+                      error_statuses=args.error_statuses, retry_after=args.retry_after,
+                      hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+                      bad_json_rate=args.bad_json_rate, rpm_limit=args.rpm_limit,
+                      tpm_limit=args.tpm_limit, limit_burst=args.limit_burst,
+                      story_facts=args.story_facts, seed=args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, base_url = start_server(config_from_args(args), args.host, args.port)
+    print(f"Fake OpenAI listening on {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
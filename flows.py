@@ -0,0 +1,145 @@
+import os
+from typing import Dict, Any, Tuple
+
+from pipeline import (
+    generate_story, apply_tweak,
+    generate_arc_start, generate_next_chapter,
+    empty_memory, update_story_memory,
+    agenerate_story, aapply_tweak,
+    agenerate_arc_start, agenerate_next_chapter, aupdate_story_memory
+)
+
+# Send chapters a rolling summary + the last chapter instead of the whole story
+USE_STORY_MEMORY = os.getenv("STORY_MEMORY", "1") != "0"
+
+# Tweak shortcuts the page and the CLI suggest -> the instruction sent to the editor
+PRESET_TWEAKS = {
+    "shorter": "Reduce to ~450 words. Simplify sentences further.",
+    "calmer": "Lower stakes, slower cadence, extra reassurance in the last two paragraphs.",
+    "more-dialogue": "Add gentle dialogue between characters with simple tags.",
+    "new-moral": "Change the moral to 'kindness and sharing' clearly in the final line."
+}
+
+
+def preset_tweak(tweak_text: str) -> str:
+    """Expand a preset name ("shorter", "calmer", ...) into its instruction."""
+    return PRESET_TWEAKS.get(tweak_text.strip().lower(), tweak_text)
+
+# -------------------- Session-state transitions --------------------
+# Each flow takes the user's current `state` dict (as kept in the web session)
+# and returns the new one, so the web routes, the job workers and other
+# drivers all share the same story logic.
+
+
+def start_story(prompt: str, mode: str = "short") -> Dict[str, Any]:
+    if mode == "arc":
+        # Brief and Chapter 1 together: the chapter is drafted while the request is classified
+        start = generate_arc_start(prompt)
+        return _arc_state(prompt, start["brief"], start["chapter"], start["verdict"])
+
+    # Short story mode
+    return short_state(prompt, generate_story(prompt, max_rounds=2))
+
+
+def _arc_state(prompt: str, brief: Dict[str, Any], ch1: str, verdict1: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "mode": "arc",
+        "prompt": prompt,
+        "brief": brief,
+        "chapters": [ch1],
+        # final chapter already produced? (False initially)
+        "arc_ready_to_end": False,
+        "history": [{"round": "chapter-1", "verdict": verdict1}],
+    }
+
+
+def short_state(prompt: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    """Session state for a finished short story (generate_story result)."""
+    return {
+        "mode": "short",
+        "prompt": prompt,
+        "brief": result["brief"],
+        "story": result["story"],
+        "history": result["history"],
+        "passed": result.get("passed", False),
+    }
+
+
+def tweak_story(state: Dict[str, Any], tweak_text: str) -> Dict[str, Any]:
+    text, kind = _tweak_target(state)
+    new_text, new_verdict = apply_tweak(state["brief"], text, tweak_text, rounds=2, kind=kind)
+    return _tweaked(state, new_text, new_verdict)
+
+
+def _tweak_target(state: Dict[str, Any]) -> Tuple[str, str]:
+    """(text, kind) a tweak applies to: the latest chapter of an arc, else the story."""
+    if state.get("mode") == "arc":
+        return state["chapters"][-1], "chapter"
+    return state["story"], "story"
+
+
+def _tweaked(state: Dict[str, Any], new_text: str, new_verdict: Dict[str, Any]) -> Dict[str, Any]:
+    if state.get("mode") == "arc":
+        chapters = state["chapters"]
+        chapters[-1] = new_text
+        state["history"].append(
+            {"round": f"tweak-ch{len(chapters)}", "verdict": new_verdict})
+    else:
+        state["story"] = new_text
+        state["history"].append(
+            {"round": f"tweak-{len(state['history'])+1}", "verdict": new_verdict})
+    return state
+
+
+def next_chapter(state: Dict[str, Any], end_now: bool = False) -> Dict[str, Any]:
+    chapters = state["chapters"]
+    memory = None
+    if USE_STORY_MEMORY:
+        memory = state.get("memory") or empty_memory()
+        # Fold every chapter except the latest one, which is sent verbatim
+        for ch in chapters[memory["chapters_folded"]:-1]:
+            memory = update_story_memory(memory, ch)
+        state["memory"] = memory
+    chapter, verdict = generate_next_chapter(
+        state["brief"], chapters, end_now=end_now, memory=memory)
+    return _chapter_added(state, chapter, verdict, end_now)
+
+
+def _chapter_added(state: Dict[str, Any], chapter: str, verdict: Dict[str, Any], end_now: bool) -> Dict[str, Any]:
+    chapters = state["chapters"]
+    chapters.append(chapter)
+    label = f"chapter-{len(chapters)} (final)" if end_now else f"chapter-{len(chapters)}"
+    state["history"].append({"round": label, "verdict": verdict})
+    if end_now:
+        state["arc_ready_to_end"] = True  # UI will only show End Now
+    return state
+
+
+# -------------------- Async flows (ASGI app) --------------------
+# Same transitions on the async pipeline, so one event loop can drive many
+# stories at once.
+
+async def astart_story(prompt: str, mode: str = "short") -> Dict[str, Any]:
+    if mode == "arc":
+        start = await agenerate_arc_start(prompt)
+        return _arc_state(prompt, start["brief"], start["chapter"], start["verdict"])
+    return short_state(prompt, await agenerate_story(prompt, max_rounds=2))
+
+
+async def atweak_story(state: Dict[str, Any], tweak_text: str) -> Dict[str, Any]:
+    text, kind = _tweak_target(state)
+    new_text, new_verdict = await aapply_tweak(state["brief"], text, tweak_text, rounds=2, kind=kind)
+    return _tweaked(state, new_text, new_verdict)
+
+
+async def anext_chapter(state: Dict[str, Any], end_now: bool = False) -> Dict[str, Any]:
+    chapters = state["chapters"]
+    memory = None
+    if USE_STORY_MEMORY:
+        memory = state.get("memory") or empty_memory()
+        for ch in chapters[memory["chapters_folded"]:-1]:
+            memory = await aupdate_story_memory(memory, ch)
+        state["memory"] = memory
+    chapter, verdict = await agenerate_next_chapter(
+        state["brief"], chapters, end_now=end_now, memory=memory)
+    return _chapter_added(state, chapter, verdict, end_now)
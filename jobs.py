@@ -0,0 +1,300 @@
+import asyncio
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import checkpoints
+
+# Job table shared by every web worker on the machine
+JOBS_PATH = os.getenv("JOBS_DB_PATH", ".cache/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Jobs run at once by the ASGI app's queue (tasks on one event loop, not threads)
+ASYNC_JOB_WORKERS = int(os.getenv("ASYNC_JOB_WORKERS", "256"))
+# Jobs allowed to wait (beyond the ones running) before submit() refuses
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+# Finished jobs are kept this long so the page can still pick up the result
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+# Runs per job before it is marked failed; later attempts resume from the
+# stage checkpoints of earlier ones (see checkpoints.py)
+JOB_ATTEMPTS = int(os.getenv("JOB_ATTEMPTS", "2"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the local queue is at capacity (HTTP 429)."""
+
+
+def _owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        # Can't see other machines' processes; assume they are fine
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Bounded local worker pool backed by a SQLite job table.
+
+    submit() records the job and hands it to a worker thread; handlers are
+    plain functions payload -> result (both JSON-serializable). The job id
+    is the checkpoint run id, so jobs re-claimed from a dead process, retried
+    after an error, or re-queued with retry() skip the stages already done.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 path: str = JOBS_PATH, workers: int = JOB_WORKERS,
+                 max_queued: int = JOB_QUEUE_SIZE):
+        self.handlers = handlers
+        self.path = path
+        self.workers = workers
+        self.max_queued = max_queued
+        self.owner = _owner_id()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        self._threads = []
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # -------------------- Lifecycle --------------------
+
+    def start(self) -> "JobQueue":
+        self._recover()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def _recover(self) -> None:
+        """Adopt unfinished jobs whose owning process is gone."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                     (DONE, FAILED, now - JOB_RETENTION))
+        rows = conn.execute("SELECT id, owner FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                            (QUEUED, RUNNING)).fetchall()
+        for job_id, owner in rows:
+            if _owner_alive(owner):
+                continue
+            claimed = conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, updated_at = ? "
+                "WHERE id = ? AND owner IS ?",
+                (QUEUED, self.owner, now, job_id, owner)).rowcount
+            if claimed:
+                with self._lock:
+                    self._pending += 1
+                self._dispatch(job_id)
+
+    # -------------------- Public API --------------------
+
+    def submit(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            if self._pending >= self.workers + self.max_queued:
+                raise QueueFull("Too many stories are being written right now. Please try again shortly.")
+            self._pending += 1
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, payload, owner, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(payload), self.owner, now, now))
+        self._dispatch(job_id)
+        return job_id
+
+    def retry(self, job_id: str) -> bool:
+        """Re-queue a failed job under the same id; False if it isn't a failed job."""
+        with self._lock:
+            if self._pending >= self.workers + self.max_queued:
+                raise QueueFull("Too many stories are being written right now. Please try again shortly.")
+            self._pending += 1
+        claimed = self._conn().execute(
+            "UPDATE jobs SET status = ?, error = NULL, owner = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (QUEUED, self.owner, time.time(), job_id, FAILED)).rowcount
+        if not claimed:
+            with self._lock:
+                self._pending -= 1
+            return False
+        self._dispatch(job_id)
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "error": row[4],
+            "created_at": row[5],
+            "updated_at": row[6],
+        }
+
+    def depth(self) -> int:
+        """Jobs accepted by this process and not yet finished."""
+        with self._lock:
+            return self._pending
+
+    # -------------------- Worker loop --------------------
+
+    def _dispatch(self, job_id: str) -> None:
+        """Hand an accepted job to the workers."""
+        self._queue.put(job_id)
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def _claim(self, job_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Mark a queued job running; (kind, payload), or None if it isn't ours to run."""
+        conn = self._conn()
+        claimed = conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ? AND owner = ?",
+            (RUNNING, time.time(), job_id, QUEUED, self.owner)).rowcount
+        if not claimed:
+            return None
+        kind, payload = conn.execute(
+            "SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return kind, json.loads(payload)
+
+    def _finish(self, job_id: str, result: Any) -> None:
+        self._conn().execute("UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+                             (DONE, json.dumps(result), time.time(), job_id))
+        checkpoints.clear(job_id)
+
+    def _fail(self, job_id: str, error: str) -> None:
+        self._conn().execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                             (FAILED, error, time.time(), job_id))
+
+    def _run(self, job_id: str) -> None:
+        claimed = self._claim(job_id)
+        if claimed is None:
+            return
+        kind, payload = claimed
+        for attempt in range(1, max(1, JOB_ATTEMPTS) + 1):
+            try:
+                with checkpoints.run(job_id):
+                    result = self.handlers[kind](payload)
+                break
+            except Exception as e:
+                if attempt >= JOB_ATTEMPTS:
+                    self._fail(job_id, str(e))
+                    return
+                time.sleep(JOB_RETRY_DELAY)
+        self._finish(job_id, result)
+
+
+class AsyncJobQueue(JobQueue):
+    """
+    JobQueue for the ASGI app: handlers are coroutine functions and every
+    job is a task on the server's event loop, so a waiting story costs a
+    task instead of a thread. `workers` caps the jobs running at once.
+    start() must be called from the running loop.
+    """
+
+    def __init__(self, handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]],
+                 path: str = JOBS_PATH, workers: int = ASYNC_JOB_WORKERS,
+                 max_queued: int = JOB_QUEUE_SIZE):
+        super().__init__(handlers, path=path, workers=workers, max_queued=max_queued)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self) -> "AsyncJobQueue":
+        self._loop = asyncio.get_running_loop()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._recover()
+        return self
+
+    async def stop(self) -> None:
+        """Cancel running jobs (they are re-claimed from checkpoints on restart)."""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _dispatch(self, job_id: str) -> None:
+        # submit() may be called from a thread (e.g. a sync test client)
+        self._loop.call_soon_threadsafe(self._spawn, job_id)
+
+    def _spawn(self, job_id: str) -> None:
+        task = self._loop.create_task(self._work_async(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _work_async(self, job_id: str) -> None:
+        try:
+            async with self._slots:
+                await self._run_async(job_id)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def _run_async(self, job_id: str) -> None:
+        claimed = await asyncio.to_thread(self._claim, job_id)
+        if claimed is None:
+            return
+        kind, payload = claimed
+        for attempt in range(1, max(1, JOB_ATTEMPTS) + 1):
+            try:
+                with checkpoints.run(job_id):
+                    result = await self.handlers[kind](payload)
+                break
+            except Exception as e:
+                if attempt >= JOB_ATTEMPTS:
+                    await asyncio.to_thread(self._fail, job_id, str(e))
+                    return
+                await asyncio.sleep(JOB_RETRY_DELAY)
+        await asyncio.to_thread(self._finish, job_id, result)
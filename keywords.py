@@ -0,0 +1,40 @@
+from typing import Dict
+
+from dedup import features
+
+# Request keywords shared by the warm story pool (pool.match_request) and the
+# local brief for arc starts (quickbrief.provisional_brief), so both read a
+# request the same way.
+
+# Words that only ask for a category
+CATEGORY_WORDS = {
+    "bedtime-calm": "calm sleepy sleep cozy quiet soothing relaxing peaceful lullaby dream dreams",
+    "adventure": "adventure adventures adventurous quest exploring explore journey voyage",
+    "animal-friends": "animal animals pet pets",
+    "learning-moral": "moral morals manners lesson",
+    "fantasy": "fantasy magic magical fairy fairies",
+    "silly": "silly funny fun goofy giggle giggles joke jokes",
+}
+# Words that point to a category but also ask for something specific (a
+# dragon, a treasure map), so a request using them isn't generic
+CATEGORY_HINTS = {
+    "adventure": "treasure map",
+    "animal-friends": "zoo farm",
+    "fantasy": "dragon dragons unicorn wizard witch castle spell",
+}
+# Request words -> moral
+MORAL_WORDS = {
+    "kindness": "kind kindness caring care",
+    "sharing": "share shares sharing",
+    "courage": "brave bravery courage courageous scared afraid",
+    "patience": "patient patience waiting wait",
+    "honesty": "honest honesty truth truthful lie lying",
+    "friendship": "friend friends friendship",
+    "helping others": "help helps helping helpful",
+    "trying again": "try trying practice mistake mistakes",
+}
+
+
+def word_map(*tables: Dict[str, str]) -> Dict[str, str]:
+    """Stemmed word -> key over one or more {key: "space separated words"} tables."""
+    return {word: key for table in tables for key, words in table.items() for word in features(words)}
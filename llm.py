@@ -1,32 +1,303 @@
-# llm.py
+import asyncio
+import contextlib
+import contextvars
 import os
-from openai import OpenAI
+import time
+import weakref
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+import cache as response_cache
+import metrics
+import ratelimit
+import resilience
+import structured
 
 # Same model as required by the assignment
 MODEL_NAME = "gpt-3.5-turbo"
 
+# HTTP pool / concurrency tuning (override via env)
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "32"))
+MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Ask for response_format=json_object on JSON stages (disable for models without it)
+JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+
 # Create a single client per process
 _client = None
 
+# Async clients (and their in-flight semaphore) are bound to the event loop
+# that created them, so keep one per loop and let it go when the loop does.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=30.0,
+    )
+
+
+def _base_url():
+    # OPENAI_BASE_URL points the app at a proxy or the local fake server
+    return os.getenv("OPENAI_BASE_URL") or None
+
 
 def _get_client():
     global _client
     if _client is None:
-        # Reads OPENAI_API_KEY from env
-        _client = OpenAI()
+        # Reads OPENAI_API_KEY from env; retries are done by resilience.call
+        _client = OpenAI(base_url=_base_url(), max_retries=0, http_client=httpx.Client(
+            limits=_pool_limits(), timeout=DEFAULT_TIMEOUT))
     return _client
 
 
-def chat(messages, max_tokens=1200, temperature=0.7):
+def reset_clients():
+    """Drop cached clients so the next call picks up a new OPENAI_BASE_URL."""
+    global _client
+    _client = None
+    _async_clients.clear()
+
+
+def _get_async_client():
+    """
+    Return (client, semaphore) for the running event loop.
+    The semaphore caps concurrent requests from this process at MAX_IN_FLIGHT.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        client = AsyncOpenAI(base_url=_base_url(), max_retries=0, http_client=httpx.AsyncClient(
+            limits=_pool_limits(), timeout=DEFAULT_TIMEOUT))
+        entry = (client, asyncio.Semaphore(MAX_IN_FLIGHT))
+        _async_clients[loop] = entry
+    return entry
+
+
+# Usage totals for the current flow (see track_usage); None when not tracking
+_usage = contextvars.ContextVar("llm_usage", default=None)
+
+
+@contextlib.contextmanager
+def track_usage():
+    """
+    Collect call counts and token usage of every chat call made inside the
+    block, including concurrent tasks started from it.
+    """
+    totals = {"calls": 0, "cached_calls": 0,
+              "prompt_tokens": 0, "completion_tokens": 0, "llm_seconds": 0.0}
+    token = _usage.set(totals)
+    try:
+        yield totals
+    finally:
+        _usage.reset(token)
+
+
+def _record_usage(usage=None, cached=False, seconds=0.0, stage=""):
+    prompt_tokens = (getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else 0
+    completion_tokens = (getattr(usage, "completion_tokens", 0) or 0) if usage is not None else 0
+    metrics.record_call(stage, seconds, prompt_tokens, completion_tokens, cached)
+
+    totals = _usage.get()
+    if totals is None:
+        return
+    totals["calls"] += 1
+    totals["llm_seconds"] += seconds
+    if cached:
+        totals["cached_calls"] += 1
+    totals["prompt_tokens"] += prompt_tokens
+    totals["completion_tokens"] += completion_tokens
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return max(1, len(text) // 4)
+
+
+def _cost(messages, max_tokens):
+    """Quota a call may use, as the API counts it: prompt estimate + max_tokens."""
+    return sum(estimate_tokens(m.get("content") or "") for m in messages) + max_tokens
+
+
+def _charge(messages, max_tokens):
+    """Take shared quota for one request; resilience runs it before every attempt and hedge."""
+    cost = _cost(messages, max_tokens)
+    return lambda: ratelimit.acquire(cost)
+
+
+def _acharge(messages, max_tokens):
+    cost = _cost(messages, max_tokens)
+    return lambda: ratelimit.aacquire(cost)
+
+
+def _cache_key(messages, max_tokens, temperature, stage, use_cache):
+    if use_cache is None:
+        use_cache = response_cache.enabled_for(stage)
+    if not use_cache:
+        return None
+    return response_cache.cache_key(MODEL_NAME, messages, max_tokens, temperature)
+
+
+def _json_kwargs(json_mode):
+    return {"response_format": {"type": "json_object"}} if json_mode and JSON_MODE else {}
+
+
+def _cacheable(content, json_mode):
+    # Never cache a JSON reply that can't be parsed; it would fail again on every hit
+    if not content:
+        return False
+    if not json_mode:
+        return True
+    try:
+        structured.parse_json(content)
+    except structured.SchemaError:
+        return False
+    return True
+
+
+def chat(messages, max_tokens=1200, temperature=0.7, timeout=None, stage="", cache=None, json_mode=False):
     """
     Minimal wrapper using the OpenAI v1+ SDK.
     Accepts a `messages` list with system/user/assistant roles.
+    `stage` names the pipeline stage; `cache` forces the response cache on/off
+    (default: on for stages listed in cache.CACHE_STAGES). `json_mode` asks
+    for a JSON object reply. Every request that goes out, retries and hedges
+    included, waits for shared quota first (see ratelimit.py).
     """
+    key = _cache_key(messages, max_tokens, temperature, stage, cache)
+    if key is not None:
+        hit = response_cache.get_cache().get(key)
+        if hit is not None:
+            _record_usage(cached=True, stage=stage)
+            return hit
+
     client = _get_client()
-    resp = client.chat.completions.create(
+    started = time.perf_counter()
+    resp = resilience.call(lambda: client.chat.completions.create(
         model=MODEL_NAME,
         messages=messages,
         max_tokens=max_tokens,
         temperature=temperature,
-    )
-    return resp.choices[0].message.content
+        timeout=timeout or DEFAULT_TIMEOUT,
+        **_json_kwargs(json_mode),
+    ), stage=stage, charge=_charge(messages, max_tokens))
+    _record_usage(resp.usage, seconds=time.perf_counter() - started, stage=stage)
+    content = resp.choices[0].message.content
+    if key is not None and _cacheable(content, json_mode):
+        response_cache.get_cache().put(key, content)
+    return content
+
+
+def chat_stream(messages, max_tokens=1200, temperature=0.7, timeout=None, stage=""):
+    """
+    Streaming mode of `chat`: yields content deltas as they arrive.
+    Streams always go to the API (they are never served from the cache).
+    Opening the stream is retried like `chat`; once deltas flow, errors surface.
+    """
+    client = _get_client()
+    started = time.perf_counter()
+    stream = resilience.call(lambda: client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=timeout or DEFAULT_TIMEOUT,
+        stream=True,
+        stream_options={"include_usage": True},
+    ), stage=stage, hedge=False, charge=_charge(messages, max_tokens))
+    usage = None
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+    _record_usage(usage, seconds=time.perf_counter() - started, stage=stage)
+
+
+async def achat(messages, max_tokens=1200, temperature=0.7, timeout=None, stage="", cache=None, json_mode=False):
+    """
+    Coroutine version of `chat` on the shared async client.
+    Each attempt waits for shared quota, then a free in-flight slot, before it is sent.
+    """
+    key = _cache_key(messages, max_tokens, temperature, stage, cache)
+    if key is not None:
+        hit = await asyncio.to_thread(response_cache.get_cache().get, key)
+        if hit is not None:
+            _record_usage(cached=True, stage=stage)
+            return hit
+
+    client, in_flight = _get_async_client()
+
+    async def send():
+        # Each attempt (and hedge) takes its own slot; backoff sleeps hold none
+        async with in_flight:
+            return await client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout or DEFAULT_TIMEOUT,
+                **_json_kwargs(json_mode),
+            )
+
+    started = time.perf_counter()
+    resp = await resilience.acall(send, stage=stage, charge=_acharge(messages, max_tokens))
+    _record_usage(resp.usage, seconds=time.perf_counter() - started, stage=stage)
+    content = resp.choices[0].message.content
+    if key is not None and _cacheable(content, json_mode):
+        await asyncio.to_thread(response_cache.get_cache().put, key, content)
+    return content
+
+
+async def achat_stream(messages, max_tokens=1200, temperature=0.7, timeout=None, stage=""):
+    """
+    Async generator version of `chat_stream` on the shared async client.
+    The in-flight slot is held until the stream ends (backoff sleeps hold none).
+    """
+    client, in_flight = _get_async_client()
+
+    async def send():
+        await in_flight.acquire()
+        try:
+            return await client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                timeout=timeout or DEFAULT_TIMEOUT,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+        except BaseException:
+            in_flight.release()
+            raise
+
+    started = time.perf_counter()
+    stream = await resilience.acall(send, stage=stage, hedge=False, charge=_acharge(messages, max_tokens))
+    usage = None
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        in_flight.release()
+        await stream.close()
+    _record_usage(usage, seconds=time.perf_counter() - started, stage=stage)
+
+
+async def aclose():
+    """Close the async client bound to the running loop (if any)."""
+    entry = _async_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[0].close()
@@ -0,0 +1,403 @@
+"""
+Load test for the web app: simulated families using the page, with
+concurrency ramped up step by step.
+
+    python loadtest.py --ramp 1,2,4,8,16 --step-seconds 60 --latency lognormal:1.5:0.4
+    python loadtest.py --app asgi --ramp 8,32,128 --tokens-per-sec 50
+    python loadtest.py --url http://127.0.0.1:5000 --ramp 4     # an app you started yourself
+
+By default the fake OpenAI server (fake_openai.py) runs in this process and
+the app is started the way the Procfile does (gunicorn webapp:app, or
+uvicorn asgi:app with --app asgi) in a scratch directory. Each simulated
+user keeps its own cookie session and does what the page does: a short
+story (streamed, or as a background job), a few tweaks, then a multi-arc
+story through next, end_next and end_now, following every job by polling
+/jobs/<id> and finishing it.
+
+Per step it reports sessions and requests per second, p50/p95/p99 per route
+and per user action, rejected (429), error, failed-job and timeout rates,
+and saturation: queued and running jobs sampled from the app's job table.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+import fake_openai
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PROMPTS = [
+    "a sleepy hedgehog who learns to share", "a brave little turtle and a lost map",
+    "a dragon who is afraid of the dark", "two kittens building a blanket fort",
+    "an owl who helps the moon find its way", "a bunny who tells the truth",
+]
+NAMES = ["Pip", "Luna", "Milo", "Hazel", "Otis", "Wren", "Juniper", "Bo", "Clover", "Finn"]
+TWEAKS = [
+    "Make it calmer with a softer ending.", "Add gentle dialogue between the friends.",
+    "Make it a little shorter.", "Give the main character a funny hat.",
+]
+
+_JOB_RE = re.compile(r"/jobs/([0-9a-f]+)/finish")
+_ID_RE = re.compile(r"/jobs/[0-9a-f]+")
+
+# Outcomes other than "ok"; sessions cut short by the end of a step are not counted
+REJECTED, ERROR, FAILED, TIMEOUT, CUT = "rejected", "error", "failed", "timeout", "cut"
+
+
+class ActionError(Exception):
+    def __init__(self, outcome: str, detail: str = ""):
+        super().__init__(detail or outcome)
+        self.outcome = outcome
+
+
+def _pct(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+# -------------------- Simulated user --------------------
+
+class User:
+    """One family: a cookie session and the page's request sequence."""
+
+    def __init__(self, client: httpx.AsyncClient, args: argparse.Namespace, rng: random.Random,
+                 samples: List[Dict[str, Any]], step: int, stop_at: float):
+        self.client = client
+        self.args = args
+        self.rng = rng
+        self.samples = samples
+        self.step = step
+        self.stop_at = stop_at
+        self.outcome = "ok"
+
+    def _record(self, kind: str, name: str, started: float, outcome: str) -> None:
+        self.samples.append({"step": self.step, "kind": kind, "name": name, "outcome": outcome,
+                             "at": time.time(), "seconds": time.perf_counter() - started})
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        route = f"{method} {_ID_RE.sub('/jobs/<id>', path.split('?')[0])}"
+        started = time.perf_counter()
+        try:
+            resp = await self.client.request(method, path, timeout=self.args.timeout, **kwargs)
+        except httpx.TimeoutException:
+            self._record("route", route, started, TIMEOUT)
+            raise ActionError(TIMEOUT, route)
+        except httpx.HTTPError as e:
+            self._record("route", route, started, ERROR)
+            raise ActionError(ERROR, f"{route}: {e}")
+        outcome = "ok" if resp.status_code < 400 else REJECTED if resp.status_code == 429 else ERROR
+        self._record("route", route, started, outcome)
+        if outcome != "ok":
+            raise ActionError(outcome, f"{route}: HTTP {resp.status_code}")
+        return resp
+
+    async def action(self, name: str, run) -> bool:
+        """Time one user-visible action (click to result); False if it didn't succeed."""
+        started = time.perf_counter()
+        if started >= self.stop_at:
+            # The step is over: finish the action in progress, start no new one
+            self.outcome = CUT
+            return False
+        try:
+            await run()
+        except ActionError as e:
+            self._record("action", name, started, e.outcome)
+            self.outcome = e.outcome
+            return False
+        self._record("action", name, started, "ok")
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.think)
+        return True
+
+    async def submit_job(self, path: str, data: Dict[str, str]) -> None:
+        """POST a form that starts a job, then follow it like the page does."""
+        await self.request("POST", path, data=data)
+        page = await self.request("GET", "/")
+        match = _JOB_RE.search(page.text)
+        if match is None:
+            raise ActionError(ERROR, f"{path}: no job on the page")
+        job_id = match.group(1)
+        deadline = time.perf_counter() + self.args.timeout
+        while True:
+            status = (await self.request("GET", f"/jobs/{job_id}",
+                                         headers={"Accept": "application/json"})).json()["status"]
+            if status not in ("queued", "running"):
+                break
+            if time.perf_counter() > deadline:
+                raise ActionError(TIMEOUT, f"job {job_id}")
+            await asyncio.sleep(self.args.poll)
+        await self.request("POST", f"/jobs/{job_id}/finish")
+        await self.request("GET", "/")
+        if status != "done":
+            raise ActionError(FAILED, f"job {job_id}: {status}")
+
+    async def stream_story(self, prompt: str) -> None:
+        """The browser's short-story path: /generate/stream, then /generate/commit."""
+        route = "GET /generate/stream"
+        started = time.perf_counter()
+        token = None
+        try:
+            async with self.client.stream("GET", "/generate/stream", params={"prompt": prompt},
+                                          timeout=self.args.timeout) as resp:
+                event = None
+                async for line in resp.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: ") and event in ("done", "failed"):
+                        token = json.loads(line[6:]).get("token")
+                        break
+        except httpx.TimeoutException:
+            self._record("route", route, started, TIMEOUT)
+            raise ActionError(TIMEOUT, route)
+        except httpx.HTTPError as e:
+            self._record("route", route, started, ERROR)
+            raise ActionError(ERROR, f"{route}: {e}")
+        self._record("route", route, started, "ok" if token else FAILED)
+        if not token:
+            raise ActionError(FAILED, route)
+        await self.request("POST", "/generate/commit", data={"token": token})
+        await self.request("GET", "/")
+
+    def _prompt(self) -> str:
+        # Families ask for different things; a name keeps prompts from repeating exactly
+        return f"{self.rng.choice(PROMPTS)}, named {self.rng.choice(NAMES)}"
+
+    async def session(self) -> None:
+        """One full visit; stops early (like a user would) when an action fails."""
+        args = self.args
+        await self.request("GET", "/")
+        prompt = self._prompt()
+        if args.short_via == "stream":
+            ok = await self.action("short story", lambda: self.stream_story(prompt))
+        else:
+            ok = await self.action("short story", lambda: self.submit_job(
+                "/generate", {"prompt": prompt, "mode": "short"}))
+        for _ in range(args.tweaks if ok else 0):
+            tweak = self.rng.choice(TWEAKS)
+            if not await self.action("tweak", lambda: self.submit_job("/tweak", {"tweak": tweak})):
+                break
+        if not args.arc:
+            return
+        if not await self.action("arc start", lambda: self.submit_job(
+                "/generate", {"prompt": self._prompt(), "mode": "arc"})):
+            return
+        for _ in range(args.chapters):
+            if not await self.action("arc next", lambda: self.submit_job("/arc/next", {})):
+                return
+        if await self.action("arc end_next", lambda: self.submit_job("/arc/end_next", {})):
+            await self.action("arc end_now", lambda: self.request("POST", "/arc/end_now"))
+
+
+async def _user_loop(url: str, args: argparse.Namespace, seed: int, samples: List[Dict[str, Any]],
+                     step: int, stop_at: float) -> None:
+    rng = random.Random(seed)
+    # Stagger arrivals so a step doesn't start with one synchronized burst
+    await asyncio.sleep(rng.uniform(0, min(args.think, 5.0)))
+    while time.perf_counter() < stop_at:
+        async with httpx.AsyncClient(base_url=url) as client:
+            user = User(client, args, rng, samples, step, stop_at)
+            started = time.perf_counter()
+            try:
+                await user.session()
+            except ActionError as e:
+                user.outcome = e.outcome
+            if user.outcome != CUT:
+                user._record("session", "session", started, user.outcome)
+
+
+# -------------------- Saturation --------------------
+
+def _job_counts(jobs_db: Optional[str]) -> Dict[str, int]:
+    if not jobs_db or not os.path.exists(jobs_db):
+        return {}
+    try:
+        conn = sqlite3.connect(jobs_db, timeout=1)
+        try:
+            return dict(conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return {}
+
+
+async def _sample_jobs(jobs_db: Optional[str], out: List[Dict[str, int]]) -> None:
+    while True:
+        out.append(await asyncio.to_thread(_job_counts, jobs_db))
+        await asyncio.sleep(0.5)
+
+
+# -------------------- Steps and report --------------------
+
+async def run_step(url: str, args: argparse.Namespace, users: int, step: int,
+                   jobs_db: Optional[str]) -> Dict[str, Any]:
+    samples: List[Dict[str, Any]] = []
+    saturation: List[Dict[str, int]] = []
+    started = time.perf_counter()
+    stop_at = started + args.step_seconds
+    sampler = asyncio.create_task(_sample_jobs(jobs_db, saturation))
+    loops = [asyncio.create_task(_user_loop(url, args, args.seed * 1000 + step * 100 + i, samples, step, stop_at))
+             for i in range(users)]
+    # Users finish the action they are in (bounded by the timeout), then stop
+    done, pending = await asyncio.wait(loops, timeout=args.step_seconds + args.timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    sampler.cancel()
+    elapsed = time.perf_counter() - started
+    return {"users": users, "seconds": elapsed, "samples": samples, "saturation": saturation}
+
+
+def _rates(rows: List[Dict[str, Any]]) -> Dict[str, float]:
+    n = len(rows) or 1
+    return {k: sum(1 for r in rows if r["outcome"] == k) / n for k in (REJECTED, ERROR, FAILED, TIMEOUT)}
+
+
+def _rates_text(rows: List[Dict[str, Any]]) -> str:
+    return " ".join(f"{k} {v:.1%}" for k, v in _rates(rows).items() if v) or "no errors"
+
+
+def summarize(result: Dict[str, Any], capacity: Optional[int]) -> Dict[str, Any]:
+    """One row of the saturation curve."""
+    samples, seconds = result["samples"], result["seconds"]
+    routes = [s for s in samples if s["kind"] == "route"]
+    actions = [s for s in samples if s["kind"] == "action"]
+    sessions = [s for s in samples if s["kind"] == "session"]
+    running = [c.get("running", 0) for c in result["saturation"]] or [0]
+    queued = [c.get("queued", 0) for c in result["saturation"]] or [0]
+    return {
+        "users": result["users"],
+        "req_per_s": len(routes) / seconds,
+        "sessions_per_min": sum(1 for s in sessions if s["outcome"] == "ok") / seconds * 60,
+        "action_p95": _pct([s["seconds"] for s in actions if s["outcome"] == "ok"], 95),
+        "action_errors": sum(_rates(actions).values()),
+        "running_avg": sum(running) / len(running),
+        "queued_max": max(queued),
+        "busy": sum(running) / len(running) / capacity if capacity else None,
+    }
+
+
+def report(result: Dict[str, Any], capacity: Optional[int]) -> None:
+    samples = result["samples"]
+    row = summarize(result, capacity)
+    routes = [s for s in samples if s["kind"] == "route"]
+    busy = f", job slots busy {row['busy']:.0%} avg" if row["busy"] is not None else ""
+    print(f"\n== {row['users']} users: {row['req_per_s']:.1f} req/s, {row['sessions_per_min']:.1f} sessions/min; "
+          f"requests: {_rates_text(routes)}")
+    print(f"   jobs running avg {row['running_avg']:.1f}, queued max {row['queued_max']}{busy}")
+    for kind in ("action", "route"):
+        names = sorted({s["name"] for s in samples if s["kind"] == kind})
+        for name in names:
+            rows = [s for s in samples if s["kind"] == kind and s["name"] == name]
+            ok = [s["seconds"] for s in rows if s["outcome"] == "ok"]
+            print(f"   {kind:<6} {name:<26} n={len(rows):<5} p50 {_pct(ok, 50):6.2f}s p95 {_pct(ok, 95):6.2f}s "
+                  f"p99 {_pct(ok, 99):6.2f}s  {_rates_text(rows)}")
+
+
+def report_curve(results: List[Dict[str, Any]], capacity: Optional[int]) -> None:
+    """Saturation curve: how throughput, latency and queueing move as users ramp up."""
+    print("\nusers  req/s  sessions/min  action p95  action errors  jobs running  queued max  slots busy")
+    for result in results:
+        row = summarize(result, capacity)
+        busy = f"{row['busy']:.0%}" if row["busy"] is not None else "-"
+        print(f"{row['users']:>5}  {row['req_per_s']:5.1f}  {row['sessions_per_min']:12.1f}  "
+              f"{row['action_p95']:9.1f}s  {row['action_errors']:13.1%}  {row['running_avg']:12.1f}  "
+              f"{row['queued_max']:10d}  {busy:>10}")
+
+
+def _start_app(args: argparse.Namespace, base_url: str, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "fake"),
+               PYTHONPATH=ROOT)
+    bind = f"127.0.0.1:{args.port}"
+    if args.app == "asgi":
+        cmd = ["uvicorn", "asgi:app", "--app-dir", ROOT, "--port", str(args.port), "--log-level", "warning"]
+    else:
+        # Same settings as the Procfile, plus the worker count
+        cmd = ["gunicorn", "webapp:app", "--timeout", "120", "-w", str(args.workers), "-b", bind]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(150):
+        try:
+            httpx.get(f"http://{bind}/metrics", timeout=1)
+            return proc
+        except httpx.HTTPError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"app did not start: {' '.join(cmd)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ramp simulated users against the web app.")
+    fake_openai.add_arguments(parser)
+    parser.add_argument("--app", choices=("webapp", "asgi"), default="webapp", help="which app to start")
+    parser.add_argument("--url", help="test an app that is already running instead (no fake server is started)")
+    parser.add_argument("--jobs-db", help="job table of the --url app, to sample saturation from")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers (the Procfile uses 1)")
+    parser.add_argument("--port", type=int, default=8780)
+    parser.add_argument("--ramp", default="1,2,4,8", help="comma-separated concurrent users per step")
+    parser.add_argument("--step-seconds", type=float, default=60.0)
+    parser.add_argument("--think", type=float, default=3.0, help="mean pause between a user's actions")
+    parser.add_argument("--poll", type=float, default=1.5, help="job polling interval (the page uses 1.5 s)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per request/action timeout")
+    parser.add_argument("--short-via", choices=("stream", "job"), default=None,
+                        help="short stories over /generate/stream or as a job (default: what the "
+                             "page does, stream on asgi and job on webapp)")
+    parser.add_argument("--tweaks", type=int, default=2)
+    parser.add_argument("--no-arc", dest="arc", action="store_false", help="skip the multi-arc part")
+    parser.add_argument("--chapters", type=int, default=1, help="arc/next clicks before end_next")
+    parser.add_argument("--json", help="also write raw samples and saturation to this file")
+    parser.set_defaults(latency="lognormal:1.0:0.4", tokens_per_sec=100.0, seed=1)
+    args = parser.parse_args()
+    if args.short_via is None:
+        args.short_via = "stream" if args.app == "asgi" else "job"
+
+    proc = None
+    server = None
+    jobs_db = args.jobs_db
+    capacity = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        server, base_url = fake_openai.start_server(fake_openai.config_from_args(args))
+        workdir = tempfile.mkdtemp(prefix="loadtest-")
+        proc = _start_app(args, base_url, workdir)
+        url = f"http://127.0.0.1:{args.port}"
+        jobs_db = os.path.join(workdir, ".cache", "jobs.sqlite3")
+        if args.app == "asgi":
+            capacity = int(os.getenv("ASYNC_JOB_WORKERS", "256"))
+        else:
+            capacity = args.workers * int(os.getenv("JOB_WORKERS", "4"))
+
+    results = []
+    try:
+        for step, users in enumerate(int(n) for n in args.ramp.split(",")):
+            result = asyncio.run(run_step(url, args, users, step, jobs_db))
+            report(result, capacity)
+            results.append(result)
+        report_curve(results, capacity)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if server is not None:
+            server.shutdown()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
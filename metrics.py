@@ -0,0 +1,236 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# In-process metrics: one registry per worker process, rendered in the
+# Prometheus text format by /metrics. Recording is a dict update under a lock.
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+FLOW_BUCKETS = (1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+EDIT_BUCKETS = (0, 1, 2, 3, 4, 5)
+# Per-call records kept for debugging (most recent first out)
+RECENT_CALLS = 500
+
+_HELP = {
+    "llm_call_seconds": ("histogram", "Latency of chat calls by pipeline stage."),
+    "llm_calls_total": ("counter", "Chat calls by pipeline stage and cache result."),
+    "llm_tokens_total": ("counter", "Tokens used by pipeline stage and kind."),
+    "story_judge_verdicts_total": ("counter", "Judge verdicts by round, result and source (llm or local)."),
+    "story_edit_rounds": ("histogram", "Editor calls per story flow."),
+    "story_flow_seconds": ("histogram", "Wall time of whole story flows."),
+    "story_patch_edits_total": ("counter", "Patch-mode edits applied locally or sent back for a full rewrite."),
+    "story_arc_starts_total": ("counter", "Arc starts by how chapter 1 was drafted (local brief kept, redrafted...)."),
+    "story_continuity_edits_total": ("counter", "Continuity-pass chapter patches applied or rejected (outline arcs)."),
+    "request_index_lookups_total": ("counter", "Near-duplicate request index lookups: miss, brief reused or story reused."),
+    "story_pool_lookups_total": ("counter", "Warm story pool lookups: hit, miss, or request too specific for the pool."),
+    "story_pool_discards_total": ("counter", "Pool stories thrown away (stale) or never added (failed the judge)."),
+    "story_pool_age_seconds": ("histogram", "Age of pool stories when served."),
+    "speculative_lookups_total": ("counter", "Clicks on guessable actions: hit, joined a running guess, or miss."),
+    "speculative_runs_total": ("counter", "Speculative runs by kind and outcome (ready, failed, cancelled, diverged, expired)."),
+    "speculative_tokens_total": ("counter", "Tokens spent by speculative runs, used by a click or wasted."),
+    "speculative_skipped_total": ("counter", "Speculative runs not started: token budget spent or workers busy."),
+    "checkpoint_steps_total": ("counter", "Pipeline stage results recorded to, or replayed from, run checkpoints."),
+    "llm_json_failures_total": ("counter", "Unrepairable JSON replies by stage: re-asked, or replaced by defaults."),
+    "llm_limiter_wait_seconds": ("histogram", "Time chat calls waited for shared rate-limit quota, by priority."),
+    "llm_limiter_timeouts_total": ("counter", "Chat calls that gave up waiting for quota, by priority."),
+    "llm_retries_total": ("counter", "Retried chat calls by stage and failure reason."),
+    "llm_hedges_total": ("counter", "Hedged chat calls by stage and which request won."),
+    "llm_circuit_rejections_total": ("counter", "Chat calls refused while the circuit breaker was open."),
+}
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], "Histogram"] = {}
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_gauges: List[Tuple[str, str, Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]]] = []
+_recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_CALLS)
+
+# Current flow (id, name, edit count) and judge round, set by the pipeline
+_flow: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("metrics_flow", default=None)
+_round: contextvars.ContextVar[str] = contextvars.ContextVar("metrics_round", default="")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels: Any) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _observe(name: str, value: float, buckets, **labels: Any) -> None:
+    key = (name, _labels(**labels))
+    hist = _histograms.get(key)
+    if hist is None:
+        hist = _histograms[key] = Histogram(buckets)
+    hist.observe(value)
+
+
+def _inc(name: str, amount: float = 1.0, **labels: Any) -> None:
+    key = (name, _labels(**labels))
+    _counters[key] = _counters.get(key, 0.0) + amount
+
+
+# -------------------- Context --------------------
+
+@contextlib.contextmanager
+def flow(name: str):
+    """
+    Tag every chat call inside the block with a flow id; records the flow's
+    wall time and editor rounds on exit. Nested flows reuse the outer one.
+    Usable as a decorator.
+    """
+    if _flow.get() is not None:
+        yield _flow.get()
+        return
+    current = {"id": uuid.uuid4().hex[:12], "name": name, "edits": 0}
+    token = _flow.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        _flow.reset(token)
+        with _lock:
+            _observe("story_flow_seconds", time.perf_counter() - started, FLOW_BUCKETS, flow=name)
+            _observe("story_edit_rounds", current["edits"], EDIT_BUCKETS, flow=name)
+
+
+def set_round(round_label: Any) -> None:
+    """Label subsequent judge verdicts in this context with `round_label`."""
+    _round.set(str(round_label))
+
+
+# -------------------- Recording --------------------
+
+def record_call(stage: str, seconds: float, prompt_tokens: int = 0,
+                completion_tokens: int = 0, cached: bool = False) -> None:
+    stage = stage or "other"
+    current = _flow.get()
+    record = {
+        "stage": stage,
+        "round": _round.get(),
+        "flow_id": current["id"] if current else "",
+        "flow": current["name"] if current else "",
+        "seconds": round(seconds, 4),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached": cached,
+        "at": time.time(),
+    }
+    with _lock:
+        if current is not None and stage in ("editor", "editor_patch") and not cached:
+            current["edits"] += 1
+        _inc("llm_calls_total", stage=stage, cached=str(cached).lower())
+        if not cached:
+            _observe("llm_call_seconds", seconds, LATENCY_BUCKETS, stage=stage)
+            _inc("llm_tokens_total", prompt_tokens, stage=stage, kind="prompt")
+            _inc("llm_tokens_total", completion_tokens, stage=stage, kind="completion")
+        _recent.append(record)
+
+
+def judge_verdict(verdict: Dict[str, Any]) -> None:
+    with _lock:
+        _inc("story_judge_verdicts_total",
+             round=_round.get() or "n/a",
+             result="pass" if verdict.get("pass") else "fail",
+             source=verdict.get("source", "llm"))
+
+
+def incr(name: str, amount: float = 1.0, **labels: Any) -> None:
+    """Bump a counter declared in _HELP."""
+    with _lock:
+        _inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, buckets, **labels: Any) -> None:
+    """Add a sample to a histogram declared in _HELP."""
+    with _lock:
+        _observe(name, value, buckets, **labels)
+
+
+def register_gauge(name: str, help_text: str,
+                   fn: Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]) -> None:
+    """
+    Add a gauge computed at scrape time. `fn` returns {labels: value}, with
+    labels as built by gauge_labels(); use {(): value} for an unlabelled gauge.
+    """
+    with _lock:
+        _gauges[:] = [g for g in _gauges if g[0] != name]
+        _gauges.append((name, help_text, fn))
+
+
+def gauge_labels(**labels: Any) -> Tuple[Tuple[str, str], ...]:
+    return _labels(**labels)
+
+
+def recent_calls() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_recent)
+
+
+# -------------------- Prometheus text format --------------------
+
+def _fmt_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render() -> str:
+    lines: List[str] = []
+    with _lock:
+        hists = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+        gauges = list(_gauges)
+    hists = [(k, (h.buckets, list(h.counts), h.sum, h.count)) for k, h in hists]
+
+    seen = set()
+    for (name, labels), (buckets, counts, total, count) in hists:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_HELP[name][1]}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', _fmt_value(bound)))} {cumulative}")
+        lines.append(f"{name}_bucket{_fmt_labels(labels, ('le', '+Inf'))} {count}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(total)}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_HELP[name][1]}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+
+    for name, help_text, fn in gauges:
+        try:
+            values = fn()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+
+    return "\n".join(lines) + "\n"
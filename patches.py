@@ -0,0 +1,120 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+import structured
+
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+_NUMBER_PREFIX_RE = re.compile(r"^\s*\[\d+\]\s*")
+
+OPS = ("replace", "insert", "delete")
+
+
+class PatchError(ValueError):
+    """The editor's patch is malformed or doesn't fit the story."""
+
+
+# -------------------- Paragraph numbering --------------------
+
+def split_paragraphs(story: str) -> List[str]:
+    """Title (first line) followed by the blank-line separated body paragraphs."""
+    lines = (story or "").strip().splitlines()
+    if not lines:
+        return []
+    body = "\n".join(lines[1:]).strip()
+    return [lines[0].strip()] + [p.strip() for p in _PARAGRAPH_SPLIT_RE.split(body) if p.strip()]
+
+
+def join_paragraphs(paragraphs: List[str]) -> str:
+    return "\n\n".join(paragraphs)
+
+
+def number_paragraphs(story: str) -> str:
+    """Story with `[n]` before each paragraph, as shown to the patch editor."""
+    return "\n\n".join(f"[{i}] {p}" for i, p in enumerate(split_paragraphs(story)))
+
+
+# -------------------- Parsing / validation --------------------
+
+def _index(op: Dict[str, Any], field: str, count: int) -> int:
+    value = op.get(field)
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not 0 <= value < count:
+        raise PatchError(f"{op.get('op')}: '{field}' must be a paragraph number 0-{count - 1}")
+    return value
+
+
+def _text(op: Dict[str, Any]) -> str:
+    text = op.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise PatchError(f"{op.get('op')}: 'text' must be non-empty")
+    return _NUMBER_PREFIX_RE.sub("", text.strip())
+
+
+def parse_patch(raw: str, count: int) -> List[Tuple[str, int, str]]:
+    """
+    Validate the editor's JSON against a story of `count` paragraphs.
+    Returns (op, index, text) tuples; raises PatchError if anything is off.
+    """
+    try:
+        # A cut-off reply would apply a half-written paragraph: reject it
+        data = structured.parse_json(raw, truncated=False)
+    except structured.SchemaError as e:
+        raise PatchError(f"invalid JSON: {e}") from e
+    ops = data.get("ops")
+    if not isinstance(ops, list):
+        raise PatchError("'ops' must be a list")
+
+    parsed: List[Tuple[str, int, str]] = []
+    touched = set()
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in OPS:
+            raise PatchError(f"unknown operation: {op!r}")
+        kind = op["op"]
+        if kind == "insert":
+            parsed.append((kind, _index(op, "after", count), _text(op)))
+            continue
+        idx = _index(op, "p", count)
+        if idx in touched:
+            raise PatchError(f"paragraph {idx} changed twice")
+        touched.add(idx)
+        if kind == "delete":
+            if idx == 0:
+                raise PatchError("cannot delete the title")
+            parsed.append((kind, idx, ""))
+        else:
+            parsed.append((kind, idx, _text(op)))
+    return parsed
+
+
+# -------------------- Applying --------------------
+
+def apply_patch(story: str, raw: str) -> str:
+    """
+    Apply the editor's patch (JSON text) to `story`. Indexes refer to the
+    original numbering; inserts after the same paragraph keep their order.
+    """
+    paragraphs = split_paragraphs(story)
+    if not paragraphs:
+        raise PatchError("empty story")
+    ops = parse_patch(raw, len(paragraphs))
+
+    slots: List[List[str]] = [[p] for p in paragraphs]
+    inserts: Dict[int, List[str]] = {}
+    for kind, idx, text in ops:
+        if kind == "replace":
+            slots[idx] = [text]
+        elif kind == "delete":
+            slots[idx] = []
+        else:
+            inserts.setdefault(idx, []).append(text)
+
+    out: List[str] = []
+    for idx, slot in enumerate(slots):
+        out.extend(slot)
+        out.extend(inserts.get(idx, []))
+    if len(out) < 2:
+        raise PatchError("patch leaves no story body")
+    # The title stays a single line
+    out[0] = " ".join(out[0].split())
+    return join_paragraphs(out)
@@ -1,73 +1,131 @@
+import asyncio
 import json
+import os
 import re
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Iterator, AsyncIterator, Optional
 
-from llm import chat
+from llm import chat, achat, aclose, chat_stream, achat_stream, estimate_tokens
+import checkpoints
+import dedup
+import metrics
+import patches
+import pool
+import prejudge
+import quickbrief
+import structured
+from sanitize import StorySanitizer, sanitize_story_text
 from prompts import (
     CLASSIFIER_SYSTEM, CLASSIFIER_USER_TEMPLATE,
     STORYTELLER_SYSTEM, STORYTELLER_USER_TEMPLATE,
     JUDGE_SYSTEM, JUDGE_USER_TEMPLATE,
     EDITOR_SYSTEM, EDITOR_USER_TEMPLATE,
-    CHAPTER_STORYTELLER_SYSTEM, CHAPTER_USER_TEMPLATE
+    EDITOR_PATCH_SYSTEM, EDITOR_PATCH_USER_TEMPLATE,
+    JUDGE_REVISE_SYSTEM, JUDGE_REVISE_USER_TEMPLATE,
+    CHAPTER_STORYTELLER_SYSTEM, CHAPTER_USER_TEMPLATE,
+    MEMORY_SYSTEM, MEMORY_USER_TEMPLATE,
+    OUTLINE_SYSTEM, OUTLINE_USER_TEMPLATE, OUTLINE_CHAPTER_USER_TEMPLATE,
+    CONTINUITY_SYSTEM, CONTINUITY_USER_TEMPLATE
 )
 
+# Approximate token budget for the rolling story memory sent with each chapter
+MEMORY_TOKEN_BUDGET = int(os.getenv("STORY_MEMORY_TOKENS", "400"))
+
+# Best-of-N drafting in generate_story: how many drafts, how many at once,
+# and how long (seconds) to wait for more drafts once one is judged (0 = all)
+STORY_CANDIDATES = int(os.getenv("STORY_CANDIDATES", "1"))
+CANDIDATE_CONCURRENCY = int(os.getenv("STORY_CANDIDATE_CONCURRENCY", "4"))
+CANDIDATE_DEADLINE = float(os.getenv("STORY_CANDIDATE_DEADLINE", "0"))
+
+# Editor output: "full" rewrites the whole story, "patch" asks for paragraph
+# edit operations (much less output) and falls back to a full rewrite if the
+# patch can't be applied
+EDIT_MODE = os.getenv("EDIT_MODE", "full")
+PATCH_MAX_TOKENS = int(os.getenv("EDIT_PATCH_MAX_TOKENS", "500"))
+
+# Judge/edit loop: "separate" judges, then edits (two calls per failed round);
+# "fused" judges and revises in one call, then confirms the final text once,
+# with the LLM judge (FUSED_CONFIRM=llm) or the local checks only ("local")
+JUDGE_MODE = os.getenv("JUDGE_MODE", "separate")
+FUSED_CONFIRM = os.getenv("FUSED_CONFIRM", "llm")
+
+# Outline-first arcs (generate_outlined_arc): chapters written at once from one
+# plan; how many at a time, and whether a continuity pass follows
+OUTLINE_CONCURRENCY = int(os.getenv("OUTLINE_CONCURRENCY", "8"))
+OUTLINE_CONTINUITY = os.getenv("OUTLINE_CONTINUITY", "1") != "0"
+
+# Arc start: draft chapter 1 from a local keyword brief while the classifier
+# runs, instead of classifying first ("0")
+ARC_FAST_START = os.getenv("ARC_FAST_START", "1") != "0"
+
+# How often a JSON stage (classifier, judge, memory) is re-asked when its reply
+# can't be repaired locally, before falling back to defaults
+JSON_RETRIES = int(os.getenv("LLM_JSON_RETRIES", "1"))
+
 # -------------------- Utilities --------------------
 
 
 def _sanitize_story_text(text: str) -> str:
-    """
-    Enforce plain text:
-    - Remove bold/backticks and heading markers.
-    - First non-empty line becomes a plain title (strip 'Title:' and symbols).
-    - Trim extra whitespace.
-    """
-    if not text:
-        return text
+    """Plain-text story cleanup (see sanitize.StorySanitizer for the rules)."""
+    return sanitize_story_text(text)
 
-    # Remove inline emphasis/backticks globally
-    text = text.replace("**", "").replace("__", "").replace("`", "")
 
-    lines = [ln.rstrip() for ln in text.strip().splitlines()]
-    # First non-empty line -> title cleanup
-    first_idx = next((i for i, ln in enumerate(lines) if ln.strip()), None)
-    if first_idx is not None:
-        first = lines[first_idx].strip()
-        # Strip heading markers and 'Title' labels
-        # leading '#'
-        first = re.sub(r'^\s*#+\s*', '', first)
-        # 'Title:' or 'Title -'
-        first = re.sub(r'^\s*title\s*[:\-]\s*', '', first, flags=re.I)
-        # line is just 'Title'
-        first = re.sub(r'^\s*title\s*$', '', first, flags=re.I)
-        first = first.strip(" *:_-")
-        lines[first_idx] = first
+def _parse_json(s: str) -> Dict[str, Any]:
+    """JSON object from a model reply, repairing it if needed (structured.SchemaError if not)."""
+    return structured.parse_json(s)
 
-    # Remove leading '# ' from other lines too
-    lines = [re.sub(r'^\s*#+\s*', '', ln) for ln in lines]
 
-    cleaned = "\n".join(lines).strip()
-    return cleaned
+def _ask_json(messages: List[Dict[str, str]], finish, stage: str, **kwargs: Any) -> Any:
+    """
+    Call a JSON stage and parse the reply with `finish`. A reply that can't
+    be repaired locally re-asks this stage only (up to JSON_RETRIES times);
+    raises structured.SchemaError if every attempt fails.
+    """
+    raw = chat(messages, stage=stage, json_mode=True, **kwargs)
+    attempt = 0
+    while True:
+        try:
+            return finish(raw)
+        except structured.SchemaError as e:
+            if attempt >= JSON_RETRIES:
+                metrics.incr("llm_json_failures_total", stage=stage, action="default")
+                raise
+            metrics.incr("llm_json_failures_total", stage=stage, action="reask")
+            attempt += 1
+            raw = chat(structured.reask_messages(messages, raw, e), stage=stage, json_mode=True,
+                       **dict(kwargs, temperature=0.0, cache=False))
 
 
-def _parse_json(s: str) -> Dict[str, Any]:
-    s = s.strip()
-    start = s.find("{")
-    end = s.rfind("}")
-    if start != -1 and end != -1 and end > start:
-        s = s[start:end+1]
-    return json.loads(s)
+async def _aask_json(messages: List[Dict[str, str]], finish, stage: str, **kwargs: Any) -> Any:
+    raw = await achat(messages, stage=stage, json_mode=True, **kwargs)
+    attempt = 0
+    while True:
+        try:
+            return finish(raw)
+        except structured.SchemaError as e:
+            if attempt >= JSON_RETRIES:
+                metrics.incr("llm_json_failures_total", stage=stage, action="default")
+                raise
+            metrics.incr("llm_json_failures_total", stage=stage, action="reask")
+            attempt += 1
+            raw = await achat(structured.reask_messages(messages, raw, e), stage=stage, json_mode=True,
+                              **dict(kwargs, temperature=0.0, cache=False))
 
 
 # -------------------- Core (classifier / storyteller / judge / editor) --------------------
 
-def classify_request(user_request: str) -> Dict[str, Any]:
-    messages = [
+def _classifier_messages(user_request: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": CLASSIFIER_SYSTEM},
         {"role": "user", "content": CLASSIFIER_USER_TEMPLATE.format(
             request=user_request)}
     ]
-    raw = chat(messages, max_tokens=400, temperature=0.2)
-    brief = _parse_json(raw)
+
+
+def _finish_brief(raw: str) -> Dict[str, Any]:
+    return _guard_brief(structured.coerce_brief(_parse_json(raw)))
+
+
+def _guard_brief(brief: Dict[str, Any]) -> Dict[str, Any]:
     # Guardrails
     brief.setdefault("age_range", "5-10")
     brief.setdefault("length_words", 550)
@@ -78,18 +136,16 @@ def classify_request(user_request: str) -> Dict[str, Any]:
     return brief
 
 
-def tell_story(brief: Dict[str, Any]) -> str:
-    messages = [
+def _storyteller_messages(brief: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": STORYTELLER_SYSTEM},
         {"role": "user", "content": STORYTELLER_USER_TEMPLATE.format(
             brief_json=json.dumps(brief))}
     ]
-    story = chat(messages, max_tokens=1200, temperature=0.8)
-    return _sanitize_story_text(story)
 
 
-def judge_story(brief: Dict[str, Any], story: str, user_tweak: str = "") -> Dict[str, Any]:
-    messages = [
+def _judge_messages(brief: Dict[str, Any], story: str, user_tweak: str = "") -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": JUDGE_SYSTEM},
         {"role": "user", "content": JUDGE_USER_TEMPLATE.format(
             brief_json=json.dumps(brief),
@@ -97,18 +153,21 @@ def judge_story(brief: Dict[str, Any], story: str, user_tweak: str = "") -> Dict
             story=story
         )}
     ]
-    raw = chat(messages, max_tokens=500, temperature=0.1)
-    verdict = _parse_json(raw)
-    scores = verdict.get("scores", {})
-    if "average" not in scores and scores:
-        nums = [v for k, v in scores.items() if isinstance(v, (int, float))]
-        if nums:
-            verdict["scores"]["average"] = round(sum(nums) / len(nums), 2)
+
+
+def _finish_verdict(raw: str) -> Dict[str, Any]:
+    return structured.coerce_verdict(_parse_json(raw))
+
+
+def _unjudged_verdict(local: Dict[str, Any]) -> Dict[str, Any]:
+    """Local-only verdict when the judge never returned usable JSON."""
+    verdict = prejudge.as_verdict(local)
+    verdict["issues"] = verdict["issues"] + ["Judge reply was unusable; only local checks ran."]
     return verdict
 
 
-def edit_story(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], user_tweak: str = "") -> str:
-    messages = [
+def _editor_messages(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], user_tweak: str = "") -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": EDITOR_SYSTEM},
         {"role": "user", "content": EDITOR_USER_TEMPLATE.format(
             brief_json=json.dumps(brief),
@@ -117,54 +176,756 @@ def edit_story(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], us
             judge_json=json.dumps(judge_json)
         )}
     ]
-    revised = chat(messages, max_tokens=1200, temperature=0.6)
+
+
+def _patch_messages(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], user_tweak: str = "") -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": EDITOR_PATCH_SYSTEM},
+        {"role": "user", "content": EDITOR_PATCH_USER_TEMPLATE.format(
+            brief_json=json.dumps(brief),
+            user_tweak=(user_tweak or "None"),
+            numbered_story=patches.number_paragraphs(story),
+            judge_json=json.dumps(judge_json)
+        )}
+    ]
+
+
+def _finish_patch(story: str, raw: str) -> Optional[str]:
+    """Patched story, or None if the patch is unusable (caller falls back to a full rewrite)."""
+    try:
+        revised = patches.apply_patch(story, raw)
+    except patches.PatchError:
+        metrics.incr("story_patch_edits_total", result="fallback")
+        return None
+    metrics.incr("story_patch_edits_total", result="applied")
     return _sanitize_story_text(revised)
 
 
-def generate_story(user_request: str, max_rounds: int = 2) -> Dict[str, Any]:
+def _judge_revise_messages(brief: Dict[str, Any], story: str, user_tweak: str = "") -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": JUDGE_REVISE_SYSTEM},
+        {"role": "user", "content": JUDGE_REVISE_USER_TEMPLATE.format(
+            brief_json=json.dumps(brief),
+            user_tweak=(user_tweak or "None"),
+            story=story
+        )}
+    ]
+
+
+def _finish_judge_revise(raw: str, local: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    data = _parse_json(raw)
+    revised = str(data.pop("revised_story", "") or "").strip()
+    verdict = prejudge.merge(structured.coerce_verdict(data), local)
+    return verdict, (_sanitize_story_text(revised) if revised else None)
+
+
+def _local_verdict(brief: Dict[str, Any], story: str, user_tweak: str = "", kind: str = "story") -> Dict[str, Any]:
+    verdict = prejudge.as_verdict(prejudge.prejudge(brief, story, kind=kind, user_tweak=user_tweak))
+    metrics.judge_verdict(verdict)
+    return verdict
+
+
+def _known_request(user_request: str) -> Optional[Dict[str, Any]]:
+    """Stored brief/story of a near-identical earlier request (see dedup.py), or None."""
+    if not dedup.INDEX_ENABLED:
+        return None
+    match = dedup.get_index().lookup(user_request)
+    if match is None:
+        result = "miss"
+    elif match["story"] and dedup.REUSE_STORIES:
+        result = "story"
+    else:
+        result = "brief"
+    metrics.incr("request_index_lookups_total", result=result)
+    return match
+
+
+def _reused_story(match: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The generate_story result for a stored passing story, if reuse is on."""
+    if not match or not match["story"] or not dedup.REUSE_STORIES:
+        return None
+    return {"brief": match["brief"], "story": match["story"], "history": match["history"] or [],
+            "passed": True, "reused": {"similarity": match["similarity"]}}
+
+
+def _pooled_story(user_request: str) -> Optional[Dict[str, Any]]:
+    """A warm pool story for a generic request (see pool.py), or None."""
+    if not pool.POOL_ENABLED:
+        return None
+    key = pool.match_request(user_request)
+    if key is None:
+        metrics.incr("story_pool_lookups_total", result="not_generic")
+        return None
+    entry = pool.get_pool().take(*key)
+    metrics.incr("story_pool_lookups_total", result="hit" if entry else "miss")
+    if entry is None:
+        return None
+    return {"brief": entry["brief"], "story": entry["story"], "history": entry["history"],
+            "passed": True, "pooled": {"age": entry["age"]}}
+
+
+def _instant_story(user_request: str, match: Optional[Dict[str, Any]], use_pool: bool) -> Optional[Dict[str, Any]]:
+    """A finished story without running the pipeline: reused near-duplicate, then warm pool."""
+    reused = _reused_story(match)
+    if reused is None and use_pool:
+        reused = _pooled_story(user_request)
+    return reused
+
+
+async def _aknown_request(user_request: str) -> Optional[Dict[str, Any]]:
+    # The index is SQLite: keep its reads and writes off the event loop
+    return await asyncio.to_thread(_known_request, user_request)
+
+
+async def _ainstant_story(user_request: str, match: Optional[Dict[str, Any]],
+                          use_pool: bool) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(_instant_story, user_request, match, use_pool)
+
+
+async def _aremember_request(user_request: str, brief: Dict[str, Any],
+                             result: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    return await asyncio.to_thread(_remember_request, user_request, brief, result)
+
+
+def _remember_request(user_request: str, brief: Dict[str, Any],
+                      result: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Index the brief (and a passing story from `result`); returns `result`.
+    Skipped inside dedup.read_only() (batch.py, the pool filler), so
+    synthetic requests don't skew the index's hits and reuse.
+    """
+    if dedup.INDEX_ENABLED and dedup.remembering():
+        story = result["story"] if result and result.get("passed") and not result.get("reused") else None
+        dedup.get_index().remember(user_request, brief, story=story,
+                                   history=result["history"] if story else None)
+    return result
+
+
+@checkpoints.stage("brief")
+def classify_request(user_request: str) -> Dict[str, Any]:
+    try:
+        brief = _ask_json(_classifier_messages(user_request), _finish_brief,
+                          max_tokens=400, temperature=0.2, stage="classifier")
+    except structured.SchemaError:
+        return _guard_brief(structured.default_brief(user_request))
+    _remember_request(user_request, brief)
+    return brief
+
+
+@checkpoints.stage("draft")
+def tell_story(brief: Dict[str, Any]) -> str:
+    story = chat(_storyteller_messages(brief), max_tokens=1200, temperature=0.8, stage="storyteller")
+    return _sanitize_story_text(story)
+
+
+@checkpoints.stage("verdict")
+def judge_story(brief: Dict[str, Any], story: str, user_tweak: str = "", kind: str = "story") -> Dict[str, Any]:
+    """
+    Local rule checks first (see prejudge.py); obvious failures return a
+    local verdict without an LLM call. `kind` is "story" or "chapter".
+    """
+    local = prejudge.prejudge(brief, story, kind=kind, user_tweak=user_tweak)
+    if not local["pass"]:
+        verdict = prejudge.as_verdict(local)
+    else:
+        try:
+            verdict = prejudge.merge(_ask_json(_judge_messages(brief, story, user_tweak), _finish_verdict,
+                                               max_tokens=500, temperature=0.1, stage="judge"), local)
+        except structured.SchemaError:
+            verdict = _unjudged_verdict(local)
+    metrics.judge_verdict(verdict)
+    return verdict
+
+
+@checkpoints.stage("edit")
+def edit_story(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], user_tweak: str = "",
+               mode: Optional[str] = None) -> str:
+    """Revise the story; `mode` overrides EDIT_MODE ("full" or "patch")."""
+    if (mode or EDIT_MODE) == "patch":
+        raw = chat(_patch_messages(brief, story, judge_json, user_tweak),
+                   max_tokens=PATCH_MAX_TOKENS, temperature=0.4, stage="editor_patch",
+                   json_mode=True)
+        revised = _finish_patch(story, raw)
+        if revised is not None:
+            return revised
+    revised = chat(_editor_messages(brief, story, judge_json, user_tweak),
+                   max_tokens=1200, temperature=0.6, stage="editor")
+    return _sanitize_story_text(revised)
+
+
+@checkpoints.stage("judge_revise")
+def judge_and_revise(
+    brief: Dict[str, Any],
+    story: str,
+    user_tweak: str = "",
+    kind: str = "story",
+    must_revise: bool = False
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Fused judge + editor: one call returns the verdict on `story` and, if it
+    fails (or `must_revise`), the revised text; otherwise the revision is None.
+    An unusable reply is re-asked once like any JSON stage, then falls back
+    to judge_story. Local hard failures and replies without a usable revision
+    use edit_story.
+    """
+    local = prejudge.prejudge(brief, story, kind=kind, user_tweak=user_tweak)
+    if not local["pass"]:
+        verdict, revised = prejudge.as_verdict(local), None
+        metrics.judge_verdict(verdict)
+    else:
+        try:
+            verdict, revised = _ask_json(_judge_revise_messages(brief, story, user_tweak),
+                                         lambda raw: _finish_judge_revise(raw, local),
+                                         max_tokens=1700, temperature=0.5, stage="judge_revise")
+            metrics.judge_verdict(verdict)
+        except structured.SchemaError:
+            verdict, revised = judge_story(brief, story, user_tweak, kind), None
+    if verdict.get("pass") and not must_revise:
+        return verdict, None
+    if revised is None:
+        revised = edit_story(brief, story, verdict, user_tweak=user_tweak)
+    return verdict, revised
+
+
+@checkpoints.stage("confirm")
+def confirm_story(brief: Dict[str, Any], story: str, user_tweak: str = "", kind: str = "story") -> Dict[str, Any]:
+    """Final verdict after fused rounds: the LLM judge, or only the local checks."""
+    if FUSED_CONFIRM == "local":
+        return _local_verdict(brief, story, user_tweak, kind)
+    return judge_story(brief, story, user_tweak, kind)
+
+
+# -------------------- Async variants (for concurrent flows) --------------------
+
+@checkpoints.stage("brief")
+async def aclassify_request(user_request: str) -> Dict[str, Any]:
+    try:
+        brief = await _aask_json(_classifier_messages(user_request), _finish_brief,
+                                 max_tokens=400, temperature=0.2, stage="classifier")
+    except structured.SchemaError:
+        return _guard_brief(structured.default_brief(user_request))
+    await _aremember_request(user_request, brief)
+    return brief
+
+
+@checkpoints.stage("draft")
+async def atell_story(brief: Dict[str, Any], cache: Optional[bool] = None) -> str:
+    story = await achat(_storyteller_messages(brief), max_tokens=1200, temperature=0.8,
+                        stage="storyteller", cache=cache)
+    return _sanitize_story_text(story)
+
+
+@checkpoints.stage("verdict")
+async def ajudge_story(brief: Dict[str, Any], story: str, user_tweak: str = "", kind: str = "story") -> Dict[str, Any]:
+    local = prejudge.prejudge(brief, story, kind=kind, user_tweak=user_tweak)
+    if not local["pass"]:
+        verdict = prejudge.as_verdict(local)
+    else:
+        try:
+            verdict = prejudge.merge(await _aask_json(_judge_messages(brief, story, user_tweak), _finish_verdict,
+                                                      max_tokens=500, temperature=0.1, stage="judge"), local)
+        except structured.SchemaError:
+            verdict = _unjudged_verdict(local)
+    metrics.judge_verdict(verdict)
+    return verdict
+
+
+@checkpoints.stage("edit")
+async def aedit_story(brief: Dict[str, Any], story: str, judge_json: Dict[str, Any], user_tweak: str = "",
+                      mode: Optional[str] = None) -> str:
+    if (mode or EDIT_MODE) == "patch":
+        raw = await achat(_patch_messages(brief, story, judge_json, user_tweak),
+                          max_tokens=PATCH_MAX_TOKENS, temperature=0.4, stage="editor_patch",
+                          json_mode=True)
+        revised = _finish_patch(story, raw)
+        if revised is not None:
+            return revised
+    revised = await achat(_editor_messages(brief, story, judge_json, user_tweak),
+                          max_tokens=1200, temperature=0.6, stage="editor")
+    return _sanitize_story_text(revised)
+
+
+@checkpoints.stage("judge_revise")
+async def ajudge_and_revise(
+    brief: Dict[str, Any],
+    story: str,
+    user_tweak: str = "",
+    kind: str = "story",
+    must_revise: bool = False
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    local = prejudge.prejudge(brief, story, kind=kind, user_tweak=user_tweak)
+    if not local["pass"]:
+        verdict, revised = prejudge.as_verdict(local), None
+        metrics.judge_verdict(verdict)
+    else:
+        try:
+            verdict, revised = await _aask_json(_judge_revise_messages(brief, story, user_tweak),
+                                                lambda raw: _finish_judge_revise(raw, local),
+                                                max_tokens=1700, temperature=0.5, stage="judge_revise")
+            metrics.judge_verdict(verdict)
+        except structured.SchemaError:
+            verdict, revised = await ajudge_story(brief, story, user_tweak, kind), None
+    if verdict.get("pass") and not must_revise:
+        return verdict, None
+    if revised is None:
+        revised = await aedit_story(brief, story, verdict, user_tweak=user_tweak)
+    return verdict, revised
+
+
+@checkpoints.stage("confirm")
+async def aconfirm_story(brief: Dict[str, Any], story: str, user_tweak: str = "", kind: str = "story") -> Dict[str, Any]:
+    if FUSED_CONFIRM == "local":
+        return _local_verdict(brief, story, user_tweak, kind)
+    return await ajudge_story(brief, story, user_tweak, kind)
+
+
+@metrics.flow("generate_story")
+def generate_story(
+    user_request: str,
+    max_rounds: int = 2,
+    candidates: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    deadline: Optional[float] = None,
+    use_pool: bool = True
+) -> Dict[str, Any]:
     """
     Short-story flow: Classify -> Storyteller -> Judge (+Editor if needed) -> Judge
+    With candidates > 1 the first draft is best-of-N (see agenerate_story);
+    that runs its own event loop, so inside one await agenerate_story instead
+    (RuntimeError otherwise). With JUDGE_MODE=fused each round is one judge_and_revise call.
+    Generic requests may be served from the warm story pool (`use_pool`).
     """
-    brief = classify_request(user_request)
+    candidates = STORY_CANDIDATES if candidates is None else candidates
+    if candidates > 1:
+        return _run_async(agenerate_story(
+            user_request, max_rounds, candidates, concurrency, deadline, use_pool))
+
+    match = _known_request(user_request)
+    instant = _instant_story(user_request, match, use_pool)
+    if instant is not None:
+        return instant
+    brief = match["brief"] if match else classify_request(user_request)
+    return _remember_request(user_request, brief, write_story(brief, max_rounds))
+
+
+def write_story(brief: Dict[str, Any], max_rounds: int = 2) -> Dict[str, Any]:
+    """Storyteller -> Judge (+Editor if needed) -> Judge for an existing brief."""
     story = tell_story(brief)
     history: List[Dict[str, Any]] = []
 
+    fused = JUDGE_MODE == "fused"
+
     for round_idx in range(1, max_rounds + 1):
-        verdict = judge_story(brief, story)
+        metrics.set_round(round_idx)
+        if fused:
+            verdict, revised = judge_and_revise(brief, story)
+        else:
+            verdict, revised = judge_story(brief, story), None
         history.append({"round": round_idx, "verdict": verdict})
         if verdict.get("pass"):
             return {"brief": brief, "story": story, "history": history, "passed": True}
-        story = edit_story(brief, story, verdict)
+        story = revised if revised is not None else edit_story(brief, story, verdict)
 
-    final_verdict = judge_story(brief, story)
+    metrics.set_round(max_rounds + 1)
+    final_verdict = confirm_story(brief, story) if fused else judge_story(brief, story)
     history.append({"round": max_rounds + 1, "verdict": final_verdict})
     return {"brief": brief, "story": story, "history": history, "passed": final_verdict.get("pass", False)}
 
 
+@metrics.flow("pool_fill")
+def pool_story(category: str, moral: str) -> Optional[Tuple[Dict[str, Any], str, List[Dict[str, Any]]]]:
+    """Warm-pool producer (pool.PoolFiller): a judge-passed story for the key, or None."""
+    with dedup.read_only():
+        brief = classify_request(f"A {category.replace('-', ' ')} bedtime story about {moral}.")
+    brief.update(category=category, moral=moral)
+    result = write_story(brief)
+    if not result["passed"]:
+        return None
+    return result["brief"], result["story"], result["history"]
+
+
+def _run_async(coro):
+    """
+    Run a pipeline coroutine from sync code on a fresh loop, closing its
+    client after. Inside a running event loop (asyncio.run can't nest) it
+    raises RuntimeError naming the coroutine to await instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError(f"sync pipeline entry point called inside a running event loop; "
+                           f"await pipeline.{coro.__qualname__}() instead")
+
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await aclose()
+    return asyncio.run(runner())
+
+
+def _rank(verdict: Dict[str, Any]) -> Tuple[bool, float]:
+    return bool(verdict.get("pass")), float(verdict.get("scores", {}).get("average") or 0)
+
+
+def _succeeded(task: asyncio.Task) -> bool:
+    return not task.cancelled() and task.exception() is None
+
+
+async def _best_candidate(
+    brief: Dict[str, Any],
+    n: int,
+    concurrency: int,
+    deadline: Optional[float]
+) -> Tuple[str, Dict[str, Any], int]:
+    """
+    Draft and judge `n` stories concurrently (at most `concurrency` at once).
+    After `deadline` seconds we stop waiting as soon as one draft is judged.
+    Returns (story, verdict, candidates_judged) for the best draft.
+    """
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def candidate(index: int):
+        async with limit:
+            with checkpoints.branch(f"candidate-{index}"):
+                # Never serve drafts from the cache: they'd all be the same story
+                story = await atell_story(brief, cache=False)
+                return story, await ajudge_story(brief, story)
+
+    tasks = [asyncio.create_task(candidate(i)) for i in range(n)]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=deadline or None)
+        # Past the deadline with nothing usable yet: take the first draft that finishes
+        while pending and not any(_succeeded(t) for t in done):
+            more, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            done |= more
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    results = [t.result() for t in done if _succeeded(t)]
+    if not results:
+        # A cancelled candidate has no exception to re-raise (exception() would raise)
+        errors = [t.exception() for t in done if not t.cancelled()]
+        raise errors[0] if errors else RuntimeError("every story candidate was cancelled")
+    story, verdict = max(results, key=lambda r: _rank(r[1]))
+    return story, verdict, len(results)
+
+
+async def agenerate_story(
+    user_request: str,
+    max_rounds: int = 2,
+    candidates: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    deadline: Optional[float] = None,
+    use_pool: bool = True
+) -> Dict[str, Any]:
+    """
+    Async short-story flow. With candidates > 1, N storyteller drafts are
+    written and judged concurrently and the best passing one is returned;
+    the editor only runs if none pass.
+    """
+    candidates = STORY_CANDIDATES if candidates is None else candidates
+    concurrency = CANDIDATE_CONCURRENCY if concurrency is None else concurrency
+    deadline = CANDIDATE_DEADLINE if deadline is None else deadline
+
+    with metrics.flow("generate_story"):
+        metrics.set_round(1)
+        match = await _aknown_request(user_request)
+        instant = await _ainstant_story(user_request, match, use_pool)
+        if instant is not None:
+            return instant
+        brief = match["brief"] if match else await aclassify_request(user_request)
+        verdict: Optional[Dict[str, Any]] = None
+        judged = 1
+        if candidates > 1:
+            story, verdict, judged = await _best_candidate(brief, candidates, concurrency, deadline)
+        else:
+            story = await atell_story(brief)
+        history: List[Dict[str, Any]] = []
+        fused = JUDGE_MODE == "fused"
+
+        for round_idx in range(1, max_rounds + 1):
+            metrics.set_round(round_idx)
+            revised = None
+            if verdict is None:
+                if fused:
+                    verdict, revised = await ajudge_and_revise(brief, story)
+                else:
+                    verdict = await ajudge_story(brief, story)
+            history.append({"round": round_idx, "verdict": verdict})
+            if round_idx == 1 and candidates > 1:
+                history[-1]["candidates"] = judged
+            if verdict.get("pass"):
+                return await _aremember_request(user_request, brief,
+                                               {"brief": brief, "story": story, "history": history, "passed": True})
+            story = revised if revised is not None else await aedit_story(brief, story, verdict)
+            verdict = None
+
+        metrics.set_round(max_rounds + 1)
+        final_verdict = await (aconfirm_story(brief, story) if fused else ajudge_story(brief, story))
+        history.append({"round": max_rounds + 1, "verdict": final_verdict})
+        return await _aremember_request(user_request, brief, {"brief": brief, "story": story, "history": history,
+                                                              "passed": final_verdict.get("pass", False)})
+
+
+def _sanitized_stream(messages: List[Dict[str, str]], parts: List[str], **kwargs: Any) -> Iterator[str]:
+    """chat_stream with the story cleanup applied on the fly; cleaned text is also appended to `parts`."""
+    sanitizer = StorySanitizer()
+    for delta in chat_stream(messages, **kwargs):
+        cleaned = sanitizer.feed(delta)
+        if cleaned:
+            parts.append(cleaned)
+            yield cleaned
+    tail = sanitizer.finish()
+    if tail:
+        parts.append(tail)
+        yield tail
+
+
+def generate_story_events(user_request: str, max_rounds: int = 2) -> Iterator[Tuple[str, Any]]:
+    """
+    Streaming version of generate_story. Yields (event, data) pairs:
+    brief, token (sanitized storyteller/editor deltas), story (full sanitized text),
+    verdict, editing, and finally done with the same dict generate_story returns.
+    """
+    match = _known_request(user_request)
+    instant = _instant_story(user_request, match, use_pool=True)
+    if instant is not None:
+        yield "brief", instant["brief"]
+        yield "story", instant["story"]
+        yield "done", instant
+        return
+    brief = match["brief"] if match else classify_request(user_request)
+    yield "brief", brief
+
+    parts: List[str] = []
+    for delta in _sanitized_stream(_storyteller_messages(brief), parts, max_tokens=1200, temperature=0.8, stage="storyteller"):
+        yield "token", delta
+    story = "".join(parts)
+    yield "story", story
+    history: List[Dict[str, Any]] = []
+    fused = JUDGE_MODE == "fused"
+
+    for round_idx in range(1, max_rounds + 1):
+        metrics.set_round(round_idx)
+        if fused:
+            verdict, revised = judge_and_revise(brief, story)
+        else:
+            verdict, revised = judge_story(brief, story), None
+        history.append({"round": round_idx, "verdict": verdict})
+        yield "verdict", history[-1]
+        if verdict.get("pass"):
+            yield "done", _remember_request(user_request, brief,
+                                            {"brief": brief, "story": story, "history": history, "passed": True})
+            return
+
+        yield "editing", {"round": round_idx, "mode": "fused" if fused else EDIT_MODE}
+        if revised is not None:
+            story = revised
+        elif EDIT_MODE == "patch":
+            # Patches are small JSON; nothing worth streaming
+            story = edit_story(brief, story, verdict)
+        else:
+            parts = []
+            for delta in _sanitized_stream(_editor_messages(brief, story, verdict), parts, max_tokens=1200, temperature=0.6, stage="editor"):
+                yield "token", delta
+            story = "".join(parts)
+        yield "story", story
+
+    metrics.set_round(max_rounds + 1)
+    final_verdict = confirm_story(brief, story) if fused else judge_story(brief, story)
+    history.append({"round": max_rounds + 1, "verdict": final_verdict})
+    yield "verdict", history[-1]
+    yield "done", _remember_request(user_request, brief, {"brief": brief, "story": story, "history": history,
+                                                          "passed": final_verdict.get("pass", False)})
+
+
+async def _asanitized_stream(messages: List[Dict[str, str]], parts: List[str],
+                             **kwargs: Any) -> AsyncIterator[str]:
+    """achat_stream with the story cleanup applied on the fly (see _sanitized_stream)."""
+    sanitizer = StorySanitizer()
+    async for delta in achat_stream(messages, **kwargs):
+        cleaned = sanitizer.feed(delta)
+        if cleaned:
+            parts.append(cleaned)
+            yield cleaned
+    tail = sanitizer.finish()
+    if tail:
+        parts.append(tail)
+        yield tail
+
+
+async def agenerate_story_events(user_request: str, max_rounds: int = 2) -> AsyncIterator[Tuple[str, Any]]:
+    """Async generator version of generate_story_events (same events)."""
+    with metrics.flow("generate_story"):
+        match = await _aknown_request(user_request)
+        instant = await _ainstant_story(user_request, match, use_pool=True)
+        if instant is not None:
+            yield "brief", instant["brief"]
+            yield "story", instant["story"]
+            yield "done", instant
+            return
+        brief = match["brief"] if match else await aclassify_request(user_request)
+        yield "brief", brief
+
+        parts: List[str] = []
+        async for delta in _asanitized_stream(_storyteller_messages(brief), parts, max_tokens=1200,
+                                              temperature=0.8, stage="storyteller"):
+            yield "token", delta
+        story = "".join(parts)
+        yield "story", story
+        history: List[Dict[str, Any]] = []
+        fused = JUDGE_MODE == "fused"
+
+        for round_idx in range(1, max_rounds + 1):
+            metrics.set_round(round_idx)
+            if fused:
+                verdict, revised = await ajudge_and_revise(brief, story)
+            else:
+                verdict, revised = await ajudge_story(brief, story), None
+            history.append({"round": round_idx, "verdict": verdict})
+            yield "verdict", history[-1]
+            if verdict.get("pass"):
+                yield "done", await _aremember_request(user_request, brief, {"brief": brief, "story": story,
+                                                                             "history": history, "passed": True})
+                return
+
+            yield "editing", {"round": round_idx, "mode": "fused" if fused else EDIT_MODE}
+            if revised is not None:
+                story = revised
+            elif EDIT_MODE == "patch":
+                story = await aedit_story(brief, story, verdict)
+            else:
+                parts = []
+                async for delta in _asanitized_stream(_editor_messages(brief, story, verdict), parts,
+                                                      max_tokens=1200, temperature=0.6, stage="editor"):
+                    yield "token", delta
+                story = "".join(parts)
+            yield "story", story
+
+        metrics.set_round(max_rounds + 1)
+        final_verdict = await (aconfirm_story(brief, story) if fused else ajudge_story(brief, story))
+        history.append({"round": max_rounds + 1, "verdict": final_verdict})
+        yield "verdict", history[-1]
+        yield "done", await _aremember_request(user_request, brief, {"brief": brief, "story": story,
+                                                                     "history": history,
+                                                                     "passed": final_verdict.get("pass", False)})
+
+
+@metrics.flow("apply_tweak")
 def apply_tweak(
     brief: Dict[str, Any],
     current_story: str,
     tweak_text: str,
-    rounds: int = 2
+    rounds: int = 2,
+    kind: str = "story"
 ) -> Tuple[str, Dict[str, Any]]:
     """
     Apply user-supplied tweak to a story or chapter via Editor -> Judge loop.
     """
-    verdict = judge_story(brief, current_story, user_tweak=tweak_text)
+    if JUDGE_MODE == "fused":
+        return _apply_tweak_fused(brief, current_story, tweak_text, rounds, kind)
+
+    metrics.set_round("tweak-0")
+    verdict = judge_story(brief, current_story, user_tweak=tweak_text, kind=kind)
     existing = verdict.get("edit_instructions", "")
     verdict["edit_instructions"] = (
         existing + " USER TWEAK: " + tweak_text).strip()
 
     story = current_story
-    for _ in range(max(1, rounds)):
+    for round_idx in range(1, max(1, rounds) + 1):
         story = edit_story(brief, story, verdict, user_tweak=tweak_text)
-        verdict = judge_story(brief, story, user_tweak=tweak_text)
-        if verdict.get("pass") and verdict.get("scores", {}).get("requirements_satisfaction", 8) >= 8:
+        metrics.set_round(f"tweak-{round_idx}")
+        verdict = judge_story(brief, story, user_tweak=tweak_text, kind=kind)
+        if _tweak_done(verdict):
             break
 
     return story, verdict
 
 
+def _tweak_done(verdict: Dict[str, Any]) -> bool:
+    return bool(verdict.get("pass")) and verdict.get("scores", {}).get("requirements_satisfaction", 8) >= 8
+
+
+def _apply_tweak_fused(
+    brief: Dict[str, Any],
+    current_story: str,
+    tweak_text: str,
+    rounds: int,
+    kind: str
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    apply_tweak with judge_and_revise: the first call applies the tweak, later
+    calls judge the result (revising again if it fails); the last round only
+    confirms. Two calls when the first revision passes.
+    """
+    metrics.set_round("tweak-0")
+    _, story = judge_and_revise(brief, current_story, user_tweak=tweak_text, kind=kind, must_revise=True)
+    rounds = max(1, rounds)
+    for round_idx in range(1, rounds):
+        metrics.set_round(f"tweak-{round_idx}")
+        verdict, revised = judge_and_revise(brief, story, user_tweak=tweak_text, kind=kind)
+        if _tweak_done(verdict):
+            return story, verdict
+        story = revised if revised is not None else edit_story(brief, story, verdict, user_tweak=tweak_text)
+    metrics.set_round(f"tweak-{rounds}")
+    return story, confirm_story(brief, story, user_tweak=tweak_text, kind=kind)
+
+
+async def aapply_tweak(
+    brief: Dict[str, Any],
+    current_story: str,
+    tweak_text: str,
+    rounds: int = 2,
+    kind: str = "story"
+) -> Tuple[str, Dict[str, Any]]:
+    """Coroutine version of apply_tweak."""
+    with metrics.flow("apply_tweak"):
+        if JUDGE_MODE == "fused":
+            return await _aapply_tweak_fused(brief, current_story, tweak_text, rounds, kind)
+
+        metrics.set_round("tweak-0")
+        verdict = await ajudge_story(brief, current_story, user_tweak=tweak_text, kind=kind)
+        existing = verdict.get("edit_instructions", "")
+        verdict["edit_instructions"] = (
+            existing + " USER TWEAK: " + tweak_text).strip()
+
+        story = current_story
+        for round_idx in range(1, max(1, rounds) + 1):
+            story = await aedit_story(brief, story, verdict, user_tweak=tweak_text)
+            metrics.set_round(f"tweak-{round_idx}")
+            verdict = await ajudge_story(brief, story, user_tweak=tweak_text, kind=kind)
+            if _tweak_done(verdict):
+                break
+
+        return story, verdict
+
+
+async def _aapply_tweak_fused(
+    brief: Dict[str, Any],
+    current_story: str,
+    tweak_text: str,
+    rounds: int,
+    kind: str
+) -> Tuple[str, Dict[str, Any]]:
+    metrics.set_round("tweak-0")
+    _, story = await ajudge_and_revise(brief, current_story, user_tweak=tweak_text, kind=kind, must_revise=True)
+    rounds = max(1, rounds)
+    for round_idx in range(1, rounds):
+        metrics.set_round(f"tweak-{round_idx}")
+        verdict, revised = await ajudge_and_revise(brief, story, user_tweak=tweak_text, kind=kind)
+        if _tweak_done(verdict):
+            return story, verdict
+        story = revised if revised is not None else await aedit_story(brief, story, verdict, user_tweak=tweak_text)
+    metrics.set_round(f"tweak-{rounds}")
+    return story, await aconfirm_story(brief, story, user_tweak=tweak_text, kind=kind)
+
+
 # -------------------- Multi-arc / chapter helpers --------------------
 
 def _concat_chapters(chapters: List[str]) -> str:
@@ -172,59 +933,430 @@ def _concat_chapters(chapters: List[str]) -> str:
     return "\n\n".join(chapters).strip()
 
 
-def generate_first_chapter(brief: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
-    """
-    Create chapter 1 using the CHAPTER storyteller + judge/edit loop.
-    Returns (chapter_text, verdict).
-    """
-    messages = [
+def _chapter_messages(brief: Dict[str, Any], story_so_far: str, end_now: bool) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": CHAPTER_STORYTELLER_SYSTEM},
         {"role": "user", "content": CHAPTER_USER_TEMPLATE.format(
             brief_json=json.dumps(brief),
-            story_so_far="",
-            end_now="false"
+            story_so_far=story_so_far,
+            end_now=str(end_now).lower()
         )}
     ]
-    chapter = chat(messages, max_tokens=900, temperature=0.8)
-    chapter = _sanitize_story_text(chapter)
 
-    verdict = judge_story(brief, chapter)
+
+@checkpoints.stage("chapter")
+def _draft_chapter(brief: Dict[str, Any], story_so_far: str, end_now: bool) -> str:
+    chapter = chat(_chapter_messages(brief, story_so_far, end_now),
+                   max_tokens=900, temperature=0.8, stage="chapter")
+    return _sanitize_story_text(chapter)
+
+
+@metrics.flow("chapter")
+def _write_chapter(brief: Dict[str, Any], story_so_far: str, end_now: bool) -> Tuple[str, Dict[str, Any]]:
+    """CHAPTER storyteller + judge, with one editing pass if needed."""
+    metrics.set_round("chapter")
+    chapter = _draft_chapter(brief, story_so_far, end_now)
+    verdict = judge_story(brief, chapter, kind="chapter")
     if verdict.get("pass"):
         return chapter, verdict
 
     # One editing pass if needed
     chapter = edit_story(brief, chapter, verdict)
-    verdict = judge_story(brief, chapter)
+    verdict = judge_story(brief, chapter, kind="chapter")
     return chapter, verdict
 
 
+@checkpoints.stage("chapter")
+async def _adraft_chapter(brief: Dict[str, Any], story_so_far: str, end_now: bool) -> str:
+    chapter = await achat(_chapter_messages(brief, story_so_far, end_now),
+                          max_tokens=900, temperature=0.8, stage="chapter")
+    return _sanitize_story_text(chapter)
+
+
+async def _ajudged_chapter(brief: Dict[str, Any], chapter: str) -> Tuple[str, Dict[str, Any]]:
+    """Judge a drafted chapter, with one editing pass if needed."""
+    verdict = await ajudge_story(brief, chapter, kind="chapter")
+    if verdict.get("pass"):
+        return chapter, verdict
+
+    chapter = await aedit_story(brief, chapter, verdict)
+    verdict = await ajudge_story(brief, chapter, kind="chapter")
+    return chapter, verdict
+
+
+async def _awrite_chapter(brief: Dict[str, Any], story_so_far: str, end_now: bool) -> Tuple[str, Dict[str, Any]]:
+    """Coroutine version of _write_chapter."""
+    with metrics.flow("chapter"):
+        metrics.set_round("chapter")
+        chapter = await _adraft_chapter(brief, story_so_far, end_now)
+        return await _ajudged_chapter(brief, chapter)
+
+
+def _story_so_far(prior_chapters: List[str], memory: Optional[Dict[str, Any]]) -> str:
+    if memory is not None:
+        return _memory_context(memory, prior_chapters[-1] if prior_chapters else "")
+    return _concat_chapters(prior_chapters)
+
+
+def generate_first_chapter(brief: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Create chapter 1 using the CHAPTER storyteller + judge/edit loop.
+    Returns (chapter_text, verdict).
+    """
+    return _write_chapter(brief, "", end_now=False)
+
+
 def generate_next_chapter(
     brief: Dict[str, Any],
     prior_chapters: List[str],
-    end_now: bool = False
+    end_now: bool = False,
+    memory: Optional[Dict[str, Any]] = None
 ) -> Tuple[str, Dict[str, Any]]:
     """
     Generate the next chapter considering STORY SO FAR and end flag.
     If end_now=True, the chapter must conclude the whole story.
+    With `memory` (see update_story_memory), STORY SO FAR is the rolling
+    summary plus the last chapter verbatim instead of every prior chapter.
     Returns (chapter_text, verdict).
     """
-    story_so_far = _concat_chapters(prior_chapters)
-    messages = [
+    return _write_chapter(brief, _story_so_far(prior_chapters, memory), end_now)
+
+
+async def agenerate_first_chapter(brief: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    return await _awrite_chapter(brief, "", end_now=False)
+
+
+async def agenerate_next_chapter(
+    brief: Dict[str, Any],
+    prior_chapters: List[str],
+    end_now: bool = False,
+    memory: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Dict[str, Any]]:
+    """Coroutine version of generate_next_chapter."""
+    return await _awrite_chapter(brief, _story_so_far(prior_chapters, memory), end_now)
+
+
+# -------------------- Arc start --------------------
+# Chapter 1 only needs a brief. Draft it from the local keyword brief
+# (quickbrief.py) while the LLM classifier runs, then reconcile the two; the
+# chapter is judged against the classifier's brief either way.
+
+async def agenerate_arc_start(user_request: str, fast: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Brief and judged chapter 1 for a new arc. `start` in the result tells how
+    chapter 1 was drafted: "kept"/"renamed"/"provisional" (from the local
+    brief), "redraft", "serial" (fast start off) or "indexed" (known request).
+    Returns {brief, chapter, verdict, start}.
+    """
+    fast = ARC_FAST_START if fast is None else fast
+    with metrics.flow("arc_start"):
+        metrics.set_round("chapter")
+        match = await _aknown_request(user_request)
+        if match or not fast:
+            brief = match["brief"] if match else await aclassify_request(user_request)
+            chapter = await _adraft_chapter(brief, "", False)
+            start = "indexed" if match else "serial"
+        else:
+            provisional = _guard_brief(quickbrief.provisional_brief(user_request))
+            draft = asyncio.ensure_future(_adraft_chapter(provisional, "", False))
+            try:
+                classified = await aclassify_request(user_request)
+                if quickbrief.contradicts(user_request, classified):
+                    draft.cancel()
+                    brief, start = None, "redraft"
+                else:
+                    try:
+                        chapter = await draft
+                    except Exception:
+                        # The provisional draft failed: write chapter 1 from the classified brief
+                        brief, start = None, "redraft"
+                    else:
+                        brief, start = quickbrief.reconcile(user_request, provisional, classified, chapter)
+            finally:
+                draft.cancel()
+            if brief is None:
+                brief = classified
+                chapter = await _adraft_chapter(brief, "", False)
+        metrics.incr("story_arc_starts_total", start=start)
+        chapter, verdict = await _ajudged_chapter(brief, chapter)
+        return {"brief": brief, "chapter": chapter, "verdict": verdict, "start": start}
+
+
+def generate_arc_start(user_request: str, fast: Optional[bool] = None) -> Dict[str, Any]:
+    """Sync entry point for agenerate_arc_start; not for code inside an event loop (await that instead)."""
+    return _run_async(agenerate_arc_start(user_request, fast))
+
+
+# -------------------- Outline-first arcs --------------------
+# A whole arc at once (batch export): plan every chapter in one call, write
+# and judge the chapters concurrently against the plan instead of after each
+# other, then one light continuity pass over the result.
+
+def _outline_messages(brief: Dict[str, Any], chapters: int) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": OUTLINE_SYSTEM.format(chapters=chapters)},
+        {"role": "user", "content": OUTLINE_USER_TEMPLATE.format(
+            brief_json=json.dumps(brief),
+            chapters=chapters
+        )}
+    ]
+
+
+@checkpoints.stage("outline")
+async def aplan_outline(brief: Dict[str, Any], chapters: int) -> Dict[str, Any]:
+    """Story plan: title, characters, setting, beats per chapter and the ending."""
+    try:
+        return await _aask_json(_outline_messages(brief, chapters),
+                                lambda raw: structured.coerce_outline(_parse_json(raw), chapters),
+                                max_tokens=300 + 120 * chapters, temperature=0.7, stage="outline")
+    except structured.SchemaError:
+        return structured.default_outline(brief, chapters)
+
+
+def _plan_text(plan: Dict[str, Any]) -> str:
+    text = f"{plan['title']}: {'; '.join(plan['beats']) or 'continue the story'}"
+    return text + (f" (ends with: {plan['ends_with']})" if plan["ends_with"] else "")
+
+
+def _planned_chapter_messages(brief: Dict[str, Any], outline: Dict[str, Any], index: int) -> List[Dict[str, str]]:
+    plans = outline["chapters"]
+    final = index == len(plans) - 1
+    story_so_far = "\n".join(f"Chapter {i} - {_plan_text(p)}" for i, p in enumerate(plans[:index], 1))
+    chapter_plan = _plan_text(plans[index])
+    if final and outline.get("ending"):
+        chapter_plan += f" Story ending: {outline['ending']}"
+    return [
         {"role": "system", "content": CHAPTER_STORYTELLER_SYSTEM},
-        {"role": "user", "content": CHAPTER_USER_TEMPLATE.format(
+        {"role": "user", "content": OUTLINE_CHAPTER_USER_TEMPLATE.format(
             brief_json=json.dumps(brief),
-            story_so_far=story_so_far,
-            end_now=str(end_now).lower()
+            outline_json=json.dumps(outline),
+            story_so_far=story_so_far or "Nothing yet: this is the first chapter.",
+            end_now=str(final).lower(),
+            number=index + 1,
+            total=len(plans),
+            chapter_plan=chapter_plan
         )}
     ]
-    chapter = chat(messages, max_tokens=900, temperature=0.8)
-    chapter = _sanitize_story_text(chapter)
 
-    verdict = judge_story(brief, chapter)
-    if verdict.get("pass"):
-        return chapter, verdict
 
-    # One editing pass if needed
-    chapter = edit_story(brief, chapter, verdict)
-    verdict = judge_story(brief, chapter)
-    return chapter, verdict
+@checkpoints.stage("chapter")
+async def _adraft_planned_chapter(brief: Dict[str, Any], outline: Dict[str, Any], index: int) -> str:
+    chapter = await achat(_planned_chapter_messages(brief, outline, index),
+                          max_tokens=900, temperature=0.8, stage="chapter")
+    return _sanitize_story_text(chapter)
+
+
+async def _awrite_planned_chapter(brief: Dict[str, Any], outline: Dict[str, Any],
+                                  index: int) -> Tuple[str, Dict[str, Any]]:
+    with metrics.flow("chapter"):
+        metrics.set_round("chapter")
+        chapter = await _adraft_planned_chapter(brief, outline, index)
+        return await _ajudged_chapter(brief, chapter)
+
+
+def _continuity_messages(outline: Dict[str, Any], chapters: List[str]) -> List[Dict[str, str]]:
+    numbered = "\n\n".join(f"CHAPTER {i}:\n{patches.number_paragraphs(ch)}" for i, ch in enumerate(chapters, 1))
+    return [
+        {"role": "system", "content": CONTINUITY_SYSTEM},
+        {"role": "user", "content": CONTINUITY_USER_TEMPLATE.format(
+            outline_json=json.dumps(outline),
+            numbered_chapters=numbered
+        )}
+    ]
+
+
+def _finish_continuity(brief: Dict[str, Any], chapters: List[str], raw: str) -> Dict[str, Any]:
+    """
+    Apply the continuity editor's per-chapter patches. A patch that doesn't
+    fit, or leaves the chapter failing the local checks, is skipped.
+    """
+    edits = _parse_json(raw).get("edits")
+    if not isinstance(edits, list):
+        raise structured.SchemaError("'edits' must be a list")
+    revised = list(chapters)
+    edited = set()
+    for edit in edits:
+        number = edit.get("chapter") if isinstance(edit, dict) else None
+        if isinstance(number, str) and number.strip().isdigit():
+            number = int(number)
+        if not isinstance(number, int) or not 1 <= number <= len(chapters) or number in edited:
+            metrics.incr("story_continuity_edits_total", result="rejected")
+            continue
+        try:
+            patched = _sanitize_story_text(patches.apply_patch(chapters[number - 1], json.dumps({"ops": edit.get("ops")})))
+        except patches.PatchError:
+            metrics.incr("story_continuity_edits_total", result="rejected")
+            continue
+        if not prejudge.prejudge(brief, patched, kind="chapter")["pass"]:
+            metrics.incr("story_continuity_edits_total", result="rejected")
+            continue
+        revised[number - 1] = patched
+        edited.add(number)
+        metrics.incr("story_continuity_edits_total", result="applied")
+    return {"chapters": revised, "edited": sorted(edited)}
+
+
+@checkpoints.stage("continuity")
+async def acheck_continuity(brief: Dict[str, Any], outline: Dict[str, Any], chapters: List[str]) -> Dict[str, Any]:
+    """
+    One pass over the whole arc fixing what separately written chapters
+    disagree on (names, details, order of events), as paragraph patches.
+    Returns {"chapters": [...], "edited": [chapter numbers changed]}.
+    """
+    try:
+        return await _aask_json(_continuity_messages(outline, chapters),
+                                lambda raw: _finish_continuity(brief, chapters, raw),
+                                max_tokens=PATCH_MAX_TOKENS + 150 * len(chapters), temperature=0.2,
+                                stage="continuity")
+    except structured.SchemaError:
+        return {"chapters": list(chapters), "edited": []}
+
+
+async def agenerate_outlined_arc(
+    user_request: str,
+    chapters: int = 4,
+    concurrency: Optional[int] = None,
+    continuity: Optional[bool] = None
+) -> Dict[str, Any]:
+    """
+    Whole multi-chapter story, outline first. Wall time is about one chapter
+    cycle plus the plan and continuity calls, however many chapters there are.
+    Returns {brief, outline, chapters, history, continuity_edits}.
+    """
+    chapters = max(1, chapters)
+    concurrency = OUTLINE_CONCURRENCY if concurrency is None else concurrency
+    continuity = OUTLINE_CONTINUITY if continuity is None else continuity
+
+    with metrics.flow("outline_arc"):
+        metrics.set_round("outline")
+        match = await _aknown_request(user_request)
+        brief = match["brief"] if match else await aclassify_request(user_request)
+        outline = await aplan_outline(brief, chapters)
+
+        limit = asyncio.Semaphore(max(1, concurrency))
+
+        async def write(index: int) -> Tuple[str, Dict[str, Any]]:
+            async with limit:
+                with checkpoints.branch(f"chapter-{index + 1}"):
+                    return await _awrite_planned_chapter(brief, outline, index)
+
+        written = await asyncio.gather(*(write(i) for i in range(chapters)))
+        texts = [chapter for chapter, _ in written]
+        edited: List[int] = []
+        if continuity and chapters > 1:
+            metrics.set_round("continuity")
+            checked = await acheck_continuity(brief, outline, texts)
+            texts, edited = checked["chapters"], checked["edited"]
+
+        history = [{"round": f"chapter-{i} (final)" if i == chapters else f"chapter-{i}", "verdict": verdict}
+                   for i, (_, verdict) in enumerate(written, 1)]
+        return {"brief": brief, "outline": outline, "chapters": texts, "history": history,
+                "continuity_edits": edited}
+
+
+def generate_outlined_arc(user_request: str, chapters: int = 4, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Sync entry point for agenerate_outlined_arc (batch export). It runs its
+    own event loop: async code must await agenerate_outlined_arc instead.
+    """
+    return _run_async(agenerate_outlined_arc(user_request, chapters, **kwargs))
+
+
+# -------------------- Rolling story memory --------------------
+
+def empty_memory() -> Dict[str, Any]:
+    return {"summary": "", "characters": [], "setting": "", "open_threads": [], "chapters_folded": 0}
+
+
+def _fit_memory(memory: Dict[str, Any], budget_tokens: int) -> Dict[str, Any]:
+    """Trim the memory to the token budget: oldest summary sentences go first, then threads."""
+    def size() -> int:
+        return estimate_tokens(json.dumps(memory))
+
+    sentences = re.split(r"(?<=[.!?])\s+", memory.get("summary", "").strip())
+    while size() > budget_tokens and len(sentences) > 1:
+        sentences.pop(0)
+        memory["summary"] = " ".join(sentences)
+    while size() > budget_tokens and memory.get("open_threads"):
+        memory["open_threads"].pop(0)
+    return memory
+
+
+def _memory_messages(memory: Dict[str, Any], chapter: str, budget_tokens: int) -> List[Dict[str, str]]:
+    # ~0.75 words per token; leave room for the ledger
+    max_words = max(40, int(budget_tokens * 0.75 * 0.6))
+    return [
+        {"role": "system", "content": MEMORY_SYSTEM.format(max_words=max_words)},
+        {"role": "user", "content": MEMORY_USER_TEMPLATE.format(
+            memory_json=json.dumps(memory),
+            chapter=chapter
+        )}
+    ]
+
+
+def _merge_memory(memory: Dict[str, Any], updated: Dict[str, Any], folded: int,
+                  budget_tokens: int) -> Dict[str, Any]:
+    new_memory = {
+        "summary": str(updated.get("summary", memory.get("summary", ""))),
+        "characters": updated.get("characters") or memory.get("characters", []),
+        "setting": str(updated.get("setting", memory.get("setting", ""))),
+        "open_threads": list(updated.get("open_threads", [])),
+    }
+    new_memory = _fit_memory(new_memory, budget_tokens)
+    new_memory["chapters_folded"] = folded + 1
+    return new_memory
+
+
+@checkpoints.stage("memory")
+def update_story_memory(
+    memory: Optional[Dict[str, Any]],
+    chapter: str,
+    budget_tokens: int = MEMORY_TOKEN_BUDGET
+) -> Dict[str, Any]:
+    """
+    Fold one more chapter into the running summary + character/setting ledger.
+    The result stays within roughly `budget_tokens`, however long the arc gets.
+    """
+    memory = dict(memory or empty_memory())
+    folded = memory.pop("chapters_folded", 0)
+    try:
+        updated = _ask_json(_memory_messages(memory, chapter, budget_tokens), _parse_json,
+                            max_tokens=budget_tokens + 100, temperature=0.2, stage="memory")
+    except structured.SchemaError:
+        updated = {}  # keep the previous memory rather than failing the chapter
+    return _merge_memory(memory, updated, folded, budget_tokens)
+
+
+@checkpoints.stage("memory")
+async def aupdate_story_memory(
+    memory: Optional[Dict[str, Any]],
+    chapter: str,
+    budget_tokens: int = MEMORY_TOKEN_BUDGET
+) -> Dict[str, Any]:
+    """Coroutine version of update_story_memory."""
+    memory = dict(memory or empty_memory())
+    folded = memory.pop("chapters_folded", 0)
+    try:
+        updated = await _aask_json(_memory_messages(memory, chapter, budget_tokens), _parse_json,
+                                   max_tokens=budget_tokens + 100, temperature=0.2, stage="memory")
+    except structured.SchemaError:
+        updated = {}
+    return _merge_memory(memory, updated, folded, budget_tokens)
+
+
+def _memory_context(memory: Dict[str, Any], last_chapter: str) -> str:
+    """STORY SO FAR text built from the memory and the latest chapter."""
+    characters = "; ".join(
+        f"{c.get('name', '')} ({c.get('traits', '')})" if isinstance(c, dict) else str(c)
+        for c in memory.get("characters", [])
+    )
+    threads = "; ".join(str(t) for t in memory.get("open_threads", []))
+    parts = [
+        f"SUMMARY OF EARLIER CHAPTERS: {memory.get('summary') or 'None'}",
+        f"CHARACTERS: {characters or 'None'}",
+        f"SETTING: {memory.get('setting') or 'None'}",
+        f"OPEN THREADS: {threads or 'None'}",
+    ]
+    if last_chapter:
+        parts.append("LATEST CHAPTER (verbatim):\n" + last_chapter)
+    return "\n".join(parts).strip()
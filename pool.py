@@ -0,0 +1,294 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+import ratelimit
+from dedup import features
+from keywords import CATEGORY_WORDS, MORAL_WORDS, word_map
+from structured import BRIEF_CATEGORIES
+
+log = logging.getLogger(__name__)
+
+# Warm pool of judge-passed stories per (category, moral), served to generic
+# requests ("a calm story about kindness") without waiting for the pipeline.
+# Off by default: filling it spends LLM calls in the background.
+POOL_ENABLED = os.getenv("STORY_POOL", "0") == "1"
+POOL_PATH = os.getenv("STORY_POOL_PATH", ".cache/story_pool.sqlite3")
+POOL_SIZE = int(os.getenv("STORY_POOL_SIZE", "2"))
+POOL_MORALS = [m.strip().lower() for m in os.getenv(
+    "STORY_POOL_MORALS", "kindness,sharing,courage,patience,honesty,friendship").split(",") if m.strip()]
+POOL_CATEGORIES = [c.strip() for c in os.getenv(
+    "STORY_POOL_CATEGORIES", ",".join(BRIEF_CATEGORIES)).split(",") if c.strip()]
+# Stories older than this are thrown away instead of served
+POOL_MAX_AGE = float(os.getenv("STORY_POOL_MAX_AGE", str(7 * 24 * 3600)))
+# Filler sleep when every slot is full (it also wakes up on each take)
+POOL_INTERVAL = float(os.getenv("STORY_POOL_INTERVAL", "30"))
+# A (category, moral) whose story failed is skipped for STORY_POOL_INTERVAL,
+# doubling per consecutive failure up to this many seconds
+POOL_BACKOFF_MAX = float(os.getenv("STORY_POOL_BACKOFF_MAX", "3600"))
+# A slot claimed by a filler that never finished is released after this
+FILL_TIMEOUT = 600.0
+
+AGE_BUCKETS = (60, 600, 3600, 6 * 3600, 24 * 3600, 3 * 24 * 3600, 7 * 24 * 3600)
+
+READY, FILLING = "ready", "filling"
+
+# Words a request may contain and still count as generic, besides the moral
+# and category keywords (keywords.py)
+_GENERIC_WORDS = features("""
+calm gentle cozy sleepy sleep quiet soft sweet nice happy good short simple lovely
+night time fun funny magical warm soothing relaxing peaceful new any random something
+""")
+
+_MORAL_BY_WORD = word_map({m: m for m in POOL_MORALS},
+                          {m: words for m, words in MORAL_WORDS.items() if m in POOL_MORALS})
+# Category hints (a dragon, a zoo) are left out: they ask for something specific
+_CATEGORY_BY_WORD = word_map({c: w for c, w in CATEGORY_WORDS.items() if c in POOL_CATEGORIES})
+
+
+def match_request(request: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    (category, moral) for a generic request, either possibly None (= any);
+    None if the request asks for anything specific (characters, places...).
+    """
+    feats = features(request)
+    moral = category = None
+    for word in feats:
+        if word in _MORAL_BY_WORD:
+            moral = moral or _MORAL_BY_WORD[word]
+        elif word in _CATEGORY_BY_WORD:
+            category = category or _CATEGORY_BY_WORD[word]
+        elif word not in _GENERIC_WORDS:
+            return None
+    return category, moral
+
+
+# -------------------- Store --------------------
+
+class StoryPool:
+    """
+    SQLite table of pooled stories shared by every worker on the machine.
+    Fillers claim a slot (status 'filling') before writing, so concurrent
+    fillers don't overshoot; take() removes the entry it serves.
+    """
+
+    def __init__(self, path: str = POOL_PATH, size: int = POOL_SIZE, max_age: float = POOL_MAX_AGE):
+        self.path = path
+        self.size = size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.wake = threading.Event()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pool (
+                id TEXT PRIMARY KEY,
+                category TEXT NOT NULL,
+                moral TEXT NOT NULL,
+                status TEXT NOT NULL,
+                brief TEXT,
+                story TEXT,
+                history TEXT,
+                created_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS pool_key ON pool (category, moral, status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _expire(self, conn: sqlite3.Connection, now: float) -> None:
+        stale = conn.execute("DELETE FROM pool WHERE status = ? AND created_at < ?",
+                             (READY, now - self.max_age)).rowcount
+        if stale:
+            metrics.incr("story_pool_discards_total", stale, reason="stale")
+        conn.execute("DELETE FROM pool WHERE status = ? AND created_at < ?", (FILLING, now - FILL_TIMEOUT))
+
+    def take(self, category: Optional[str] = None, moral: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Remove and return the oldest fresh story for the key (None = any),
+        as {brief, story, history, age}; None if the pool has none.
+        """
+        now = time.time()
+        conn = self._conn()
+        self._expire(conn, now)
+        for _ in range(3):
+            row = conn.execute(
+                "SELECT id, brief, story, history, created_at FROM pool WHERE status = ? "
+                "AND (? IS NULL OR category = ?) AND (? IS NULL OR moral = ?) "
+                "ORDER BY created_at LIMIT 1",
+                (READY, category, category, moral, moral)).fetchone()
+            if row is None:
+                break
+            # Another worker may have served it in the meantime
+            if conn.execute("DELETE FROM pool WHERE id = ?", (row[0],)).rowcount:
+                self._count(hit=True)
+                self.wake.set()
+                age = now - row[4]
+                metrics.observe("story_pool_age_seconds", age, AGE_BUCKETS)
+                return {"brief": json.loads(row[1]), "story": row[2],
+                        "history": json.loads(row[3]), "age": round(age, 1)}
+        self._count(hit=False)
+        self.wake.set()
+        return None
+
+    def claim(self, keys: List[Tuple[str, str]]) -> Optional[Tuple[str, str, str]]:
+        """Reserve a slot for the key with the biggest shortfall: (slot id, category, moral)."""
+        now = time.time()
+        conn = self._conn()
+        with self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(conn, now)
+                have = {(c, m): n for c, m, n in conn.execute(
+                    "SELECT category, moral, COUNT(*) FROM pool GROUP BY category, moral")}
+                short = [(self.size - have.get(k, 0), k) for k in keys if have.get(k, 0) < self.size]
+                if not short:
+                    conn.execute("COMMIT")
+                    return None
+                _, (category, moral) = max(short, key=lambda s: s[0])
+                slot = uuid.uuid4().hex
+                conn.execute("INSERT INTO pool (id, category, moral, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                             (slot, category, moral, FILLING, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return slot, category, moral
+
+    def fill(self, slot: str, brief: Dict[str, Any], story: str, history: List[Dict[str, Any]]) -> None:
+        self._conn().execute(
+            "UPDATE pool SET status = ?, brief = ?, story = ?, history = ?, created_at = ? WHERE id = ?",
+            (READY, json.dumps(brief), story, json.dumps(history), time.time(), slot))
+
+    def release(self, slot: str) -> None:
+        self._conn().execute("DELETE FROM pool WHERE id = ?", (slot,))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*), MIN(created_at) FROM pool GROUP BY status").fetchall()
+        by_status = {status: (count, oldest) for status, count, oldest in rows}
+        ready, oldest = by_status.get(READY, (0, None))
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "ready": ready,
+            "filling": by_status.get(FILLING, (0, None))[0],
+            "target": self.size * len(POOL_CATEGORIES) * len(POOL_MORALS),
+            "oldest_age": round(now - oldest, 1) if oldest else 0.0,
+        }
+
+
+# One pool per process (connections are per thread inside it)
+_pool = None
+
+
+def get_pool() -> StoryPool:
+    global _pool
+    if _pool is None:
+        _pool = StoryPool()
+    return _pool
+
+
+def stats() -> Dict[str, Any]:
+    return get_pool().stats()
+
+
+# -------------------- Filler --------------------
+
+class PoolFiller:
+    """
+    Background thread topping the pool up, one story at a time. `produce`
+    is (category, moral) -> (brief, story, history) for a judge-passed
+    story, or None if the story didn't pass.
+    """
+
+    def __init__(self, produce: Callable[[str, str], Optional[Tuple[Dict[str, Any], str, List[Dict[str, Any]]]]],
+                 pool: Optional[StoryPool] = None, interval: float = POOL_INTERVAL):
+        self.produce = produce
+        self.pool = pool or get_pool()
+        self.interval = interval
+        self.keys = [(c, m) for c in POOL_CATEGORIES for m in POOL_MORALS]
+        # key -> (consecutive failures, time.monotonic() before which it is skipped)
+        self._backoff: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "PoolFiller":
+        self._thread = threading.Thread(target=self._loop, name="story-pool-filler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.pool.wake.set()
+
+    def _due_keys(self) -> List[Tuple[str, str]]:
+        now = time.monotonic()
+        return [k for k in self.keys if self._backoff.get(k, (0, 0.0))[1] <= now]
+
+    def _failed(self, key: Tuple[str, str]) -> None:
+        failures = self._backoff.get(key, (0, 0.0))[0] + 1
+        delay = min(POOL_BACKOFF_MAX, self.interval * 2 ** (failures - 1))
+        self._backoff[key] = (failures, time.monotonic() + delay)
+
+    def fill_once(self) -> bool:
+        """
+        Produce one story for the emptiest key. False if there was nothing to
+        do (pool full, or every short key backing off) or the story failed,
+        so the caller waits before the next one.
+        """
+        claimed = self.pool.claim(self._due_keys())
+        if claimed is None:
+            return False
+        slot, category, moral = claimed
+        try:
+            with ratelimit.priority("batch"):
+                made = self.produce(category, moral)
+        except Exception:
+            self.pool.release(slot)
+            self._failed((category, moral))
+            raise
+        if made is None:
+            self.pool.release(slot)
+            self._failed((category, moral))
+            metrics.incr("story_pool_discards_total", reason="failed_judge")
+            return False
+        self._backoff.pop((category, moral), None)
+        self.pool.fill(slot, *made)
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.fill_once():
+                    continue
+            except Exception:
+                log.exception("story pool fill failed")
+            self.pool.wake.wait(self.interval)
+            self.pool.wake.clear()
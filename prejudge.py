@@ -0,0 +1,211 @@
+import functools
+import re
+import threading
+from collections import deque
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Target word ranges from the storyteller prompts
+WORD_RANGES = {"story": (400, 700), "chapter": (250, 450)}
+# How far outside the range still counts as "close enough" for the LLM judge
+WORD_SLACK = 0.1
+# Flesch-Kincaid grade above which we flag the text for ages 5-10
+MAX_GRADE = 5.0
+
+_WORD_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?")
+_SENTENCE_RE = re.compile(r"[^.!?]+[.!?]*")
+_VOWEL_GROUP_RE = re.compile(r"[aeiouy]+")
+_MARKDOWN_RE = re.compile(r"\*\*|__|`|^\s*#|^\s*title\s*[:\-]", re.I | re.M)
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n\s*\n")
+
+_stats = {"checked": 0, "short_circuited": 0}
+_stats_lock = threading.Lock()
+
+
+# -------------------- Banned-term automaton --------------------
+
+class TermAutomaton:
+    """
+    Aho-Corasick matcher over lower-cased text. Finds every listed term (and
+    its simple plural) in one pass, only on whole-word boundaries.
+    """
+
+    def __init__(self, terms: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, int]]] = [[]]
+        for term in terms:
+            term = term.strip().lower()
+            if term:
+                self._add(term, term)
+                self._add(term + "s", term)
+        self._build()
+
+    def _add(self, pattern: str, term: str) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((term, len(pattern)))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0) if node else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> List[str]:
+        text = text.lower()
+        found: List[str] = []
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for term, length in self._out[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or not text[start - 1].isalnum()) and \
+                        (end == len(text) or not text[end].isalnum()):
+                    if term not in found:
+                        found.append(term)
+        return found
+
+
+@functools.lru_cache(maxsize=128)
+def _automaton(terms: Tuple[str, ...]) -> TermAutomaton:
+    return TermAutomaton(terms)
+
+
+# -------------------- Metrics --------------------
+
+def _syllables(word: str) -> int:
+    word = word.lower()
+    count = len(_VOWEL_GROUP_RE.findall(word))
+    if word.endswith("e") and not word.endswith(("le", "ee")) and count > 1:
+        count -= 1
+    return max(1, count)
+
+
+def readability(text: str) -> Dict[str, float]:
+    words = _WORD_RE.findall(text)
+    sentences = [s for s in _SENTENCE_RE.findall(text) if _WORD_RE.search(s)]
+    if not words or not sentences:
+        return {"avg_sentence_words": 0.0, "syllables_per_word": 0.0, "fk_grade": 0.0}
+    wps = len(words) / len(sentences)
+    spw = sum(_syllables(w) for w in words) / len(words)
+    return {
+        "avg_sentence_words": round(wps, 2),
+        "syllables_per_word": round(spw, 2),
+        "fk_grade": round(0.39 * wps + 11.8 * spw - 15.59, 2),
+    }
+
+
+# -------------------- Rule engine --------------------
+
+def prejudge(brief: Dict[str, Any], story: str, kind: str = "story", user_tweak: str = "") -> Dict[str, Any]:
+    """
+    Cheap local checks run before the LLM judge.
+    `pass` is False only for unambiguous failures (word count far off,
+    leftover markdown, no plain title line, an avoided multi-word phrase);
+    those go straight to the editor with the generated `edit_instructions`.
+    Soft findings (readability, few blank-line paragraphs, a single avoided
+    word such as "fear", which is often harmless in context) leave the
+    decision to the LLM judge and are reported in `issues`/`local_scores`.
+    """
+    hard: List[str] = []
+    instructions: List[str] = []
+    soft: List[str] = []
+
+    body_lines = (story or "").strip().splitlines()
+    title = body_lines[0].strip() if body_lines else ""
+    body = "\n".join(body_lines[1:]).strip()
+    word_count = len(_WORD_RE.findall(body))
+
+    lo, hi = WORD_RANGES.get(kind, WORD_RANGES["story"])
+    if word_count < lo * (1 - WORD_SLACK) or word_count > hi * (1 + WORD_SLACK):
+        target = (lo + hi) // 2
+        msg = f"Length is {word_count} words; target is {lo}-{hi}."
+        # An explicit user tweak may ask for a different length; let the judge decide
+        if user_tweak:
+            soft.append(msg)
+        else:
+            hard.append(msg)
+            verb = "Expand" if word_count < lo else "Trim"
+            instructions.append(f"{verb} the text to about {target} words.")
+
+    if _MARKDOWN_RE.search(story or ""):
+        hard.append("Contains markdown or a 'Title:' label.")
+        instructions.append(
+            "Remove all markdown symbols (**, #, backticks) and any 'Title:' label.")
+
+    if not title or len(title.split()) > 12 or title.endswith("."):
+        hard.append("First line is not a short plain title.")
+        instructions.append("Put a short plain title alone on the first line.")
+    paragraphs = [p for p in _PARAGRAPH_SPLIT_RE.split(body) if p.strip()]
+    if len(paragraphs) < 3:
+        soft.append(f"Only {len(paragraphs)} blank-line paragraph(s) after the title.")
+
+    banned = _automaton(tuple(sorted(brief.get("avoid_topics", [])))).find(story or "")
+    phrases = [term for term in banned if len(term.split()) > 1]
+    words = [term for term in banned if len(term.split()) == 1]
+    if phrases:
+        hard.append("Mentions avoided topics: " + ", ".join(phrases) + ".")
+        instructions.append(
+            "Remove every mention of: " + ", ".join(phrases) + ", keeping the tone calm and safe.")
+    if words:
+        soft.append("Uses words from avoided topics: " + ", ".join(words) + "; check they are harmless here.")
+
+    scores = readability(body)
+    if scores["fk_grade"] > MAX_GRADE:
+        soft.append(
+            f"Reading level is about grade {scores['fk_grade']}; use shorter sentences and simpler words.")
+
+    with _stats_lock:
+        _stats["checked"] += 1
+        if hard:
+            _stats["short_circuited"] += 1
+
+    return {
+        "pass": not hard,
+        "issues": hard + soft,
+        "edit_instructions": " ".join(instructions),
+        "local_scores": dict(scores, word_count=word_count, paragraphs=len(paragraphs),
+                             banned_terms=banned),
+    }
+
+
+def as_verdict(local: Dict[str, Any]) -> Dict[str, Any]:
+    """Judge-shaped verdict from the local checks alone (usually a failure)."""
+    return {
+        "scores": {},
+        "pass": local["pass"],
+        "issues": local["issues"],
+        "edit_instructions": local["edit_instructions"],
+        "local": local["local_scores"],
+        "source": "local",
+    }
+
+
+def merge(verdict: Dict[str, Any], local: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach local scores and findings to an LLM judge verdict."""
+    verdict["local"] = local["local_scores"]
+    if local["issues"]:
+        verdict["issues"] = list(verdict.get("issues", [])) + local["issues"]
+    return verdict
+
+
+def stats() -> Dict[str, int]:
+    """How many stories were checked locally and how many skipped the LLM judge."""
+    with _stats_lock:
+        return dict(_stats)
@@ -122,6 +122,79 @@ JUDGE VERDICT (JSON):
 Revise the story accordingly and output only the revised story.
 """
 
+JUDGE_REVISE_SYSTEM = """\
+You are a strict *Children's Story Judge-Editor* for ages 5–10. In one reply,
+judge the story and, if needed, revise it.
+
+Rubric (scores 0–10):
+- age_fit, tone, structure, clarity, safety, bedtime_suitability
+- requirements_satisfaction: the story follows the BRIEF and the USER_TWEAK
+Passing criteria: all individual scores ≥ 8 AND average ≥ 8.5
+
+If the story does not pass, OR a USER_TWEAK is given that the story does not
+yet implement, write the revised story: fix every issue, implement the tweak
+(prefer safety if they conflict), keep names/setting and the same length range.
+Its first line is ONLY the title; no markdown or labels anywhere.
+
+Return ONLY valid JSON:
+{
+  "scores": {"age_fit": int, "tone": int, "structure": int, "clarity": int, "safety": int,
+             "bedtime_suitability": int, "requirements_satisfaction": int, "average": float},
+  "pass": boolean,
+  "issues": [ "short bullet..." ],
+  "edit_instructions": "concrete edits you applied",
+  "revised_story": "the full revised story, or an empty string if no revision is needed"
+}
+Scores and pass describe the story AS GIVEN, not your revision.
+"""
+JUDGE_REVISE_USER_TEMPLATE = """\
+BRIEF (JSON):
+{brief_json}
+
+USER_TWEAK:
+{user_tweak}
+
+STORY:
+\"\"\"{story}\"\"\"
+"""
+
+EDITOR_PATCH_SYSTEM = """\
+You are a careful *Children's Story Patch Editor*. Apply the judge's edit
+instructions AND the USER_TWEAK exactly, changing as little text as possible.
+If the tweak conflicts with safety/age rules, prefer safety. Keep the brief,
+tone, names and setting; keep the story 400–700 words (chapters 250–450).
+
+The story is given as numbered paragraphs; [0] is the title.
+Return ONLY valid JSON with the edit operations, applied to the ORIGINAL numbering:
+{
+  "ops": [
+    {"op": "replace", "p": 3, "text": "full new text of paragraph 3"},
+    {"op": "insert", "after": 5, "text": "a new paragraph placed after paragraph 5"},
+    {"op": "delete", "p": 7}
+  ]
+}
+Rules:
+- Only touch paragraphs that must change; each paragraph at most once.
+- "text" is plain prose: no markdown, no labels, no paragraph numbers.
+- Replacing [0] changes the title; never delete [0].
+- If a change affects names or details used elsewhere, replace those paragraphs too.
+"""
+EDITOR_PATCH_USER_TEMPLATE = """\
+BRIEF (JSON):
+{brief_json}
+
+USER_TWEAK (must implement):
+{user_tweak}
+
+STORY (numbered paragraphs):
+{numbered_story}
+
+JUDGE VERDICT (JSON):
+{judge_json}
+
+Return only the JSON edit operations.
+"""
+
 CHAPTER_STORYTELLER_SYSTEM = """\
 You are a *Children's Chapter Storyteller* for ages 5–10.
 Write the next CHAPTER for the story based on the BRIEF and STORY SO FAR.
@@ -151,3 +224,92 @@ END_NOW: {end_now}
 
 Write the next chapter now. Title on first line. Keep it consistent with STORY SO FAR.
 """
+
+MEMORY_SYSTEM = """\
+You are a *Story Memory Keeper* for a multi-chapter children's story.
+Fold the NEW CHAPTER into the existing MEMORY so later chapters stay consistent
+without rereading the whole story.
+Return ONLY valid JSON with these keys:
+- summary: plain-prose recap of the whole story so far (at most {max_words} words)
+- characters: array of {{"name": string, "traits": string}} (keep names exactly as written)
+- setting: short phrase (string)
+- open_threads: array of short strings (unresolved goals, promises, mysteries)
+Drop threads that the new chapter resolved. Never invent events.
+"""
+
+MEMORY_USER_TEMPLATE = """\
+MEMORY (JSON):
+{memory_json}
+
+NEW CHAPTER:
+\"\"\"{chapter}\"\"\"
+
+Return ONLY the updated MEMORY JSON.
+"""
+
+OUTLINE_SYSTEM = """\
+You are a *Story Outline Planner* for multi-chapter children's stories (ages 5–10).
+Plan the whole story from the BRIEF before any chapter is written, so each chapter
+can be written on its own and still fit with the others.
+Return ONLY valid JSON with these keys:
+- title: story title (string)
+- characters: array of {{"name": string, "traits": string}} (fixed names used in every chapter)
+- setting: short phrase (string)
+- chapters: array of exactly {chapters} objects {{"title": string, "beats": [2-4 short strings], "ends_with": string}}
+- ending: how the final chapter wraps up the story (string)
+Each chapter advances the plot with a tiny, safe arc and ends on a soft mini-beat;
+the last chapter ends the whole story calmly. Never plan violence, fear or dark imagery.
+"""
+
+OUTLINE_USER_TEMPLATE = """\
+BRIEF (JSON):
+{brief_json}
+
+CHAPTERS: {chapters}
+
+Return ONLY the story plan JSON.
+"""
+
+OUTLINE_CHAPTER_USER_TEMPLATE = """\
+BRIEF (JSON):
+{brief_json}
+
+STORY PLAN (JSON):
+{outline_json}
+
+STORY SO FAR (as planned; those chapters are being written at the same time):
+\"\"\"{story_so_far}\"\"\"
+
+END_NOW: {end_now}
+
+Write chapter {number} of {total} now, following its plan: {chapter_plan}
+Title on first line. Use the names, traits and setting exactly as in the STORY PLAN.
+"""
+
+CONTINUITY_SYSTEM = """\
+You are a *Story Continuity Editor* for a multi-chapter children's story.
+The chapters were written at the same time from one STORY PLAN. Find places where
+they disagree with each other or with the plan: names, traits, setting details,
+objects, or events mentioned before they happen. Fix only those, changing as little
+text as possible; do not restyle or shorten anything else.
+
+Each chapter is given as numbered paragraphs; [0] is its title.
+Return ONLY valid JSON:
+{
+  "edits": [
+    {"chapter": 2, "ops": [{"op": "replace", "p": 3, "text": "full new text of paragraph 3"}]}
+  ]
+}
+Ops are "replace" and "delete" (with "p") or "insert" (with "after"), on the chapter's
+ORIGINAL numbering; each paragraph at most once. Return {"edits": []} if nothing needs fixing.
+"""
+
+CONTINUITY_USER_TEMPLATE = """\
+STORY PLAN (JSON):
+{outline_json}
+
+CHAPTERS:
+{numbered_chapters}
+
+Return only the JSON edits.
+"""
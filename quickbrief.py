@@ -0,0 +1,150 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from dedup import features
+from keywords import CATEGORY_HINTS, CATEGORY_WORDS, MORAL_WORDS, word_map
+from structured import BRIEF_CATEGORIES, BRIEF_DEFAULTS, default_brief
+
+# Local keyword classifier: a provisional brief built from the request's own
+# words in microseconds, so chapter 1 of an arc can be drafted while the LLM
+# classifier is still running (see pipeline.agenerate_arc_start). It never
+# invents names; reconcile() decides afterwards whether the draft still fits
+# the classifier's brief. Category and moral keywords come from keywords.py,
+# shared with the story pool.
+
+_SETTING_WORDS = {
+    "a quiet forest": "forest woods wood trees tree",
+    "a soft meadow": "meadow field fields flowers",
+    "a calm seaside": "sea ocean beach seaside shore waves island",
+    "the starry sky above": "space moon stars star sky rocket planet",
+    "a friendly castle": "castle palace kingdom tower",
+    "a cozy garden": "garden backyard",
+    "a sleepy farm": "farm barn",
+    "a gentle mountain": "mountain mountains hill hills",
+    "a snowy hill": "snow snowy winter ice",
+    "a little village": "village town",
+    "a cozy bedroom": "bedroom bed home house",
+}
+# Nouns that name a character when they appear in a request
+_CHARACTER_WORDS = features("""
+hedgehog owl bear bunny rabbit fox cat kitten dog puppy mouse squirrel deer duck
+frog turtle tortoise elephant lion tiger giraffe penguin whale dolphin fish otter
+badger raccoon koala panda monkey pig cow horse pony sheep lamb goat chicken hen
+bird robin sparrow butterfly bee ladybug snail dinosaur dragon unicorn robot
+princess prince king queen knight wizard witch fairy elf giant pirate mermaid
+girl boy baby sister brother grandma grandpa granny mom dad teacher friend
+""")
+# Default tone per category
+_TONES = {
+    "bedtime-calm": "gentle and soothing",
+    "adventure": "curious and reassuring",
+    "animal-friends": "warm and gentle",
+    "learning-moral": "warm and encouraging",
+    "fantasy": "soft and wondrous",
+    "silly": "playful and cozy",
+}
+MAX_CHARACTERS = 4
+
+_TOKEN_RE = re.compile(r"[A-Za-z]+(?:'[A-Za-z]+)?|[.!?]")
+_NAME_SKIP = frozenset("I A An The My Our Once Please Write Tell Make Story".split())
+
+
+_CATEGORY_BY_WORD = {w: c for w, c in word_map(CATEGORY_WORDS, CATEGORY_HINTS).items() if c in BRIEF_CATEGORIES}
+_MORAL_BY_WORD = word_map(MORAL_WORDS)
+_SETTING_BY_WORD = word_map(_SETTING_WORDS)
+
+
+def _tokens(request: str) -> List[Tuple[str, Optional[str], bool]]:
+    """(word, stem, starts a sentence) for each word of the request."""
+    out, start = [], True
+    for token in _TOKEN_RE.findall(request or ""):
+        if token in ".!?":
+            start = True
+            continue
+        stems = features(token)
+        out.append((token, next(iter(stems)) if stems else None, start))
+        start = False
+    return out
+
+
+def named_characters(request: str) -> List[str]:
+    """
+    Capitalized names the user gave ("Milo", "Grandma Rose"), in order. A
+    sentence's first word is skipped, since it is capitalized anyway.
+    """
+    names: List[str] = []
+    current: List[str] = []
+    for word, _, start in _tokens(request) + [("", None, True)]:
+        if word[:1].isupper() and not start and word not in _NAME_SKIP:
+            current.append(word)
+            continue
+        if current and " ".join(current) not in names:
+            names.append(" ".join(current))
+        current = []
+    return names
+
+
+def provisional_brief(user_request: str) -> Dict[str, Any]:
+    """Brief from keyword tables and the request's own names; no LLM call."""
+    brief = default_brief(user_request)
+    del brief["request"]
+    category = moral = setting = None
+    kinds: List[str] = []
+    for word, stem, _ in _tokens(user_request):
+        if stem is None:
+            continue
+        category = category or _CATEGORY_BY_WORD.get(stem)
+        moral = moral or _MORAL_BY_WORD.get(stem)
+        setting = setting or _SETTING_BY_WORD.get(stem)
+        if stem in _CHARACTER_WORDS and f"a {word.lower()}" not in kinds:
+            kinds.append(f"a {word.lower()}")
+    if category is None and kinds:
+        category = "animal-friends"
+    brief["category"] = category or BRIEF_DEFAULTS["category"]
+    brief["moral"] = moral or BRIEF_DEFAULTS["moral"]
+    brief["setting"] = setting or BRIEF_DEFAULTS["setting"]
+    brief["tone"] = _TONES.get(brief["category"], BRIEF_DEFAULTS["tone"])
+    brief["characters"] = (named_characters(user_request) + kinds)[:MAX_CHARACTERS]
+    return brief
+
+
+def _character_name(character: str) -> str:
+    """Leading name of a classifier character ("Pip, a small hedgehog" -> "Pip")."""
+    head = re.split(r",| the | a | an ", str(character), maxsplit=1)[0].strip()
+    return head if head[:1].isupper() and len(head.split()) <= 3 else ""
+
+
+def contradicts(user_request: str, brief: Dict[str, Any]) -> bool:
+    """True if the classifier picked another category than a request keyword asked for."""
+    asked = {_CATEGORY_BY_WORD[s] for _, s, _ in _tokens(user_request) if s in _CATEGORY_BY_WORD}
+    return bool(asked) and brief.get("category") not in asked and brief.get("request") != user_request
+
+
+def reconcile(user_request: str, provisional: Dict[str, Any], brief: Dict[str, Any],
+              chapter: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    Fit the classifier's `brief` to a chapter drafted from `provisional`.
+    Returns (brief to keep the chapter with, result), or (None, "redraft")
+    when the draft contradicts the request (see contradicts(), or a name the
+    user gave is missing). Names the classifier invented that the chapter
+    doesn't use are dropped from the brief, leaving the description, so later
+    chapters keep the chapter's own names.
+    """
+    if brief.get("request") == user_request:
+        # The classifier failed and fell back to defaults: the keywords know more
+        return dict(provisional, avoid_topics=brief.get("avoid_topics", [])), "provisional"
+    if contradicts(user_request, brief) or any(name not in chapter for name in named_characters(user_request)):
+        return None, "redraft"
+
+    characters, changed = [], False
+    for character in brief.get("characters", []):
+        name = _character_name(character)
+        if name and name not in chapter:
+            rest = str(character)[len(name):].lstrip(" ,")
+            characters.append(rest or "a friend")
+            changed = True
+        else:
+            characters.append(character)
+    if not changed:
+        return brief, "kept"
+    return dict(brief, characters=characters), "renamed"
@@ -0,0 +1,250 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+import metrics
+
+# Token buckets for the account's request/token quotas, shared by every
+# worker process on the machine through SQLite. 0 disables a bucket.
+LIMIT_RPM = float(os.getenv("LLM_RPM", "0"))
+LIMIT_TPM = float(os.getenv("LLM_TPM", "0"))
+LIMIT_PATH = os.getenv("LLM_LIMIT_PATH", ".cache/ratelimit.sqlite3")
+# Bucket capacity in seconds of quota: how big a burst may go out at once
+LIMIT_BURST = float(os.getenv("LLM_LIMIT_BURST", "10"))
+# Longest wait for quota before the call fails (RateLimitTimeout)
+LIMIT_WAIT = float(os.getenv("LLM_LIMIT_WAIT", "30"))
+LIMIT_WAIT_BATCH = float(os.getenv("LLM_LIMIT_WAIT_BATCH", "600"))
+
+# Priority classes, most urgent first. Waiters are served strictly by class,
+# then first come first served, across all processes.
+PRIORITIES = {"interactive": 0, "tweak": 1, "batch": 2}
+DEFAULT_PRIORITY = "interactive"
+
+# How often a waiter that isn't at the head of the queue looks again
+POLL_SECONDS = 0.05
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("llm_priority", default=DEFAULT_PRIORITY)
+
+
+class RateLimitTimeout(RuntimeError):
+    """No quota became available before the call's deadline."""
+
+
+def enabled() -> bool:
+    return LIMIT_RPM > 0 or LIMIT_TPM > 0
+
+
+@contextlib.contextmanager
+def priority(name: str):
+    """Run the LLM calls inside the block in priority class `name`."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+# -------------------- Shared buckets --------------------
+
+class Limiter:
+    """
+    Request and token buckets plus a cross-process wait queue in SQLite.
+    A caller enqueues, waits until it is the head of the queue (by priority,
+    then arrival), then waits until both buckets hold its cost.
+    """
+
+    def __init__(self, path: str = LIMIT_PATH, rpm: float = LIMIT_RPM, tpm: float = LIMIT_TPM,
+                 burst: float = LIMIT_BURST):
+        self.path = path
+        # bucket name -> (refill per second, capacity)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        if rpm > 0:
+            self.buckets["requests"] = (rpm / 60, max(1.0, rpm / 60 * burst))
+        if tpm > 0:
+            self.buckets["tokens"] = (tpm / 60, max(1.0, tpm / 60 * burst))
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS waiters (
+                id TEXT PRIMARY KEY,
+                priority INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL,
+                deadline REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS waiters_order ON waiters (priority, enqueued_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, rank: int, deadline: float) -> str:
+        waiter = uuid.uuid4().hex
+        self._conn().execute("INSERT INTO waiters (id, priority, enqueued_at, deadline) VALUES (?, ?, ?, ?)",
+                             (waiter, rank, time.time(), deadline))
+        return waiter
+
+    def leave(self, waiter: str) -> None:
+        self._conn().execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+
+    def try_take(self, waiter: str, cost: Dict[str, float]) -> float:
+        """
+        Take `cost` from the buckets if `waiter` heads the queue and the
+        quota is there: returns 0. Otherwise the seconds to wait before
+        trying again.
+        """
+        now = time.time()
+        conn = self._conn()
+        head = conn.execute("SELECT id FROM waiters WHERE deadline >= ? ORDER BY priority, enqueued_at LIMIT 1",
+                            (now,)).fetchone()
+        if head is None or head[0] != waiter:
+            return POLL_SECONDS
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Waiters whose process died (or gave up) stop blocking the queue at their deadline
+            conn.execute("DELETE FROM waiters WHERE deadline < ?", (now,))
+            levels = {name: self._level(conn, name, now) for name in self.buckets}
+            wait = 0.0
+            for name, need in cost.items():
+                rate, capacity = self.buckets[name]
+                need = min(need, capacity)  # a call bigger than a whole burst still gets through
+                if levels[name] < need:
+                    wait = max(wait, (need - levels[name]) / rate)
+            if wait == 0.0:
+                for name, need in cost.items():
+                    levels[name] -= min(need, self.buckets[name][1])
+                conn.executemany("INSERT OR REPLACE INTO buckets (name, level, updated_at) VALUES (?, ?, ?)",
+                                 [(name, level, now) for name, level in levels.items()])
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _level(self, conn: sqlite3.Connection, name: str, now: float) -> float:
+        """Current bucket level, refilled for the time since it was last written."""
+        rate, capacity = self.buckets[name]
+        row = conn.execute("SELECT level, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+
+    def waiting(self) -> Dict[str, int]:
+        """Queued callers per priority class (all processes)."""
+        names = {rank: name for name, rank in PRIORITIES.items()}
+        rows = self._conn().execute("SELECT priority, COUNT(*) FROM waiters WHERE deadline >= ? GROUP BY priority",
+                                    (time.time(),)).fetchall()
+        return {names.get(rank, str(rank)): count for rank, count in rows}
+
+
+# One limiter per process (connections are per thread inside it)
+_limiter = None
+
+
+def get_limiter() -> Limiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = Limiter()
+    return _limiter
+
+
+# -------------------- Acquire --------------------
+
+def _request(tokens: int, deadline: Optional[float]) -> Tuple[str, Dict[str, float], float]:
+    name = _priority.get()
+    cost = {"requests": 1.0, "tokens": float(tokens)}
+    cost = {k: v for k, v in cost.items() if k in get_limiter().buckets}
+    if deadline is None:
+        deadline = time.time() + (LIMIT_WAIT_BATCH if name == "batch" else LIMIT_WAIT)
+    return name, cost, deadline
+
+
+def _waited(name: str, started: float) -> float:
+    waited = time.perf_counter() - started
+    metrics.observe("llm_limiter_wait_seconds", waited, WAIT_BUCKETS, priority=name)
+    return waited
+
+
+def _timeout(name: str) -> RateLimitTimeout:
+    metrics.incr("llm_limiter_timeouts_total", priority=name)
+    return RateLimitTimeout(f"No OpenAI quota available in time for a {name} call. Please try again shortly.")
+
+
+def acquire(tokens: int, deadline: Optional[float] = None) -> float:
+    """
+    Block until a call costing `tokens` (prompt estimate + max_tokens) may
+    go out, in the current priority class. `deadline` is a time.time()
+    value. Returns seconds waited; raises RateLimitTimeout at the deadline.
+    """
+    if not enabled():
+        return 0.0
+    name, cost, deadline = _request(tokens, deadline)
+    limiter = get_limiter()
+    started = time.perf_counter()
+    waiter = limiter.enqueue(PRIORITIES[name], deadline)
+    try:
+        while True:
+            wait = limiter.try_take(waiter, cost)
+            if wait == 0.0:
+                return _waited(name, started)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise _timeout(name)
+            time.sleep(min(wait, remaining, 1.0))
+    except BaseException:
+        limiter.leave(waiter)
+        raise
+
+
+async def aacquire(tokens: int, deadline: Optional[float] = None) -> float:
+    """acquire() for coroutines: database steps run in a thread, waits don't block the loop."""
+    if not enabled():
+        return 0.0
+    name, cost, deadline = _request(tokens, deadline)
+    limiter = get_limiter()
+    started = time.perf_counter()
+    waiter = await asyncio.to_thread(limiter.enqueue, PRIORITIES[name], deadline)
+    try:
+        while True:
+            wait = await asyncio.to_thread(limiter.try_take, waiter, cost)
+            if wait == 0.0:
+                return _waited(name, started)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise _timeout(name)
+            await asyncio.sleep(min(wait, remaining, 1.0))
+    except BaseException:
+        await asyncio.to_thread(limiter.leave, waiter)
+        raise
+
+
+def stats() -> Dict[str, Any]:
+    if not enabled():
+        return {"enabled": False}
+    return {"enabled": True, "waiting": get_limiter().waiting()}
@@ -0,0 +1,364 @@
+import asyncio
+import concurrent.futures
+import email.utils
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import openai
+
+import metrics
+
+# Retries for transient failures (rate limit, timeout, connection, 5xx)
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# Longest Retry-After we are willing to sleep for; longer ones fail the call
+RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "20"))
+
+# Hedging: if a call runs past the stage's recent p95, send a duplicate and
+# keep whichever answers first. Off by default since it spends extra tokens.
+HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SECONDS = float(os.getenv("LLM_HEDGE_MIN_SECONDS", "1.0"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Circuit breaker: after this many consecutive upstream failures, fail fast
+# for BREAKER_COOLDOWN seconds, then let a single probe call through.
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+# -------------------- Failure classification --------------------
+
+def classify(exc: BaseException) -> Optional[str]:
+    """Retry reason for a transient API failure, or None if retrying won't help."""
+    if isinstance(exc, openai.APITimeoutError):
+        return "timeout"
+    if isinstance(exc, openai.APIConnectionError):
+        return "connection"
+    if isinstance(exc, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code >= 500 or exc.status_code in (408, 409):
+            return "server"
+    return None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds requested by the Retry-After(-ms) header of a failed response."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, exc: BaseException) -> Optional[float]:
+    """
+    Full-jitter exponential backoff for retry number `attempt` (0-based),
+    never shorter than the server's Retry-After. None means don't retry.
+    """
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    wait = retry_after(exc)
+    if wait is not None:
+        if wait > RETRY_AFTER_MAX:
+            return None
+        delay = max(delay, wait)
+    return delay
+
+
+# -------------------- Circuit breaker --------------------
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker shared by all calls in the process.
+    closed -> open after `threshold` upstream failures; open -> half-open after
+    `cooldown`, where one probe decides between closed and open again.
+    Rate limits don't count: the upstream is up, just busy.
+    """
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return "open"
+            return "half-open"
+
+    def before(self) -> bool:
+        """
+        Raise CircuitOpenError unless a call may go out now. Returns True if
+        the call is the half-open probe, which must end in success(),
+        failure() or release().
+        """
+        if self.threshold <= 0:
+            return False
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._probing:
+                self._probing = True
+                return True
+        metrics.incr("llm_circuit_rejections_total")
+        raise CircuitOpenError(
+            f"LLM upstream is failing; not sending requests for another {max(remaining, 0):.0f}s")
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self) -> None:
+        """Give up the probe slot without a verdict (the probe was cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self, reason: str) -> None:
+        if reason == "rate_limit":
+            with self._lock:
+                self._probing = False
+            return
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self.threshold > 0 and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+
+breaker = CircuitBreaker()
+
+metrics.register_gauge(
+    "llm_circuit_open", "1 while the LLM circuit breaker is refusing calls.",
+    lambda: {(): 1 if breaker.is_open() else 0})
+
+
+# -------------------- Latency window (hedge threshold) --------------------
+
+_latencies: Dict[str, Deque[float]] = {}
+_latency_lock = threading.Lock()
+
+
+def observe_latency(stage: str, seconds: float) -> None:
+    with _latency_lock:
+        window = _latencies.get(stage)
+        if window is None:
+            window = _latencies[stage] = deque(maxlen=LATENCY_WINDOW)
+        window.append(seconds)
+
+
+def hedge_threshold(stage: str) -> Optional[float]:
+    """Seconds after which to hedge a call for `stage`; None while too few samples."""
+    with _latency_lock:
+        window = sorted(_latencies.get(stage, ()))
+    if len(window) < HEDGE_MIN_SAMPLES:
+        return None
+    k = min(len(window) - 1, max(0, math.ceil(HEDGE_PERCENTILE / 100 * len(window)) - 1))
+    return max(HEDGE_MIN_SECONDS, window[k])
+
+
+# -------------------- Sync calls --------------------
+
+def _no_verdict(exc: BaseException, probe: bool) -> None:
+    """A failure retrying won't fix: only an API reply says the upstream is up."""
+    if isinstance(exc, openai.APIStatusError):
+        breaker.success()  # the upstream answered; the request itself was bad
+    elif probe:
+        breaker.release()  # e.g. no rate-limit quota in time; nothing was sent
+
+
+_hedge_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=int(os.getenv("LLM_MAX_IN_FLIGHT", "32")), thread_name_prefix="llm-hedge")
+        return _hedge_pool
+
+
+def _timed(send: Callable[[], Any], stage: str) -> Any:
+    started = time.perf_counter()
+    result = send()
+    observe_latency(stage, time.perf_counter() - started)
+    return result
+
+
+def _hedged(send: Callable[[], Any], stage: str, charge: Optional[Callable[[], Any]] = None) -> Any:
+    threshold = hedge_threshold(stage)
+    if threshold is None:
+        return _timed(send, stage)
+    primary = _pool().submit(_timed, send, stage)
+    try:
+        return primary.result(timeout=threshold)
+    except concurrent.futures.TimeoutError:
+        pass
+    if charge is not None:
+        charge()  # the duplicate is a request of its own
+    backup = _pool().submit(_timed, send, stage)
+    error: Optional[BaseException] = None
+    for fut in concurrent.futures.as_completed([primary, backup]):
+        if fut.exception() is None:
+            # A blocking HTTP call can't be interrupted; the loser's reply is dropped
+            (backup if fut is primary else primary).cancel()
+            metrics.incr("llm_hedges_total", stage=stage or "other",
+                         winner="backup" if fut is backup else "primary")
+            return fut.result()
+        error = fut.exception()
+    metrics.incr("llm_hedges_total", stage=stage or "other", winner="none")
+    raise error  # type: ignore[misc]
+
+
+def call(send: Callable[[], Any], stage: str = "", hedge: Optional[bool] = None,
+         charge: Optional[Callable[[], Any]] = None) -> Any:
+    """
+    Run `send()` (one API request) behind the circuit breaker, retrying
+    transient failures with jittered backoff. With hedging on, a slow request
+    gets a duplicate after the stage's p95 latency. `charge()` runs before
+    every request that goes out, retries and hedges included (rate-limit quota).
+    """
+    hedge = HEDGE if hedge is None else hedge
+    attempt = 0
+    while True:
+        probe = breaker.before()
+        try:
+            if charge is not None:
+                charge()
+            result = _hedged(send, stage, charge) if hedge else _timed(send, stage)
+        except Exception as e:
+            reason = classify(e)
+            if reason is None:
+                _no_verdict(e, probe)
+                raise
+            breaker.failure(reason)
+            delay = backoff_delay(attempt, e) if attempt < MAX_RETRIES else None
+            if delay is None or breaker.is_open():
+                raise
+            metrics.incr("llm_retries_total", stage=stage or "other", reason=reason)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            # Interrupted (KeyboardInterrupt, GeneratorExit): no verdict on the upstream
+            if probe:
+                breaker.release()
+            raise
+        breaker.success()
+        return result
+
+
+# -------------------- Async calls --------------------
+
+async def _atimed(send: Callable[[], Awaitable[Any]], stage: str) -> Any:
+    started = time.perf_counter()
+    result = await send()
+    observe_latency(stage, time.perf_counter() - started)
+    return result
+
+
+async def _ahedged(send: Callable[[], Awaitable[Any]], stage: str,
+                   charge: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+    threshold = hedge_threshold(stage)
+    if threshold is None:
+        return await _atimed(send, stage)
+    primary = asyncio.ensure_future(_atimed(send, stage))
+    pending = {primary}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=threshold)
+        if done:
+            return primary.result()
+        if charge is not None:
+            await charge()
+        backup = asyncio.ensure_future(_atimed(send, stage))
+        pending.add(backup)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    metrics.incr("llm_hedges_total", stage=stage or "other",
+                                 winner="backup" if task is backup else "primary")
+                    return task.result()
+                error = task.exception()
+        metrics.incr("llm_hedges_total", stage=stage or "other", winner="none")
+        raise error  # type: ignore[misc]
+    finally:
+        # Cancel the losing request (closes its connection)
+        for task in pending:
+            task.cancel()
+
+
+async def acall(send: Callable[[], Awaitable[Any]], stage: str = "", hedge: Optional[bool] = None,
+                charge: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+    """Coroutine version of `call`; the losing hedge request is cancelled."""
+    hedge = HEDGE if hedge is None else hedge
+    attempt = 0
+    while True:
+        probe = breaker.before()
+        try:
+            if charge is not None:
+                await charge()
+            result = await (_ahedged(send, stage, charge) if hedge else _atimed(send, stage))
+        except Exception as e:
+            reason = classify(e)
+            if reason is None:
+                _no_verdict(e, probe)
+                raise
+            breaker.failure(reason)
+            delay = backoff_delay(attempt, e) if attempt < MAX_RETRIES else None
+            if delay is None or breaker.is_open():
+                raise
+            metrics.incr("llm_retries_total", stage=stage or "other", reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            # Cancelled (hedge loser, sibling draft, client gone): no verdict on the upstream
+            if probe:
+                breaker.release()
+            raise
+        breaker.success()
+        return result
@@ -0,0 +1,159 @@
+import re
+
+# Precompiled patterns for story cleanup (see StorySanitizer)
+_HEADING_RE = re.compile(r"^\s*#+\s*")
+_TITLE_LABEL_RE = re.compile(r"^\s*title\s*[:\-]\s*", re.I)
+_TITLE_ONLY_RE = re.compile(r"^\s*title\s*$", re.I)
+# Line boundaries recognised by str.splitlines()
+_LINE_BREAKS = frozenset("\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029")
+
+
+def clean_title(line: str) -> str:
+    """Plain title from the first non-empty line (no '#', 'Title:' or symbols)."""
+    first = _HEADING_RE.sub("", line.strip())
+    first = _TITLE_LABEL_RE.sub("", first)
+    first = _TITLE_ONLY_RE.sub("", first)
+    return _HEADING_RE.sub("", first.strip(" *:_-"))
+
+
+class StorySanitizer:
+    """
+    Incremental version of the story cleanup: feed() text chunks as they
+    stream in and get cleaned text back; finish() flushes the rest.
+    The concatenated output equals sanitize_story_text() of the whole text:
+    - '**', '__' and backticks are removed
+    - the first non-empty line becomes a plain title (emitted once it ends)
+    - leading '#' markers are removed from every line
+    - trailing whitespace of lines and of the whole text is dropped
+    Lookahead is limited to a trailing run of '*'/'_', a trailing '\\r', the
+    title line, a line's leading '#'/whitespace prefix and trailing whitespace.
+    """
+
+    def __init__(self):
+        self._star = ""         # held trailing '*' run
+        self._under = ""        # held trailing '_' run
+        self._cr = False        # held trailing '\r' (may be half of '\r\n')
+        self._line = ""         # current line, until its prefix is decided
+        self._decided = False   # current line is past its '#' prefix
+        self._line_ws = ""      # held trailing whitespace of the current line
+        self._has_title = False
+        self._started = False   # emitted any non-whitespace yet
+        self._out_ws = ""       # held whitespace (incl. newlines) between output
+
+    # -------------------- Public API --------------------
+
+    def feed(self, chunk: str) -> str:
+        if not chunk:
+            return ""
+        return self._split_lines(self._strip_markup(chunk, final=False), final=False)
+
+    def finish(self) -> str:
+        out = self._split_lines(self._strip_markup("", final=True), final=True)
+        if not self._has_title and self._line.strip():
+            out += self._emit(clean_title(self._line))
+        # An undecided last line is only whitespace / '#' markers: nothing to emit
+        self._line = ""
+        self._line_ws = ""
+        self._decided = False
+        self._out_ws = ""
+        return out
+
+    # -------------------- Stages --------------------
+
+    def _strip_markup(self, chunk: str, final: bool) -> str:
+        # '**' then '__' (like chained str.replace), holding back a trailing
+        # run of the marker since it may pair with the next chunk
+        text = self._star + chunk
+        keep = text if final else text.rstrip("*")
+        self._star = text[len(keep):]
+        text = self._under + keep.replace("**", "")
+        keep = text if final else text.rstrip("_")
+        self._under = text[len(keep):]
+        return keep.replace("__", "").replace("`", "")
+
+    def _split_lines(self, text: str, final: bool) -> str:
+        if self._cr:
+            text = "\r" + text
+            self._cr = False
+        if not final and text.endswith("\r"):
+            self._cr = True
+            text = text[:-1]
+        if not text:
+            return ""
+        lines = text.splitlines()
+        partial = "" if text[-1] in _LINE_BREAKS else lines.pop()
+        out = []
+        for line in lines:
+            out.append(self._add(line))
+            out.append(self._end_line())
+        out.append(self._add(partial))
+        return "".join(out)
+
+    def _add(self, text: str) -> str:
+        if not text:
+            return ""
+        if self._decided:
+            return self._line_text(text)
+        self._line += text
+        if not self._has_title:
+            return ""  # the title is cleaned once the whole line is known
+        line = self._line
+        m = _HEADING_RE.match(line)
+        end = m.end() if m else len(line) - len(line.lstrip())
+        if end == len(line):
+            return ""  # still only whitespace / '#' markers
+        self._decided = True
+        self._line = ""
+        return self._line_text(line[end:] if m else line)
+
+    def _end_line(self) -> str:
+        out = ""
+        if not self._has_title:
+            if self._line.strip():
+                self._has_title = True
+                out = self._emit(clean_title(self._line) + "\n")
+            # blank lines before the title disappear
+        else:
+            # An undecided line was only whitespace / '#' markers: it ends up empty
+            out = self._emit("\n")
+        self._line = ""
+        self._line_ws = ""
+        self._decided = False
+        return out
+
+    def _line_text(self, text: str) -> str:
+        body = text.rstrip()
+        if not body:
+            self._line_ws += text
+            return ""
+        out = self._emit(self._line_ws + body)
+        self._line_ws = text[len(body):]
+        return out
+
+    def _emit(self, text: str) -> str:
+        # Strip leading/trailing whitespace of the whole output
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        body = text.rstrip()
+        if not body:
+            self._out_ws += text
+            return ""
+        out = self._out_ws + body
+        self._out_ws = text[len(body):]
+        return out
+
+
+def sanitize_story_text(text: str) -> str:
+    """
+    Enforce plain text:
+    - Remove bold/backticks and heading markers.
+    - First non-empty line becomes a plain title (strip 'Title:' and symbols).
+    - Trim extra whitespace.
+    """
+    if not text:
+        return text
+    sanitizer = StorySanitizer()
+    return sanitizer.feed(text) + sanitizer.finish()
@@ -0,0 +1,238 @@
+import json
+import os
+from typing import Any, Dict, MutableMapping, NamedTuple, Optional, Tuple, Union
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+import cache as response_cache
+import dedup
+import jobs
+import metrics
+import pool
+import prejudge
+import ratelimit
+import speculative
+from flows import preset_tweak, short_state
+
+# Pieces shared by the Flask app (webapp.py) and the ASGI app (asgi.py)
+
+# Streamed results are handed back to the browser signed, since the session
+# cookie can't be set once an event stream has started.
+STREAM_RESULT_MAX_AGE = 600
+STREAM_SALT = "story-stream"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+NO_API_KEY = "OPENAI_API_KEY is not set. Configure it on Heroku or in your .env."
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def wants_json(accept_mimetypes) -> bool:
+    return accept_mimetypes.best == "application/json"
+
+
+def job_view(job_id: str, job) -> Dict[str, Any]:
+    """What /jobs/<id> shows (the result itself is only handed out via /finish)."""
+    if job is None:
+        return {"id": job_id, "status": "missing"}
+    return {"id": job["id"], "kind": job["kind"], "status": job["status"], "error": job["error"]}
+
+
+def cache_stats() -> Dict[str, Any]:
+    stats = dict(response_cache.stats(), request_index=dedup.stats())
+    if pool.POOL_ENABLED:
+        stats["story_pool"] = pool.stats()
+    if speculative.SPECULATE_ENABLED:
+        stats["speculative"] = speculative.stats()
+    return stats
+
+
+def register_gauges(job_queue) -> None:
+    """Scrape-time gauges for /metrics from the caches, pre-judge and job queue."""
+    def cache_gauges():
+        st = response_cache.stats()
+        return {metrics.gauge_labels(result="hit"): st["hits"],
+                metrics.gauge_labels(result="miss"): st["misses"]}
+
+    def prejudge_gauges():
+        st = prejudge.stats()
+        return {metrics.gauge_labels(outcome="checked"): st["checked"],
+                metrics.gauge_labels(outcome="skipped_llm_judge"): st["short_circuited"]}
+
+    metrics.register_gauge("llm_cache_lookups", "Response cache lookups by result.", cache_gauges)
+
+    def index_gauges():
+        st = dedup.stats()
+        return {metrics.gauge_labels(kind="requests"): st["entries"],
+                metrics.gauge_labels(kind="stories"): st["stories"]}
+
+    metrics.register_gauge("request_index_entries", "Requests and passing stories in the near-duplicate index.",
+                           index_gauges)
+    if pool.POOL_ENABLED:
+        def pool_gauges():
+            st = pool.stats()
+            return {metrics.gauge_labels(status="ready"): st["ready"],
+                    metrics.gauge_labels(status="filling"): st["filling"],
+                    metrics.gauge_labels(status="target"): st["target"]}
+
+        metrics.register_gauge("story_pool_entries", "Warm pool stories ready, being written, and the target.",
+                               pool_gauges)
+        metrics.register_gauge("story_pool_oldest_seconds", "Age of the oldest story waiting in the warm pool.",
+                               lambda: {(): pool.stats()["oldest_age"]})
+    metrics.register_gauge("story_prejudge_checks", "Local pre-judge checks and LLM judge calls skipped.",
+                           prejudge_gauges)
+    if ratelimit.enabled():
+        metrics.register_gauge("llm_limiter_waiting", "Chat calls queued for rate-limit quota on this machine, by priority.",
+                               lambda: {metrics.gauge_labels(priority=k): v
+                                        for k, v in ratelimit.stats()["waiting"].items()})
+    if speculative.SPECULATE_ENABLED:
+        def speculative_gauges():
+            st = speculative.stats()
+            return {metrics.gauge_labels(status="running"): st["running"],
+                    metrics.gauge_labels(status="ready"): st["ready"]}
+
+        metrics.register_gauge("speculative_results", "Speculative runs going and results waiting for a click.",
+                               speculative_gauges)
+    metrics.register_gauge("jobs_in_flight", "Background jobs accepted by this worker and not finished.",
+                           lambda: {(): job_queue.depth()})
+
+
+# -------------------- Page actions --------------------
+# Request checks and session changes behind the page routes. webapp.py and
+# asgi.py only adapt these to Flask or Quart (awaits, flash, redirects), so
+# the two apps behave the same.
+
+# A flash message for the page: (text, category)
+Notice = Tuple[str, str]
+
+
+class Job(NamedTuple):
+    """A pipeline run to hand to the job queue, and how the page labels it."""
+    kind: str
+    payload: Dict[str, Any]
+    label: str
+    error_prefix: str
+
+
+def generate_job(form) -> Union[Job, Notice]:
+    prompt = form.get("prompt", "").strip()
+    mode = form.get("mode", "short")
+    if not prompt:
+        return "Please enter a quick story idea.", "warning"
+    if not os.getenv("OPENAI_API_KEY"):
+        return NO_API_KEY, "danger"
+    label = "Creating Chapter 1…" if mode == "arc" else "Generating your story…"
+    return Job("generate", {"prompt": prompt, "mode": mode}, label, "Error generating")
+
+
+def tweak_job(state: Optional[Dict[str, Any]], form) -> Union[Job, Notice]:
+    if not state:
+        return "Please generate a story first.", "warning"
+    tweak_text = form.get("tweak", "").strip()
+    if not tweak_text:
+        return "Type any tweak to apply.", "warning"
+    # If the final chapter was already created, don't allow tweaks (user should End Now)
+    if state.get("mode") == "arc" and state.get("arc_ready_to_end"):
+        return "The final chapter is ready. Click 'End Now' to finish.", "info"
+    return Job("tweak", {"state": state, "tweak": preset_tweak(tweak_text)},
+               "Applying your tweak…", "Error applying tweak")
+
+
+def chapter_job(state: Optional[Dict[str, Any]], end_now: bool) -> Union[Job, Notice, None]:
+    """Next (or final) arc chapter; None means just show the page again."""
+    if not state or state.get("mode") != "arc":
+        return "Start a multi-arc story first.", "warning"
+    if state.get("arc_ready_to_end"):
+        # Already produced the final chapter; the page only offers End Now
+        return None if end_now else ("The final chapter is already created. Click 'End Now' to finish.", "info")
+    if end_now:
+        return Job("next_chapter", {"state": state, "end_now": True},
+                   "Writing final chapter…", "Error creating final chapter")
+    return Job("next_chapter", {"state": state, "end_now": False},
+               "Writing next chapter…", "Error creating next chapter")
+
+
+def job_started(session: MutableMapping, job: Job, job_id: str) -> None:
+    session["job"] = {"id": job_id, "label": job.label, "error_prefix": job.error_prefix}
+
+
+def job_finished(session: MutableMapping, job_id: str,
+                 job: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], Optional[Notice]]:
+    """
+    Settle the session's pending job once it has ended: (new state to show,
+    notice). A failed job is kept as `failed_job` so the page offers a retry.
+    """
+    pending = session.get("job")
+    if not pending or pending.get("id") != job_id:
+        return None, None
+    if job is None:
+        session.pop("job", None)
+        return None, (f"{pending['error_prefix']}: the request was lost. Please try again.", "danger")
+    if job["status"] == jobs.DONE:
+        session.pop("job", None)
+        return job["result"], None
+    if job["status"] == jobs.FAILED:
+        session.pop("job", None)
+        # Offer a retry: it resumes from the stages that already finished
+        session["failed_job"] = pending
+        return None, (f"{pending['error_prefix']}: {job['error']}", "danger")
+    return None, None
+
+
+def job_retried(session: MutableMapping, job_id: str, retried: bool) -> Optional[Notice]:
+    failed = session.pop("failed_job", None)
+    if retried and failed and failed.get("id") == job_id:
+        session["job"] = failed
+    elif not retried:
+        return "That request can't be retried any more. Please start it again.", "warning"
+    return None
+
+
+def retry_json(job_id: str, retried: bool, status_url: str) -> Tuple[Dict[str, Any], int]:
+    if not retried:
+        return {"id": job_id, "error": "not a failed job"}, 409
+    return {"job_id": job_id, "status_url": status_url}, 202
+
+
+def job_event(job_id: str, job: Optional[Dict[str, Any]]) -> Tuple[str, Dict[str, Any], bool]:
+    """(status, /jobs/<id>/events payload, whether the job can still change)."""
+    status = job["status"] if job else "missing"
+    return (status, {"id": job_id, "status": status, "error": job["error"] if job else None},
+            status in (jobs.QUEUED, jobs.RUNNING))
+
+
+def end_story(session: MutableMapping, notice: Notice, *keys: str) -> Notice:
+    """Drop the story (and any other `keys`) from the session."""
+    for key in ("state", "job") + keys:
+        session.pop(key, None)
+    return notice
+
+
+# -------------------- Streamed stories --------------------
+
+def stream_error(prompt: str) -> Optional[str]:
+    if not prompt:
+        return "Please enter a quick story idea."
+    if not os.getenv("OPENAI_API_KEY"):
+        return NO_API_KEY
+    return None
+
+
+def stream_event(secret_key: str, prompt: str, event: str, data: Any) -> str:
+    """One SSE frame of /generate/stream; the result is signed for /generate/commit."""
+    if event == "done":
+        data = {"token": _signer(secret_key).dumps(short_state(prompt, data))}
+    return sse(event, data)
+
+
+def streamed_state(secret_key: str, token: str) -> Union[Dict[str, Any], Notice]:
+    """The state signed by /generate/stream, or a notice if it expired."""
+    try:
+        return _signer(secret_key).loads(token, max_age=STREAM_RESULT_MAX_AGE)
+    except BadSignature:
+        return "That story expired before it was saved. Please generate again.", "warning"
+
+
+def _signer(secret_key: str) -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(secret_key, salt=STREAM_SALT)
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Which backend holds session data: "sqlite", "filesystem" or "cookie" (Flask default)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", ".cache/sessions.sqlite3")
+SESSION_DIR = os.getenv("SESSION_DIR", ".cache/sessions")
+# Sessions untouched for this long are treated as gone and purged
+SESSION_IDLE_TIMEOUT = float(
+    os.getenv("SESSION_IDLE_TIMEOUT", str(24 * 3600)))
+
+_SID_RE = re.compile(r"^[0-9a-f]{64}$")
+_serializer = TaggedJSONSerializer()
+
+
+# -------------------- Stores --------------------
+
+class SQLiteSessionStore:
+    """Session blobs in one SQLite table, shared by all workers on the machine."""
+
+    def __init__(self, path: str = SESSION_DB_PATH, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT data, accessed_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None or row[1] < time.time() - self.idle_timeout:
+            return None
+        return row[0]
+
+    def put(self, sid: str, data: bytes) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, accessed_at) VALUES (?, ?, ?)",
+            (sid, data, time.time()))
+
+    def touch(self, sid: str) -> None:
+        self._conn().execute(
+            "UPDATE sessions SET accessed_at = ? WHERE sid = ?", (time.time(), sid))
+
+    def delete(self, sid: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def purge(self) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE accessed_at < ?",
+                             (time.time() - self.idle_timeout,))
+
+
+class FileSessionStore:
+    """One file per session; the file's mtime is the last access time."""
+
+    def __init__(self, directory: str = SESSION_DIR, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.directory = directory
+        self.idle_timeout = idle_timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid: str) -> str:
+        return os.path.join(self.directory, sid)
+
+    def get(self, sid: str) -> Optional[bytes]:
+        path = self._path(sid)
+        try:
+            if os.path.getmtime(path) < time.time() - self.idle_timeout:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, sid: str, data: bytes) -> None:
+        # Write-then-rename so concurrent readers never see a partial file
+        tmp = self._path(f"{sid}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(sid))
+
+    def touch(self, sid: str) -> None:
+        try:
+            os.utime(self._path(sid))
+        except OSError:
+            pass
+
+    def delete(self, sid: str) -> None:
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def purge(self) -> None:
+        cutoff = time.time() - self.idle_timeout
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+# -------------------- Compaction --------------------
+
+def compact_state(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shrink what we keep per session: verdict history keeps only pass/scores
+    (the page shows nothing else); issues and edit instructions are dropped.
+    Returns new dicts; `data` and the live session state are left as they are.
+    """
+    state = data.get("state")
+    if isinstance(state, dict) and isinstance(state.get("history"), list):
+        history = [
+            {"round": r.get("round"),
+             "verdict": {k: v for k, v in (r.get("verdict") or {}).items() if k in ("pass", "scores")}}
+            for r in state["history"]
+        ]
+        data = dict(data, state=dict(state, history=history))
+    return data
+
+
+# -------------------- Flask session interface --------------------
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: str = "", new: bool = False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps only a random session id in the cookie; the data lives in `store`,
+    zlib-compressed, so request size stays constant however long a story gets.
+    """
+
+    # Roughly one request in this many also sweeps out idle sessions
+    purge_every = 200
+
+    def __init__(self, store, compact=compact_state):
+        self.store = store
+        self.compact = compact
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app), "")
+        if _SID_RE.match(sid):
+            blob = self.store.get(sid)
+            if blob is not None:
+                try:
+                    data = _serializer.loads(zlib.decompress(blob).decode("utf-8"))
+                    return ServerSession(data, sid=sid)
+                except (zlib.error, ValueError):
+                    pass
+        return ServerSession(sid=secrets.token_hex(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if secrets.randbelow(self.purge_every) == 0:
+            self.store.purge()
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            data = self.compact(dict(session))
+            blob = zlib.compress(_serializer.dumps(data).encode("utf-8"))
+            self.store.put(session.sid, blob)
+        else:
+            self.store.touch(session.sid)
+
+        if session.new or session.permanent:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+class AsyncServerSideSessionInterface(ServerSideSessionInterface):
+    """
+    The same server-side sessions for the ASGI (Quart) app: store reads and
+    writes run in a thread so they never block the event loop.
+    """
+
+    async def make_null_session(self, app):
+        return self.null_session_class()
+
+    async def open_session(self, app, request):
+        return await asyncio.to_thread(super().open_session, app, request)
+
+    async def save_session(self, app, session, response):
+        await asyncio.to_thread(super().save_session, app, session, response)
+
+
+def _store():
+    """Store for SESSION_BACKEND; None for the signed-cookie default."""
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    if SESSION_BACKEND == "filesystem":
+        return FileSessionStore()
+    if SESSION_BACKEND != "cookie":
+        raise ValueError(f"Unknown SESSION_BACKEND: {SESSION_BACKEND}")
+    return None
+
+
+def init_app(app) -> None:
+    """Install the server-side session backend chosen by SESSION_BACKEND."""
+    store = _store()
+    if store is not None:
+        app.session_interface = ServerSideSessionInterface(store)
+
+
+def init_async_app(app) -> None:
+    """init_app for the Quart app in asgi.py."""
+    store = _store()
+    if store is not None:
+        app.session_interface = AsyncServerSideSessionInterface(store)
@@ -0,0 +1,542 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+import ratelimit
+from flows import PRESET_TWEAKS
+from llm import track_usage
+
+log = logging.getLogger(__name__)
+
+# Speculative prefetch: once a story or chapter reaches the page, run the
+# clicks the user is likely to make next (next chapter, final chapter and,
+# optionally, preset tweaks) in the background at batch priority. A matching
+# click is served the stored result; the other guesses are dropped.
+# Off by default: every guess that isn't clicked is spent tokens.
+SPECULATE_ENABLED = os.getenv("SPECULATE", "0") == "1"
+SPECULATE_PATH = os.getenv("SPECULATE_PATH", ".cache/speculative.sqlite3")
+# Preset tweak names (see flows.PRESET_TWEAKS) to also run ahead, e.g. "shorter,calmer"
+SPECULATE_TWEAKS = [t.strip().lower() for t in os.getenv("SPECULATE_TWEAKS", "").split(",")
+                    if t.strip().lower() in PRESET_TWEAKS]
+# Speculative runs at once per process
+SPECULATE_WORKERS = int(os.getenv("SPECULATE_WORKERS", "2"))
+# Tokens speculative runs may spend per window, across every worker on the
+# machine; checked when a run starts
+SPECULATE_TOKEN_BUDGET = int(os.getenv("SPECULATE_TOKEN_BUDGET", "200000"))
+SPECULATE_BUDGET_WINDOW = float(os.getenv("SPECULATE_BUDGET_WINDOW", "3600"))
+# Results nobody clicked are thrown away after this
+SPECULATE_MAX_AGE = float(os.getenv("SPECULATE_MAX_AGE", "1800"))
+# How long a click waits for a speculative run of it that is still going
+SPECULATE_JOIN_TIMEOUT = float(os.getenv("SPECULATE_JOIN_TIMEOUT", "120"))
+# A run whose process died is given up after this
+RUN_TIMEOUT = 600.0
+POLL_SECONDS = 0.25
+
+QUEUED, RUNNING, READY, TAKEN, CANCELLED, WASTED, FAILED = (
+    "queued", "running", "ready", "taken", "cancelled", "wasted", "failed")
+
+
+def fingerprint(state: Dict[str, Any]) -> str:
+    """
+    Identity of a session state: a guess only matches clicks made on it.
+    Covers the story itself (text, chapters, brief, memory, rounds so far)
+    but not the verdict details, which session backends store differently
+    (see sessions.compact_state).
+    """
+    stable = {k: v for k, v in state.items() if k != "history"}
+    stable["rounds"] = [r.get("round") for r in state.get("history") or []]
+    return hashlib.sha256(json.dumps(stable, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _key(kind: str, payload: Dict[str, Any]) -> str:
+    payload = dict(payload, state=fingerprint(payload["state"]))
+    return hashlib.sha256(json.dumps([kind, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def candidates(state: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Job (kind, payload) pairs the page can send next for `state`, built
+    exactly as the routes build them, most likely first.
+    """
+    if state.get("mode") == "arc":
+        if state.get("arc_ready_to_end"):
+            return []
+        guesses = [("next_chapter", {"state": state, "end_now": False}),
+                   ("next_chapter", {"state": state, "end_now": True})]
+    else:
+        guesses = []
+    guesses += [("tweak", {"state": state, "tweak": PRESET_TWEAKS[name]}) for name in SPECULATE_TWEAKS]
+    return guesses
+
+
+def _guessable(kind: str, payload: Dict[str, Any]) -> bool:
+    """Whether candidates() could have guessed this click (free-text tweaks can't be)."""
+    if kind == "tweak":
+        return payload.get("tweak") in {PRESET_TWEAKS[name] for name in SPECULATE_TWEAKS}
+    return True
+
+
+def _copy(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Flows update the state in place
+    return json.loads(json.dumps(payload))
+
+
+def _tokens(usage: Dict[str, Any]) -> int:
+    return usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+# -------------------- Store --------------------
+
+class SpeculationStore:
+    """
+    SQLite table of speculative runs shared by every worker on the machine,
+    so a click landing on another worker still finds the result. Finished
+    rows stay for the budget window as the spending ledger.
+    """
+
+    def __init__(self, path: str = SPECULATE_PATH, budget: int = SPECULATE_TOKEN_BUDGET,
+                 window: float = SPECULATE_BUDGET_WINDOW, max_age: float = SPECULATE_MAX_AGE):
+        self.path = path
+        self.budget = budget
+        self.window = window
+        self.max_age = max_age
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS speculations (
+                key TEXT PRIMARY KEY,
+                base TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                tokens INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS speculations_base ON speculations (base, status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def count(self, result: str, kind: str) -> None:
+        """Record a click on a guessable action: hit, joined (waited for a running guess) or miss."""
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "joined":
+                self.joined += 1
+            else:
+                self.misses += 1
+        metrics.incr("speculative_lookups_total", kind=kind, result=result)
+
+    def _expire(self, conn: sqlite3.Connection, now: float) -> None:
+        for kind, tokens in conn.execute(
+                "SELECT kind, tokens FROM speculations WHERE status = ? AND updated_at < ?",
+                (READY, now - self.max_age)).fetchall():
+            _wasted(kind, tokens, "expired")
+        conn.execute("UPDATE speculations SET status = ?, result = NULL, updated_at = ? "
+                     "WHERE status = ? AND updated_at < ?", (WASTED, now, READY, now - self.max_age))
+        conn.execute("UPDATE speculations SET status = ? WHERE status IN (?, ?, ?) AND updated_at < ?",
+                     (FAILED, QUEUED, RUNNING, CANCELLED, now - RUN_TIMEOUT))
+        conn.execute("DELETE FROM speculations WHERE status NOT IN (?, ?, ?, ?) AND updated_at < ?",
+                     (QUEUED, RUNNING, READY, CANCELLED, now - max(self.window, self.max_age)))
+
+    def start(self, key: str, base: str, kind: str) -> bool:
+        """Record a run as queued; False if it already exists or the budget is spent."""
+        now = time.time()
+        conn = self._conn()
+        with self._lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire(conn, now)
+                if conn.execute("SELECT 1 FROM speculations WHERE key = ?", (key,)).fetchone():
+                    conn.execute("COMMIT")
+                    return False
+                spent = conn.execute("SELECT COALESCE(SUM(tokens), 0) FROM speculations WHERE created_at > ?",
+                                     (now - self.window,)).fetchone()[0]
+                if spent >= self.budget:
+                    conn.execute("COMMIT")
+                    metrics.incr("speculative_skipped_total", kind=kind, reason="budget")
+                    return False
+                conn.execute("INSERT INTO speculations (key, base, kind, status, created_at, updated_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (key, base, kind, QUEUED, now, now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def begin(self, key: str) -> bool:
+        """Mark a queued run as running; False if it was cancelled (or claimed by a click) first."""
+        return bool(self._conn().execute(
+            "UPDATE speculations SET status = ?, updated_at = ? WHERE key = ? AND status = ?",
+            (RUNNING, time.time(), key, QUEUED)).rowcount)
+
+    def status(self, key: str) -> Optional[str]:
+        row = self._conn().execute("SELECT status FROM speculations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def finish(self, key: str, kind: str, result: Any, tokens: int) -> bool:
+        """Store a finished run's result; False (and counted as waste) if it was cancelled meanwhile."""
+        conn = self._conn()
+        stored = conn.execute(
+            "UPDATE speculations SET status = ?, result = ?, tokens = ?, updated_at = ? WHERE key = ? AND status = ?",
+            (READY, json.dumps(result), tokens, time.time(), key, RUNNING)).rowcount
+        if not stored:
+            self.drop(key, kind, tokens, WASTED, "cancelled")
+        return bool(stored)
+
+    def drop(self, key: str, kind: str, tokens: int, status: str, reason: str) -> None:
+        """Close a run that produced nothing usable (cancelled or failed)."""
+        self._conn().execute("UPDATE speculations SET status = ?, tokens = ?, updated_at = ? WHERE key = ?",
+                             (status, tokens, time.time(), key))
+        _wasted(kind, tokens, reason)
+
+    def take(self, key: str) -> Optional[Dict[str, Any]]:
+        """Hand out a ready result once; None if there is none (or another worker took it)."""
+        conn = self._conn()
+        row = conn.execute("SELECT kind, result, tokens FROM speculations WHERE key = ? AND status = ?",
+                           (key, READY)).fetchone()
+        if row is None:
+            return None
+        if not conn.execute("UPDATE speculations SET status = ?, result = NULL, updated_at = ? "
+                            "WHERE key = ? AND status = ?", (TAKEN, time.time(), key, READY)).rowcount:
+            return None
+        metrics.incr("speculative_tokens_total", row[2], kind=row[0], outcome="used")
+        return json.loads(row[1])
+
+    def cancel(self, base: str, keep: Optional[str] = None) -> List[str]:
+        """
+        Drop every guess made on state `base` except `keep`: ready results are
+        wasted now, queued and running ones when their worker gets to them.
+        Returns the queued and running keys.
+        """
+        now = time.time()
+        conn = self._conn()
+        rows = conn.execute("SELECT key, kind, status, tokens FROM speculations WHERE base = ? AND status IN (?, ?, ?)",
+                            (base, QUEUED, READY, RUNNING)).fetchall()
+        running = []
+        for key, kind, status, tokens in rows:
+            if key == keep:
+                continue
+            if status == READY:
+                if conn.execute("UPDATE speculations SET status = ?, result = NULL, updated_at = ? "
+                                "WHERE key = ? AND status = ?", (WASTED, now, key, READY)).rowcount:
+                    _wasted(kind, tokens, "diverged")
+            elif conn.execute("UPDATE speculations SET status = ?, updated_at = ? WHERE key = ? AND status = ?",
+                              (CANCELLED, now, key, status)).rowcount:
+                running.append(key)
+        return running
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(tokens), 0) FROM speculations "
+            "WHERE created_at > ? GROUP BY status", (now - self.window,)).fetchall()
+        by_status = {status: (count, tokens) for status, count, tokens in rows}
+        used = by_status.get(TAKEN, (0, 0))[1]
+        wasted = sum(by_status.get(s, (0, 0))[1] for s in (WASTED, FAILED))
+        lookups = self.hits + self.joined + self.misses
+        return {
+            "hits": self.hits,
+            "joined": self.joined,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.joined) / lookups, 4) if lookups else 0.0,
+            "ready": by_status.get(READY, (0, 0))[0],
+            "queued": by_status.get(QUEUED, (0, 0))[0],
+            "running": by_status.get(RUNNING, (0, 0))[0] + by_status.get(CANCELLED, (0, 0))[0],
+            "tokens_used": used,
+            "tokens_wasted": wasted,
+            "waste_ratio": round(wasted / (used + wasted), 4) if used + wasted else 0.0,
+            "budget_spent": sum(tokens for _, tokens in by_status.values()),
+            "budget": self.budget,
+        }
+
+
+def _wasted(kind: str, tokens: int, reason: str) -> None:
+    metrics.incr("speculative_runs_total", kind=kind, outcome=reason)
+    if tokens:
+        metrics.incr("speculative_tokens_total", tokens, kind=kind, outcome="wasted")
+
+
+# One store per process (connections are per thread inside it)
+_store = None
+
+
+def get_store() -> SpeculationStore:
+    global _store
+    if _store is None:
+        _store = SpeculationStore()
+    return _store
+
+
+# -------------------- Speculator --------------------
+
+class Speculator:
+    """
+    Runs guesses for the states the page shows and serves them to matching
+    clicks. `flows` maps job kinds to the plain flow behind the job handler
+    (payload -> new state), run here at batch priority.
+
+    speculate(state) after a state reaches the session; take() on a click
+    (instant, ready results only); wrap() the job handlers so a click that
+    still became a job waits for a running guess instead of redoing it;
+    discard(state) when the user leaves the story.
+    """
+
+    def __init__(self, flows: Dict[str, Callable[[Dict[str, Any]], Any]],
+                 store: Optional[SpeculationStore] = None, workers: int = SPECULATE_WORKERS):
+        self.flows = flows
+        self.store = store or get_store()
+        self.workers = workers
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _guesses(self, state: Optional[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any], str]]:
+        if not state:
+            return []
+        state = _copy(state)
+        return [(kind, payload, _key(kind, payload)) for kind, payload in candidates(state) if kind in self.flows]
+
+    def _reserve(self, kind: str) -> bool:
+        # Keep the backlog short: guesses for stale states are worth nothing
+        with self._lock:
+            if self._pending >= self.workers * 2:
+                metrics.incr("speculative_skipped_total", kind=kind, reason="busy")
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    # -------------------- Public API --------------------
+
+    def speculate(self, state: Optional[Dict[str, Any]]) -> None:
+        """Start the guesses for a state the user is now looking at."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="speculative")
+        guesses = self._guesses(state)
+        base = fingerprint(guesses[0][1]["state"]) if guesses else ""
+        for kind, payload, key in guesses:
+            if not self._reserve(kind):
+                break
+            if not self.store.start(key, base, kind):
+                self._release()
+                continue
+            self._executor.submit(self._run, kind, payload, key)
+
+    def take(self, kind: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The new state for a click if its guess is ready (the other guesses are dropped)."""
+        key = _key(kind, payload)
+        result = self.store.take(key)
+        if result is None:
+            return None
+        self.store.cancel(fingerprint(payload["state"]), keep=key)
+        self.store.count("hit", kind)
+        return result
+
+    def join(self, kind: str, payload: Dict[str, Any], timeout: float = SPECULATE_JOIN_TIMEOUT) -> Optional[Dict[str, Any]]:
+        """
+        Like take(), but waits for a guess that is already running; None on a
+        miss. A guess still queued behind others is dropped: the click's own
+        job runs sooner.
+        """
+        key = _key(kind, payload)
+        self.store.cancel(fingerprint(payload["state"]), keep=key)
+        waited = False
+        deadline = time.monotonic() + timeout
+        while self.store.status(key) == RUNNING and time.monotonic() < deadline:
+            waited = True
+            time.sleep(POLL_SECONDS)
+        return self._joined(kind, payload, key, waited)
+
+    def _joined(self, kind: str, payload: Dict[str, Any], key: str, waited: bool) -> Optional[Dict[str, Any]]:
+        result = self.store.take(key)
+        if result is None:
+            # The click runs for real, so a queued or overdue guess is waste
+            self.store.cancel(fingerprint(payload["state"]))
+        if result is not None or _guessable(kind, payload):
+            self.store.count("miss" if result is None else "joined" if waited else "hit", kind)
+        return result
+
+    def discard(self, state: Optional[Dict[str, Any]]) -> None:
+        """Drop every guess for a state the user left (ended or reset the story)."""
+        if state:
+            self.store.cancel(fingerprint(state))
+
+    def wrap(self, handlers: Dict[str, Callable[[Dict[str, Any]], Any]]) -> Dict[str, Callable[[Dict[str, Any]], Any]]:
+        """Job handlers that serve a speculative result before running the flow."""
+        def served(kind, handler):
+            def run(payload):
+                result = self.join(kind, payload)
+                return result if result is not None else handler(payload)
+            return run
+        return {kind: served(kind, h) if kind in self.flows else h for kind, h in handlers.items()}
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # -------------------- Runs --------------------
+
+    def _run(self, kind: str, payload: Dict[str, Any], key: str) -> None:
+        try:
+            if not self.store.begin(key):
+                # Cancelled while waiting for a free worker
+                self.store.drop(key, kind, 0, WASTED, "cancelled")
+                return
+            with track_usage() as usage, ratelimit.priority("batch"):
+                try:
+                    result = self.flows[kind](_copy(payload))
+                except Exception:
+                    log.exception("speculative %s failed", kind)
+                    self.store.drop(key, kind, _tokens(usage), FAILED, "failed")
+                    return
+            if self.store.finish(key, kind, result, _tokens(usage)):
+                metrics.incr("speculative_runs_total", kind=kind, outcome="ready")
+        finally:
+            self._release()
+
+
+class AsyncSpeculator(Speculator):
+    """
+    Speculator for the ASGI app: flows are coroutine functions and guesses
+    are tasks on the server's event loop. Cancelling a guess cancels its
+    task, so a diverging click stops the LLM calls it was still making.
+    take(), join() and discard() are coroutines here.
+    """
+
+    def __init__(self, flows: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]],
+                 store: Optional[SpeculationStore] = None, workers: int = SPECULATE_WORKERS):
+        super().__init__(flows, store=store, workers=workers)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._spawned: Set[asyncio.Task] = set()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._spawned.add(task)
+        task.add_done_callback(self._spawned.discard)
+
+    def speculate(self, state: Optional[Dict[str, Any]]) -> None:
+        """Start the guesses for a state (returns at once; must be called on the loop)."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self._spawn(self._speculate(state))
+
+    async def _speculate(self, state: Optional[Dict[str, Any]]) -> None:
+        guesses = self._guesses(state)
+        base = fingerprint(guesses[0][1]["state"]) if guesses else ""
+        for kind, payload, key in guesses:
+            if not self._reserve(kind):
+                break
+            if not await asyncio.to_thread(self.store.start, key, base, kind):
+                self._release()
+                continue
+            task = asyncio.get_running_loop().create_task(self._run_async(kind, payload, key))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _, key=key: self._tasks.pop(key, None))
+
+    def _cancel_local(self, keys: List[str]) -> None:
+        for key in keys:
+            task = self._tasks.get(key)
+            if task is not None:
+                task.cancel()
+
+    async def take(self, kind: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = _key(kind, payload)
+        result = await asyncio.to_thread(self.store.take, key)
+        if result is None:
+            return None
+        self._cancel_local(await asyncio.to_thread(self.store.cancel, fingerprint(payload["state"]), key))
+        self.store.count("hit", kind)
+        return result
+
+    async def join(self, kind: str, payload: Dict[str, Any],
+                   timeout: float = SPECULATE_JOIN_TIMEOUT) -> Optional[Dict[str, Any]]:
+        key = _key(kind, payload)
+        self._cancel_local(await asyncio.to_thread(self.store.cancel, fingerprint(payload["state"]), key))
+        waited = False
+        task = self._tasks.get(key)
+        running = await asyncio.to_thread(self.store.status, key) == RUNNING
+        if task is not None and running:
+            waited = True
+            await asyncio.wait({task}, timeout=timeout)
+        elif running:
+            deadline = time.monotonic() + timeout
+            while await asyncio.to_thread(self.store.status, key) == RUNNING and time.monotonic() < deadline:
+                waited = True
+                await asyncio.sleep(POLL_SECONDS)
+        result = await asyncio.to_thread(self._joined, kind, payload, key, waited)
+        if result is None:
+            self._cancel_local([key])
+        return result
+
+    async def discard(self, state: Optional[Dict[str, Any]]) -> None:
+        if state:
+            self._cancel_local(await asyncio.to_thread(self.store.cancel, fingerprint(state)))
+
+    def wrap(self, handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]]
+             ) -> Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]]:
+        def served(kind, handler):
+            async def run(payload):
+                result = await self.join(kind, payload)
+                return result if result is not None else await handler(payload)
+            return run
+        return {kind: served(kind, h) if kind in self.flows else h for kind, h in handlers.items()}
+
+    async def stop(self) -> None:
+        """Cancel running guesses (they count as waste)."""
+        tasks = list(self._tasks.values()) + list(self._spawned)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_async(self, kind: str, payload: Dict[str, Any], key: str) -> None:
+        usage = None
+        try:
+            async with self._slots:
+                if not await asyncio.to_thread(self.store.begin, key):
+                    await asyncio.to_thread(self.store.drop, key, kind, 0, WASTED, "cancelled")
+                    return
+                with track_usage() as usage, ratelimit.priority("batch"):
+                    result = await self.flows[kind](_copy(payload))
+            if await asyncio.to_thread(self.store.finish, key, kind, result, _tokens(usage)):
+                metrics.incr("speculative_runs_total", kind=kind, outcome="ready")
+        except asyncio.CancelledError:
+            tokens = _tokens(usage) if usage is not None else 0
+            await asyncio.shield(asyncio.to_thread(self.store.drop, key, kind, tokens, WASTED, "cancelled"))
+            raise
+        except Exception:
+            log.exception("speculative %s failed", kind)
+            tokens = _tokens(usage) if usage is not None else 0
+            await asyncio.to_thread(self.store.drop, key, kind, tokens, FAILED, "failed")
+        finally:
+            self._release()
+
+
+def stats() -> Dict[str, Any]:
+    return get_store().stats()
@@ -0,0 +1,286 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Keys (and safe defaults) for the classifier brief
+BRIEF_CATEGORIES = ["bedtime-calm", "adventure", "animal-friends", "learning-moral", "fantasy", "silly"]
+BRIEF_DEFAULTS: Dict[str, Any] = {
+    "title_hint": "",
+    "category": "bedtime-calm",
+    "setting": "a cozy, quiet place at bedtime",
+    "characters": [],
+    "moral": "kindness",
+    "tone": "gentle and soothing",
+    "length_words": 550,
+    "avoid_topics": [],
+    "age_range": "5-10",
+}
+# Judge rubric keys, pass thresholds as in the judge prompt
+SCORE_KEYS = ["age_fit", "tone", "structure", "clarity", "safety",
+              "bedtime_suitability", "requirements_satisfaction"]
+PASS_MIN_SCORE = 8
+PASS_MIN_AVERAGE = 8.5
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```\s*$")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class SchemaError(ValueError):
+    """Model output that can't be repaired into the expected JSON object."""
+
+
+# -------------------- Tolerant parsing --------------------
+
+def _scan(text: str) -> Tuple[List[str], List[str], List[Tuple[int, List[str]]], bool]:
+    """
+    Re-emit `text` as JSON pieces: single-quoted strings become double-quoted,
+    Python literals become JSON ones and trailing commas are dropped.
+    Returns (pieces, open brackets, cut points at commas as (piece index,
+    open brackets), still inside a string).
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    cuts: List[Tuple[int, List[str]]] = []
+    quote = ""
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < n:
+                nxt = text[i + 1]
+                # \' is not a JSON escape
+                out.append("'" if nxt == "'" else ch + nxt)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = ""
+            elif ch == '"':
+                out.append('\\"')  # inside a single-quoted string
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # ignore anything after the top-level object
+        elif ch == ",":
+            cuts.append((len(out), list(stack)))
+            out.append(ch)
+        elif ch.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+    return out, stack, cuts, bool(quote)
+
+
+def parse_json(raw: str, truncated: bool = True) -> Dict[str, Any]:
+    """
+    Parse a JSON object from model output, repairing common damage: code
+    fences, prose around the object, single quotes, Python literals, trailing
+    commas, and truncation (unterminated strings, missing closing braces).
+    With truncated=False a cut-off reply is rejected instead, for replies
+    whose strings are used verbatim. Raises SchemaError if no object can be
+    recovered.
+    """
+    s = _FENCE_RE.sub("", (raw or "").strip())
+    start = s.find("{")
+    if start == -1:
+        raise SchemaError("no JSON object in reply")
+    end = s.rfind("}")
+    if end > start:
+        try:
+            data = json.loads(s[start:end + 1])
+            if isinstance(data, dict):
+                return data
+        except json.JSONDecodeError:
+            pass
+
+    pieces, stack, cuts, in_string = _scan(s[start:])
+    if not truncated and (stack or in_string):
+        raise SchemaError("reply was cut off")
+    body = "".join(pieces) + ('"' if in_string else "")
+    body = body.rstrip().rstrip(",")
+    closers = "".join(reversed(stack))
+    candidates = [body + closers, body + " null" + closers, body + ": null" + closers]
+    # Truncated mid-member: drop the incomplete member after the last comma
+    candidates += ["".join(pieces[:idx]) + "".join(reversed(open_)) for idx, open_ in reversed(cuts)]
+    for candidate in candidates:
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    raise SchemaError("unrepairable JSON in reply")
+
+
+# -------------------- Coercion --------------------
+
+def _as_str(value: Any, default: str = "") -> str:
+    if value is None:
+        return default
+    if isinstance(value, (list, tuple)):
+        return " ".join(str(v) for v in value)
+    return str(value).strip() or default
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        return [p.strip() for p in re.split(r"[;,\n]", value) if p.strip()]
+    if isinstance(value, (list, tuple)):
+        return [_as_str(v) if not isinstance(v, dict) else v for v in value if v not in (None, "")]
+    return [str(value)]
+
+
+def _as_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        m = re.search(r"-?\d+(?:\.\d+)?", value)
+        return float(m.group()) if m else None
+    return None
+
+
+def _as_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        v = value.strip().lower()
+        if v in ("true", "yes", "pass", "passed", "1"):
+            return True
+        if v in ("false", "no", "fail", "failed", "0"):
+            return False
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return None
+
+
+def coerce_brief(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill and type-fix a classifier brief. Needs at least one of setting,
+    characters or category from the model; everything else has a default.
+    """
+    if not any(data.get(k) for k in ("setting", "characters", "category")):
+        raise SchemaError("brief has none of setting/characters/category")
+    brief = dict(data)
+    for key in ("title_hint", "setting", "moral", "tone", "age_range"):
+        brief[key] = _as_str(data.get(key), BRIEF_DEFAULTS[key])
+    category = _as_str(data.get("category")).lower().replace(" ", "-")
+    brief["category"] = category if category in BRIEF_CATEGORIES else BRIEF_DEFAULTS["category"]
+    brief["characters"] = _as_list(data.get("characters"))
+    brief["avoid_topics"] = [str(t).lower() for t in _as_list(data.get("avoid_topics"))]
+    length = _as_number(data.get("length_words"))
+    brief["length_words"] = int(min(700, max(400, length))) if length else BRIEF_DEFAULTS["length_words"]
+    return brief
+
+
+def default_brief(user_request: str) -> Dict[str, Any]:
+    """Safe brief used when the classifier never returns usable JSON."""
+    brief = dict(BRIEF_DEFAULTS, characters=[], avoid_topics=[])
+    brief["title_hint"] = " ".join(user_request.split()[:8])
+    brief["request"] = user_request
+    return brief
+
+
+def coerce_verdict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill and type-fix a judge verdict: integer scores clamped to 0-10 and an
+    average. Needs every rubric score from the model (a truncated reply is
+    re-asked, never passed on partial scores). `pass` is the score thresholds,
+    AND-ed with the model's own pass when it gives one.
+    """
+    raw_scores = data.get("scores")
+    if not isinstance(raw_scores, dict):
+        raw_scores = {k: data[k] for k in SCORE_KEYS if k in data}
+    scores: Dict[str, Any] = {}
+    for key, value in raw_scores.items():
+        num = _as_number(value)
+        if num is not None and key != "average":
+            scores[key] = int(round(min(10.0, max(0.0, num))))
+    missing = [k for k in SCORE_KEYS if k not in scores]
+    if missing:
+        raise SchemaError(f"verdict is missing scores: {', '.join(missing)}")
+
+    rubric = [scores[k] for k in SCORE_KEYS]
+    scores["average"] = round(sum(rubric) / len(rubric), 2)
+    passed = min(rubric) >= PASS_MIN_SCORE and scores["average"] >= PASS_MIN_AVERAGE
+    if _as_bool(data.get("pass")) is False:
+        passed = False
+    verdict = dict(data)
+    verdict["scores"] = scores
+    verdict["pass"] = passed
+    verdict["issues"] = _as_list(data.get("issues"))
+    verdict["edit_instructions"] = _as_str(data.get("edit_instructions"))
+    return verdict
+
+
+def _chapter_plan(data: Any, number: int) -> Dict[str, Any]:
+    data = data if isinstance(data, dict) else {"beats": data}
+    beats = data.get("beats")
+    return {"title": _as_str(data.get("title"), f"Chapter {number}"),
+            # A single string is one beat (beats often contain commas)
+            "beats": [beats.strip()] if isinstance(beats, str) and beats.strip() else _as_list(beats),
+            "ends_with": _as_str(data.get("ends_with"))}
+
+
+def coerce_outline(data: Dict[str, Any], chapters: int) -> Dict[str, Any]:
+    """
+    Fill and type-fix a story plan with exactly `chapters` chapter plans
+    (extra ones are dropped, missing ones left to the storyteller). Needs
+    chapter plans from the model.
+    """
+    plans = data.get("chapters")
+    if not isinstance(plans, list) or not plans:
+        raise SchemaError("outline has no chapter plans")
+    characters = [c if isinstance(c, dict) else {"name": str(c), "traits": ""}
+                  for c in (data.get("characters") or []) if c]
+    return {
+        "title": _as_str(data.get("title")),
+        "characters": [{"name": _as_str(c.get("name")), "traits": _as_str(c.get("traits"))} for c in characters],
+        "setting": _as_str(data.get("setting")),
+        "chapters": [_chapter_plan(plans[i] if i < len(plans) else {}, i + 1) for i in range(chapters)],
+        "ending": _as_str(data.get("ending")),
+    }
+
+
+def default_outline(brief: Dict[str, Any], chapters: int) -> Dict[str, Any]:
+    """Bare plan used when the planner never returns usable JSON: chapters follow the brief alone."""
+    return {"title": _as_str(brief.get("title_hint")), "characters": [],
+            "setting": _as_str(brief.get("setting")),
+            "chapters": [_chapter_plan({}, i + 1) for i in range(chapters)], "ending": ""}
+
+
+def reask_messages(messages: List[Dict[str, str]], raw: str, error: Exception) -> List[Dict[str, str]]:
+    """Follow-up asking the model to restate its last reply as valid JSON."""
+    return list(messages) + [
+        {"role": "assistant", "content": (raw or "")[:4000]},
+        {"role": "user", "content": f"That reply could not be used ({error}). "
+                                    "Return ONLY the complete JSON object, with every required key."},
+    ]
@@ -0,0 +1,95 @@
+import httpx
+import pytest
+
+import cache
+import checkpoints
+import dedup
+import fake_openai
+import llm
+import pipeline
+
+PROMPT = "A gentle story about a hedgehog who learns to be patient"
+
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    """Fake API whose judge fails the first story, with a fresh checkpoint store and no caches."""
+    server, base_url = fake_openai.start_server(fake_openai.FakeConfig(judge_script="fail,pass"))
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    monkeypatch.setattr(cache, "CACHE_STAGES", set())
+    monkeypatch.setattr(dedup, "INDEX_ENABLED", False)
+    monkeypatch.setattr(checkpoints, "CHECKPOINTS_ENABLED", True)
+    monkeypatch.setattr(checkpoints, "_store", checkpoints.CheckpointStore(str(tmp_path / "checkpoints.sqlite3")))
+    llm.reset_clients()
+    yield base_url
+    server.shutdown()
+    llm.reset_clients()
+
+
+def _calls(base_url):
+    """Upstream calls per stage so far."""
+    return httpx.get(base_url.rsplit("/v1", 1)[0] + "/stats").json()["calls"]
+
+
+def _since(base_url, before):
+    after = _calls(base_url)
+    return {stage: n - before.get(stage, 0) for stage, n in after.items() if n != before.get(stage, 0)}
+
+
+def test_failed_run_resumes_from_its_checkpoints(fake, monkeypatch):
+    chat = pipeline.chat
+
+    def editor_down(messages, stage="", **kwargs):
+        if stage == "editor":
+            raise RuntimeError("editor down")
+        return chat(messages, stage=stage, **kwargs)
+
+    monkeypatch.setattr(pipeline, "chat", editor_down)
+    with checkpoints.run("job-1"), pytest.raises(RuntimeError):
+        pipeline.generate_story(PROMPT)
+    assert _calls(fake) == {"classifier": 1, "storyteller": 1, "judge": 1}
+
+    monkeypatch.setattr(pipeline, "chat", chat)
+    before = _calls(fake)
+    with checkpoints.run("job-1"):
+        result = pipeline.generate_story(PROMPT)
+    # Brief, draft and the first verdict are replayed; only the edit round runs
+    assert result["passed"]
+    assert _since(fake, before) == {"editor": 1, "judge": 1}
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_finished_run_replays_without_calls(fake, concurrency):
+    with checkpoints.run("arc-1"):
+        first = pipeline.generate_outlined_arc(PROMPT, chapters=3, concurrency=concurrency)
+    before = _calls(fake)
+    with checkpoints.run("arc-1"):
+        again = pipeline.generate_outlined_arc(PROMPT, chapters=3, concurrency=concurrency)
+    # Chapters written at once replay into their own chapter, so the continuity pass matches too
+    assert _since(fake, before) == {}
+    assert again == first
+
+
+def test_changed_input_invalidates_the_checkpoint(fake):
+    with checkpoints.run("job-2"):
+        brief = pipeline.classify_request(PROMPT)
+        story = pipeline.tell_story(brief)
+    before = _calls(fake)
+    with checkpoints.run("job-2"):
+        assert pipeline.classify_request(PROMPT) == brief
+        assert pipeline.tell_story(brief) == story
+        pipeline.classify_request(PROMPT + " and shares")
+        pipeline.tell_story(dict(brief, moral="sharing"))
+        pipeline.judge_story(brief, story + " The end.")
+    assert _since(fake, before) == {"classifier": 1, "storyteller": 1, "judge": 1}
+
+
+def test_runs_are_kept_apart(fake):
+    with checkpoints.run("job-3"):
+        pipeline.classify_request(PROMPT)
+    before = _calls(fake)
+    with checkpoints.run("job-4"):
+        pipeline.classify_request(PROMPT)
+    pipeline.classify_request(PROMPT)
+    assert _since(fake, before) == {"classifier": 2}
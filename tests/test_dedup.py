@@ -0,0 +1,30 @@
+import asyncio
+
+import dedup
+import pipeline
+
+BRIEF = {"category": "animal-friends", "moral": "sharing"}
+
+
+def _index(monkeypatch, tmp_path):
+    index = dedup.RequestIndex(path=str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr(dedup, "INDEX_ENABLED", True)
+    monkeypatch.setattr(dedup, "_index", index)
+    return index
+
+
+def test_requests_are_remembered(monkeypatch, tmp_path):
+    index = _index(monkeypatch, tmp_path)
+    pipeline._remember_request("a story about a bunny who shares", BRIEF)
+    assert index.lookup("bunny learning to share")["brief"] == BRIEF
+
+
+def test_read_only_requests_are_not_remembered(monkeypatch, tmp_path):
+    index = _index(monkeypatch, tmp_path)
+    with dedup.read_only():
+        pipeline._remember_request("a story about a bunny who shares", BRIEF)
+        # Async stages write from a thread; the flag follows them there
+        asyncio.run(pipeline._aremember_request("a fox who is patient", BRIEF))
+    assert index.lookup("bunny learning to share") is None
+    assert index.lookup("a patient fox") is None
+    assert dedup.remembering()
@@ -0,0 +1,37 @@
+import json
+
+import fake_openai
+from fake_openai import STORY_FACTS, FakeConfig, FakeState, render
+
+
+def _reply(stage, text):
+    state = FakeState(FakeConfig(story_facts=True))
+    return render(stage, state, [{"role": "system", "content": ""}, {"role": "user", "content": text}])
+
+
+def _consistency(chapter):
+    return json.loads(_reply("judge", chapter))["scores"]["consistency"]
+
+
+def test_chapter_calls_back_to_keepsakes_it_can_see():
+    full = _reply("chapter", " ".join(STORY_FACTS[:4]))
+    assert fake_openai._facts_in(full) == [0, 2, 4]
+    assert _consistency(full) == 10
+
+
+def test_lost_keepsakes_lower_consistency():
+    # Only the latest chapter survived: keepsakes 0 and 2 are gone
+    chapter = _reply("chapter", STORY_FACTS[3])
+    assert fake_openai._facts_in(chapter) == [4]
+    assert _consistency(chapter) == 0
+
+
+def test_memory_keeps_keepsakes_as_threads():
+    memory = json.loads(_reply("memory", f"{STORY_FACTS[1]} and {STORY_FACTS[0]}"))
+    assert memory["open_threads"] == [f"keep {STORY_FACTS[0]} safe", f"keep {STORY_FACTS[1]} safe"]
+
+
+def test_plain_mode_has_no_keepsakes():
+    state = FakeState(FakeConfig())
+    assert "consistency" not in json.loads(render("judge", state, []))["scores"]
+    assert not fake_openai._facts_in(render("chapter", state, [{"role": "user", "content": STORY_FACTS[0]}]))
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import patches
+from patches import PatchError
+
+STORY = "Pip and the Stars\n\nPip woke up.\n\nPip saw the moon.\n\nPip fell asleep."
+
+
+def _apply(*ops, story=STORY):
+    return patches.split_paragraphs(patches.apply_patch(story, json.dumps({"ops": list(ops)})))
+
+
+def test_number_paragraphs():
+    assert patches.number_paragraphs(STORY).splitlines()[::2] == [
+        "[0] Pip and the Stars", "[1] Pip woke up.", "[2] Pip saw the moon.", "[3] Pip fell asleep."]
+
+
+def test_ops_use_the_original_numbering():
+    out = _apply({"op": "delete", "p": 1},
+                 {"op": "insert", "after": 1, "text": "A firefly blinked."},
+                 {"op": "replace", "p": 3, "text": "[3] Pip slept softly."},
+                 {"op": "insert", "after": 1, "text": "Wren sang."})
+    assert out == ["Pip and the Stars", "A firefly blinked.", "Wren sang.", "Pip saw the moon.", "Pip slept softly."]
+
+
+@pytest.mark.parametrize("op", [
+    {"op": "replace", "p": 4, "text": "x"},
+    {"op": "delete", "p": -1},
+    {"op": "insert", "after": "9", "text": "x"},
+    {"op": "replace", "p": True, "text": "x"},
+])
+def test_out_of_range_indexes_are_rejected(op):
+    with pytest.raises(PatchError):
+        _apply(op)
+
+
+def test_overlapping_operations_are_rejected():
+    with pytest.raises(PatchError, match="changed twice"):
+        _apply({"op": "replace", "p": 2, "text": "x"}, {"op": "delete", "p": 2})
+
+
+@pytest.mark.parametrize("ops", [
+    [{"op": "delete", "p": 0}],
+    [{"op": "delete", "p": 1}, {"op": "delete", "p": 2}, {"op": "delete", "p": 3}],
+    [{"op": "replace", "p": 1, "text": "  "}],
+    [{"op": "rewrite", "p": 1, "text": "x"}],
+])
+def test_invalid_patches_are_rejected(ops):
+    with pytest.raises(PatchError):
+        _apply(*ops)
+
+
+def test_damaged_json_is_repaired():
+    raw = "```json\n{'ops': [{'op': 'replace', 'p': '2', 'text': 'Pip saw the stars.'},]}\n```"
+    assert patches.split_paragraphs(patches.apply_patch(STORY, raw))[2] == "Pip saw the stars."
+
+
+@pytest.mark.parametrize("raw", [
+    "",
+    "I made the ending calmer.",
+    '{"ops": [{"op": "replace", "p": 3, "text": "Pip fell asl',
+    '{"changes": []}',
+])
+def test_unusable_replies_are_rejected(raw):
+    with pytest.raises(PatchError):
+        patches.apply_patch(STORY, raw)
+
+
+def test_unusable_patch_falls_back_to_a_full_rewrite(monkeypatch):
+    import pipeline
+
+    replies = {"editor_patch": "Sorry, here is the story instead.", "editor": "Pip and the Stars\n\nA new story."}
+    calls = []
+
+    def chat(messages, stage="", **kwargs):
+        calls.append((stage, kwargs.get("json_mode", False)))
+        return replies[stage]
+
+    monkeypatch.setattr(pipeline, "chat", chat)
+    revised = pipeline.edit_story({}, STORY, {"issues": []}, mode="patch")
+    assert revised == "Pip and the Stars\n\nA new story."
+    assert calls == [("editor_patch", True), ("editor", False)]
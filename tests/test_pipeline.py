@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+import pipeline
+
+BRIEF = {"category": "bedtime-calm"}
+
+
+def _candidates(monkeypatch, outcomes):
+    """Candidate drafts that end, in turn, as `outcomes`: "pass", "fail" or "cancel"."""
+    outcomes = iter(outcomes)
+
+    async def tell(brief, cache=True):
+        outcome = next(outcomes)
+        await asyncio.sleep(0.01)
+        if outcome == "cancel":
+            raise asyncio.CancelledError()
+        if outcome == "fail":
+            raise ValueError("draft failed")
+        return "a story"
+
+    async def judge(brief, story):
+        return {"pass": True, "scores": {}}
+
+    monkeypatch.setattr(pipeline, "atell_story", tell)
+    monkeypatch.setattr(pipeline, "ajudge_story", judge)
+
+
+def test_cancelled_candidate_is_skipped(monkeypatch):
+    _candidates(monkeypatch, ["cancel", "pass", "cancel"])
+    story, verdict, judged = asyncio.run(pipeline._best_candidate(BRIEF, 3, 3, None))
+    assert story == "a story" and judged == 1
+
+
+def test_failed_candidate_error_is_raised(monkeypatch):
+    _candidates(monkeypatch, ["cancel", "fail"])
+    with pytest.raises(ValueError):
+        asyncio.run(pipeline._best_candidate(BRIEF, 2, 2, None))
+
+
+def test_all_candidates_cancelled(monkeypatch):
+    _candidates(monkeypatch, ["cancel", "cancel"])
+    with pytest.raises(RuntimeError):
+        asyncio.run(pipeline._best_candidate(BRIEF, 2, 2, None))
+
+
+STORY = ("Pip and the Stars\n\n" + "\n\n".join(
+    "Pip the little hedgehog watched the stars come out over the quiet meadow. " * 9 for _ in range(4)))
+
+
+def _fused(monkeypatch, replies):
+    """Fused-stage replies served in turn; returns the (stage, json failure action) log."""
+    replies, log = iter(replies), []
+
+    def chat(messages, stage="", **kwargs):
+        log.append((stage, None))
+        return next(replies)
+
+    def incr(name, amount=1.0, **labels):
+        if name == "llm_json_failures_total":
+            log.append((labels["stage"], labels["action"]))
+
+    monkeypatch.setattr(pipeline, "chat", chat)
+    monkeypatch.setattr(pipeline.metrics, "incr", incr)
+    return log
+
+
+def test_unusable_fused_reply_is_reasked(monkeypatch):
+    scores = dict.fromkeys(pipeline.structured.SCORE_KEYS, 9)
+    log = _fused(monkeypatch, ['{"scores": {"age_fit": 9', json.dumps({"scores": scores, "issues": []})])
+    verdict, revised = pipeline.judge_and_revise({}, STORY)
+    assert verdict["pass"] and revised is None
+    assert log == [("judge_revise", None), ("judge_revise", "reask"), ("judge_revise", None)]
+
+
+def test_fused_stage_falls_back_to_the_judge(monkeypatch):
+    scores = dict.fromkeys(pipeline.structured.SCORE_KEYS, 9)
+    log = _fused(monkeypatch, ["no json", "still none", json.dumps({"scores": scores})])
+    verdict, _ = pipeline.judge_and_revise({}, STORY)
+    assert verdict["pass"]
+    assert [entry for entry in log if entry[1]] == [("judge_revise", "reask"), ("judge_revise", "default")]
+    assert log[-1] == ("judge", None)
+
+
+@pytest.mark.parametrize("call, coroutine", [
+    (lambda: pipeline.generate_outlined_arc("a fox", chapters=2), "agenerate_outlined_arc"),
+    (lambda: pipeline.generate_arc_start("a fox"), "agenerate_arc_start"),
+    (lambda: pipeline.generate_story("a fox", candidates=2), "agenerate_story"),
+])
+def test_sync_entry_points_refuse_a_running_loop(call, coroutine, recwarn):
+    async def inside_loop():
+        with pytest.raises(RuntimeError, match=coroutine):
+            call()
+
+    asyncio.run(inside_loop())
+    assert not [w for w in recwarn if "never awaited" in str(w.message)]
@@ -0,0 +1,37 @@
+import pool
+
+
+def _filler(tmp_path, produce):
+    store = pool.StoryPool(path=str(tmp_path / "pool.sqlite3"), size=1)
+    filler = pool.PoolFiller(produce, pool=store, interval=60)
+    filler.keys = [("silly", "kindness"), ("adventure", "courage")]
+    return filler, store
+
+
+def test_failed_key_backs_off(tmp_path):
+    tried = []
+
+    def produce(category, moral):
+        tried.append((category, moral))
+        return None
+
+    filler, _ = _filler(tmp_path, produce)
+    assert filler.fill_once() is False
+    assert filler.fill_once() is False
+    assert filler.fill_once() is False  # both keys backing off: nothing claimed
+    assert len(tried) == 2 and len(set(tried)) == 2
+
+
+def test_backoff_doubles_and_success_resets(tmp_path):
+    results = [None, None, ({"category": "silly"}, "story", [])]
+    filler, store = _filler(tmp_path, lambda c, m: results.pop(0))
+    filler.keys = [("silly", "kindness")]
+    filler.fill_once()
+    first = filler._backoff[("silly", "kindness")]
+    filler._backoff[("silly", "kindness")] = (first[0], 0.0)
+    filler.fill_once()
+    assert filler._backoff[("silly", "kindness")][0] == 2
+    filler._backoff[("silly", "kindness")] = (2, 0.0)
+    assert filler.fill_once() is True
+    assert ("silly", "kindness") not in filler._backoff
+    assert store.stats()["ready"] == 1
@@ -0,0 +1,38 @@
+import prejudge
+
+BRIEF = {"avoid_topics": ["fear", "darkness", "scary monsters"]}
+SENTENCE = "Pip the little hedgehog watched the stars come out over the quiet meadow. "
+
+
+def _story(paragraphs=4, sentences=9, extra=""):
+    body = "\n\n".join(SENTENCE * sentences for _ in range(paragraphs))
+    return "Pip and the Stars\n\n" + body + extra
+
+
+def test_clean_story_passes():
+    assert prejudge.prejudge(BRIEF, _story())["pass"]
+
+
+def test_single_avoided_word_goes_to_the_judge():
+    local = prejudge.prejudge(BRIEF, _story(extra=" Then the fear melted away."))
+    assert local["pass"]
+    assert any("fear" in issue for issue in local["issues"])
+    assert local["local_scores"]["banned_terms"] == ["fear"]
+
+
+def test_avoided_phrase_fails():
+    local = prejudge.prejudge(BRIEF, _story(extra=" Then scary monsters came."))
+    assert not local["pass"]
+    assert "scary monsters" in local["edit_instructions"]
+
+
+def test_few_paragraphs_go_to_the_judge():
+    local = prejudge.prejudge(BRIEF, _story(paragraphs=1, sentences=36))
+    assert local["pass"]
+    assert any("paragraph" in issue for issue in local["issues"])
+
+
+def test_unambiguous_failures_skip_the_judge():
+    assert not prejudge.prejudge(BRIEF, _story(sentences=1))["pass"]
+    assert not prejudge.prejudge(BRIEF, "**" + _story())["pass"]
+    assert not prejudge.prejudge(BRIEF, "Once upon a time there was a hedgehog who loved stars.\n\n" + _story())["pass"]
@@ -0,0 +1,228 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import fake_openai
+import llm
+import resilience
+
+MESSAGES = [
+    {"role": "system", "content": "You are a Children's Literature Judge."},
+    {"role": "user", "content": "Judge this story."},
+]
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(resilience, "MAX_RETRIES", 5)
+    monkeypatch.setattr(resilience, "HEDGE", False)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(threshold=0))
+
+
+def _fake(monkeypatch, **config):
+    server, base_url = fake_openai.start_server(fake_openai.FakeConfig(**config))
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "fake")
+    llm.reset_clients()
+    return server, base_url
+
+
+def _upstream(base_url):
+    stats = httpx.get(base_url.rsplit("/v1", 1)[0] + "/stats").json()
+    return sum(stats["calls"].values()), stats["errors"]
+
+
+@pytest.fixture
+def fake(monkeypatch, request):
+    server, base_url = _fake(monkeypatch, **getattr(request, "param", {}))
+    yield base_url
+    server.shutdown()
+    llm.reset_clients()
+
+
+def _open_breaker(cooldown=0.05):
+    breaker = resilience.CircuitBreaker(threshold=1, cooldown=cooldown)
+    breaker.failure("server")
+    time.sleep(cooldown + 0.01)
+    assert breaker.state == "half-open"
+    return breaker
+
+
+# -------------------- Retries --------------------
+
+@pytest.mark.parametrize("fake", [{"error_rate": 0.4, "error_statuses": "500,503", "seed": 3}], indirect=True)
+def test_transient_errors_are_retried(fast_retries, fake):
+    for _ in range(20):
+        assert llm.chat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+    calls, errors = _upstream(fake)
+    assert errors > 0
+    assert calls == 20 + errors
+
+
+@pytest.mark.parametrize("fake", [{"error_rate": 0.4, "error_statuses": "500", "seed": 5}], indirect=True)
+def test_async_transient_errors_are_retried(fast_retries, fake):
+    async def run():
+        try:
+            return await asyncio.gather(*(llm.achat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+                                          for _ in range(10)))
+        finally:
+            await llm.aclose()
+
+    assert all(asyncio.run(run()))
+    assert _upstream(fake)[1] > 0
+
+
+@pytest.mark.parametrize("fake", [{"error_rate": 1.0, "error_statuses": "400"}], indirect=True)
+def test_client_errors_are_not_retried(fast_retries, fake):
+    with pytest.raises(openai.BadRequestError):
+        llm.chat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+    assert _upstream(fake)[0] == 1
+
+
+def test_backoff_respects_retry_after():
+    response = httpx.Response(429, headers={"retry-after": "0.7"},
+                              request=httpx.Request("POST", "http://fake/v1/chat/completions"))
+    exc = openai.RateLimitError("slow down", response=response, body=None)
+    assert resilience.classify(exc) == "rate_limit"
+    assert all(resilience.backoff_delay(0, exc) >= 0.7 for _ in range(20))
+
+
+# -------------------- Circuit breaker --------------------
+
+@pytest.mark.parametrize("fake", [{"error_rate": 1.0, "error_statuses": "500"}], indirect=True)
+def test_breaker_fails_fast_when_upstream_is_down(fast_retries, fake, monkeypatch):
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(threshold=3, cooldown=30))
+    with pytest.raises(openai.InternalServerError):
+        llm.chat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+    sent = _upstream(fake)[0]
+    assert sent == 3
+    started = time.perf_counter()
+    for _ in range(10):
+        with pytest.raises(resilience.CircuitOpenError):
+            llm.chat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+    assert time.perf_counter() - started < 0.5
+    assert _upstream(fake)[0] == sent
+
+
+def test_probe_success_closes_breaker(monkeypatch):
+    breaker = _open_breaker()
+    monkeypatch.setattr(resilience, "breaker", breaker)
+    assert resilience.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_releases_breaker(monkeypatch):
+    breaker = _open_breaker()
+    monkeypatch.setattr(resilience, "breaker", breaker)
+    monkeypatch.setattr(resilience, "HEDGE", False)
+
+    async def hang():
+        await asyncio.sleep(30)
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        probe = asyncio.ensure_future(resilience.acall(hang, stage="judge"))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await resilience.acall(ok, stage="judge")
+
+    assert asyncio.run(run()) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_interrupted_sync_probe_releases_breaker(monkeypatch):
+    breaker = _open_breaker()
+    monkeypatch.setattr(resilience, "breaker", breaker)
+    monkeypatch.setattr(resilience, "HEDGE", False)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        resilience.call(interrupted, stage="judge")
+    assert resilience.call(lambda: "ok", stage="judge") == "ok"
+
+
+# -------------------- Hedging --------------------
+
+def _warm(stage, seconds=0.01):
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        resilience.observe_latency(stage, seconds)
+
+
+def test_slow_call_is_hedged(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SECONDS", 0.05)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(threshold=0))
+    _warm("hedge-sync")
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        time.sleep(2.0 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    started = time.perf_counter()
+    assert resilience.call(send, stage="hedge-sync", hedge=True) == 2
+    assert time.perf_counter() - started < 1.0
+
+
+def test_async_hedge_cancels_loser(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SECONDS", 0.05)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(threshold=0))
+    _warm("hedge-async")
+    attempts, cancelled = [], []
+
+    async def send():
+        attempts.append(1)
+        try:
+            await asyncio.sleep(2.0 if len(attempts) == 1 else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return len(attempts)
+
+    async def run():
+        result = await resilience.acall(send, stage="hedge-async", hedge=True)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 2
+    assert cancelled == [1]
+
+
+# -------------------- Rate-limit quota --------------------
+
+@pytest.mark.parametrize("fake", [{"error_rate": 0.5, "error_statuses": "500,429", "retry_after": 0.01,
+                                   "seed": 11}], indirect=True)
+def test_every_attempt_takes_quota(fast_retries, fake, monkeypatch):
+    import ratelimit
+    charged = []
+    monkeypatch.setattr(ratelimit, "acquire", lambda tokens, deadline=None: charged.append(tokens))
+    for _ in range(10):
+        llm.chat(MESSAGES, max_tokens=50, stage="judge", cache=False)
+    calls, errors = _upstream(fake)
+    assert errors > 0
+    assert len(charged) == calls
+
+
+def test_hedge_takes_quota(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_SECONDS", 0.05)
+    monkeypatch.setattr(resilience, "breaker", resilience.CircuitBreaker(threshold=0))
+    _warm("hedge-quota")
+    attempts, charged = [], []
+
+    def send():
+        attempts.append(1)
+        time.sleep(1.0 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    resilience.call(send, stage="hedge-quota", hedge=True, charge=lambda: charged.append(1))
+    assert len(charged) == 2
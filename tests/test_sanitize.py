@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from benchmarks.bench_sanitizer import chunkings, legacy_sanitize, messy_story, run_stream
+from sanitize import StorySanitizer, clean_title, sanitize_story_text
+
+# Messy model outputs from the sanitizer benchmark: StorySanitizer must match
+# the old whole-string sanitizer exactly, however the stream is chunked
+CORPUS = [messy_story(random.Random(seed)) for seed in range(300)]
+
+
+@pytest.mark.parametrize("seed", range(0, 300, 30))
+def test_whole_text_matches_legacy(seed):
+    for text in CORPUS[seed:seed + 30]:
+        assert sanitize_story_text(text) == legacy_sanitize(text), repr(text)
+
+
+@pytest.mark.parametrize("seed", range(0, 300, 30))
+def test_streamed_chunks_match_legacy(seed):
+    rng = random.Random(seed)
+    for text in CORPUS[seed:seed + 30]:
+        expected = legacy_sanitize(text)
+        for chunks in chunkings(text, rng):
+            assert run_stream(chunks) == expected, (repr(text), [len(c) for c in chunks][:10])
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "**Title:** Pip's Night\r\n\r\nPip **slept**.\n",
+    "# ## # Heading\n\n## Part one\nThe moon rose.",
+    "TITLE\n\nThe `stars` came out. Wren sang.",
+    "\n \n__Grandma Moss__  \n\n\n  The end.  \t",
+])
+def test_edge_cases_match_legacy(text):
+    assert sanitize_story_text(text) == legacy_sanitize(text)
+    assert run_stream(list(text)) == legacy_sanitize(text)
+
+
+def test_markup_split_across_chunks():
+    sanitizer = StorySanitizer()
+    out = "".join(sanitizer.feed(c) for c in ["Title: Pip\n\nA *", "*bold", "*", "* _", "_word_", "_ `x`"])
+    assert out + sanitizer.finish() == "Pip\n\nA bold word x"
+
+
+def test_clean_title():
+    assert clean_title("  ## Title - The Quiet Pond: ") == "The Quiet Pond"
@@ -0,0 +1,16 @@
+import copy
+
+import sessions
+
+
+def test_compact_state_leaves_the_session_alone():
+    verdict = {"pass": False, "scores": {"average": 6}, "issues": ["too short"],
+               "edit_instructions": "Add a scene."}
+    data = {"state": {"story": "Pip", "history": [{"round": 1, "verdict": verdict}]}, "job": None}
+    before = copy.deepcopy(data)
+
+    compact = sessions.compact_state(data)
+
+    assert compact["state"]["history"] == [{"round": 1, "verdict": {"pass": False, "scores": {"average": 6}}}]
+    assert compact["state"]["story"] == "Pip"
+    assert data == before
@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+import sessions
+import speculative
+
+VERDICT = {"pass": True, "scores": {"average": 9}, "issues": ["a little long"], "edit_instructions": "Trim."}
+STATE = {"mode": "arc", "prompt": "a fox", "brief": {"category": "adventure"}, "chapters": ["Chapter one."],
+         "arc_ready_to_end": False, "history": [{"round": "chapter-1", "verdict": VERDICT}]}
+
+
+def _compacted(state):
+    return sessions.compact_state({"state": state})["state"]
+
+
+def test_fingerprint_ignores_verdict_details():
+    assert speculative.fingerprint(STATE) == speculative.fingerprint(_compacted(STATE))
+    assert speculative.fingerprint(STATE) != speculative.fingerprint(dict(STATE, chapters=["Another one."]))
+    longer = dict(STATE, history=STATE["history"] + [{"round": "tweak-ch1", "verdict": VERDICT}])
+    assert speculative.fingerprint(STATE) != speculative.fingerprint(longer)
+
+
+@pytest.mark.parametrize("stored", [_compacted, dict], ids=["server-side", "cookie"])
+def test_guess_serves_a_click_from_either_session_backend(tmp_path, stored):
+    def next_chapter(payload):
+        return dict(payload["state"], chapters=payload["state"]["chapters"] + ["Chapter two."])
+
+    store = speculative.SpeculationStore(path=str(tmp_path / "speculative.sqlite3"))
+    speculator = speculative.Speculator({"next_chapter": next_chapter}, store=store)
+    try:
+        # Guessed from the live state; the click carries it as the session stored it
+        speculator.speculate(STATE)
+        payload = {"state": stored(STATE), "end_now": False}
+        deadline = time.monotonic() + 5
+        result = None
+        while result is None and time.monotonic() < deadline:
+            result = speculator.take("next_chapter", payload)
+            time.sleep(0.02)
+    finally:
+        speculator.stop()
+    assert result["chapters"] == ["Chapter one.", "Chapter two."]
@@ -0,0 +1,65 @@
+import pytest
+
+import structured
+from structured import SCORE_KEYS, SchemaError
+
+
+def _scores(score=9, **overrides):
+    return dict({k: score for k in SCORE_KEYS}, **overrides)
+
+
+def test_truncated_judge_reply_is_rejected():
+    data = structured.parse_json('{"scores": {"age_fit": 9, "tone": 9')
+    assert data == {"scores": {"age_fit": 9, "tone": 9}}
+    with pytest.raises(SchemaError, match="safety"):
+        structured.coerce_verdict(data)
+
+
+def test_pass_without_scores_is_rejected():
+    with pytest.raises(SchemaError):
+        structured.coerce_verdict({"pass": True})
+
+
+def test_pass_is_derived_from_full_scores():
+    verdict = structured.coerce_verdict({"scores": _scores(9)})
+    assert verdict["pass"] and verdict["scores"]["average"] == 9
+
+
+def test_model_pass_cannot_override_a_failing_score():
+    verdict = structured.coerce_verdict({"scores": _scores(9, safety=3), "pass": "yes"})
+    assert not verdict["pass"]
+
+
+def test_model_fail_wins_over_passing_scores():
+    assert not structured.coerce_verdict({"scores": _scores(9), "pass": False})["pass"]
+
+
+def test_scores_are_clamped_and_typed():
+    verdict = structured.coerce_verdict({"scores": _scores("9", tone=14.2), "issues": "too long"})
+    assert verdict["scores"]["tone"] == 10 and verdict["scores"]["age_fit"] == 9
+    assert verdict["issues"] == ["too long"]
+
+
+def test_flat_scores_are_accepted():
+    assert structured.coerce_verdict(_scores(9))["pass"]
+
+
+@pytest.mark.parametrize("raw", [
+    '```json\n{"pass": true, "issues": [],}\n```',
+    "Here you go: {'pass': True, 'issues': []} Hope that helps.",
+    '{"pass": true, "issues": [',
+])
+def test_parse_json_repairs_common_damage(raw):
+    assert structured.parse_json(raw)["pass"] is True
+
+
+def test_parse_json_gives_up_on_prose():
+    with pytest.raises(SchemaError):
+        structured.parse_json("I cannot judge this story.")
+
+
+def test_brief_needs_some_content():
+    with pytest.raises(SchemaError):
+        structured.coerce_brief({"tone": "calm"})
+    brief = structured.coerce_brief({"category": "Animal Friends", "length_words": "900"})
+    assert brief["category"] == "animal-friends" and brief["length_words"] == 700
@@ -1,170 +1,166 @@
-from pipeline import (
-    generate_story, apply_tweak,
-    generate_first_chapter, generate_next_chapter
-)
+from pipeline import generate_story_events, pool_story
+from flows import start_story, tweak_story, next_chapter
 import os
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import (
+    Flask, Response, render_template, request, redirect, url_for, session, flash,
+    stream_with_context
+)
+
+import jobs
+import metrics
+import pool
+import ratelimit
+import serving
+import sessions
+import speculative
+from serving import sse
 
 load_dotenv()
 
 
+def _prioritized(name, handler):
+    """Run a job handler's LLM calls in rate-limit priority class `name`."""
+    def run(payload):
+        with ratelimit.priority(name):
+            return handler(payload)
+    return run
+
+
+# Job kinds the speculator may run before the click (see speculative.py)
+SPECULATIVE_FLOWS = {
+    "tweak": lambda p: tweak_story(p["state"], p["tweak"]),
+    "next_chapter": lambda p: next_chapter(p["state"], end_now=p.get("end_now", False)),
+}
+
+# Background job kinds -> handlers (payload dict in, new session state out)
+JOB_HANDLERS = {
+    "generate": _prioritized("interactive", lambda p: start_story(p["prompt"], p.get("mode", "short"))),
+    "tweak": _prioritized("tweak", SPECULATIVE_FLOWS["tweak"]),
+    "next_chapter": _prioritized("interactive", SPECULATIVE_FLOWS["next_chapter"]),
+}
+
+
 def create_app():
     app = Flask(__name__)
     app.secret_key = os.getenv("SECRET_KEY", "dev-secret-key-for-local-only")
+    # A live stream holds a sync worker for the whole story: the page runs
+    # short stories as polled jobs here (asgi.py streams them)
+    app.config["LIVE_STREAM"] = False
+    sessions.init_app(app)
+    speculator = speculative.Speculator(SPECULATIVE_FLOWS) if speculative.SPECULATE_ENABLED else None
+    handlers = speculator.wrap(JOB_HANDLERS) if speculator else JOB_HANDLERS
+    job_queue = jobs.JobQueue(handlers).start()
+    app.extensions["job_queue"] = job_queue
+    serving.register_gauges(job_queue)
+    if pool.POOL_ENABLED:
+        app.extensions["pool_filler"] = pool.PoolFiller(pool_story).start()
+
+    def deliver(state):
+        """Show a new state on the page and start guessing the next click on it."""
+        session["state"] = state
+        if speculator:
+            speculator.speculate(state)
+
+    def wants_json():
+        return serving.wants_json(request.accept_mimetypes)
+
+    def notify(notice):
+        if notice:
+            flash(*notice)
+        return redirect(url_for("index"))
+
+    def enqueue(job):
+        """
+        Hand a pipeline run to the job workers and return immediately.
+        Browsers are redirected to the page (which polls the job); API
+        clients get 202 + job id. A full queue answers 429. A click whose
+        speculative result is ready is served without a job. Anything but a
+        serving.Job is a notice to show instead.
+        """
+        if not isinstance(job, serving.Job):
+            return notify(job)
+        if speculator and job.kind in speculator.flows and not wants_json():
+            hit = speculator.take(job.kind, job.payload)
+            if hit is not None:
+                session.pop("failed_job", None)
+                deliver(hit)
+                return redirect(url_for("index"))
+
+        try:
+            job_id = job_queue.submit(job.kind, job.payload)
+            session.pop("failed_job", None)
+        except jobs.QueueFull as e:
+            if wants_json():
+                return {"error": str(e)}, 429
+            flash(str(e), "warning")
+            return render_template("index.html", state=session.get("state"), job=None), 429
+
+        if wants_json():
+            return {"job_id": job_id, "status_url": url_for("job_status", job_id=job_id)}, 202
+        serving.job_started(session, job, job_id)
+        return redirect(url_for("index"))
+
+    def end_story(notice, *keys):
+        if speculator:
+            speculator.discard(session.get("state"))
+        return notify(serving.end_story(session, notice, *keys))
 
     @app.route("/", methods=["GET"])
     def index():
         state = session.get("state")
-        return render_template("index.html", state=state)
+        return render_template("index.html", state=state, job=session.get("job"),
+                               failed_job=session.get("failed_job"))
 
     @app.route("/generate", methods=["POST"])
     def generate():
-        prompt = request.form.get("prompt", "").strip()
-        mode = request.form.get("mode", "short")
-        if not prompt:
-            flash("Please enter a quick story idea.", "warning")
-            return redirect(url_for("index"))
-
-        if not os.getenv("OPENAI_API_KEY"):
-            flash(
-                "OPENAI_API_KEY is not set. Configure it on Heroku or in your .env.", "danger")
-            return redirect(url_for("index"))
-
-        try:
-            if mode == "arc":
-                # Build brief quickly via the short flow (to get a brief) then start Chapter 1
-                init = generate_story(prompt, max_rounds=1)
-                brief = init["brief"]
-
-                ch1, verdict1 = generate_first_chapter(brief)
-                session["state"] = {
-                    "mode": "arc",
-                    "prompt": prompt,
-                    "brief": brief,
-                    "chapters": [ch1],
-                    # final chapter already produced? (False initially)
-                    "arc_ready_to_end": False,
-                    "history": [{"round": "chapter-1", "verdict": verdict1}],
-                }
-            else:
-                # Short story mode
-                result = generate_story(prompt, max_rounds=2)
-                session["state"] = {
-                    "mode": "short",
-                    "prompt": prompt,
-                    "brief": result["brief"],
-                    "story": result["story"],
-                    "history": result["history"],
-                    "passed": result.get("passed", False),
-                }
-
-        except Exception as e:
-            flash(f"Error generating: {e}", "danger")
+        return enqueue(serving.generate_job(request.form))
 
+    @app.route("/generate/stream", methods=["GET"])
+    def generate_stream():
+        """
+        Short-story flow as Server-Sent Events: storyteller/editor tokens live,
+        then judge/edit progress, then a signed result for /generate/commit.
+        Holds this worker until the story is done, so the page doesn't use it
+        on the sync app (see LIVE_STREAM); it stays for API clients.
+        """
+        prompt = request.args.get("prompt", "").strip()
+        error = serving.stream_error(prompt)
+        if error:
+            return Response(sse("failed", {"message": error}), mimetype="text/event-stream")
+
+        def events():
+            try:
+                for event, data in generate_story_events(prompt, max_rounds=2):
+                    yield serving.stream_event(app.secret_key, prompt, event, data)
+            except Exception as e:
+                yield sse("failed", {"message": f"Error generating: {e}"})
+
+        return Response(stream_with_context(events()), mimetype="text/event-stream", headers=serving.SSE_HEADERS)
+
+    @app.route("/generate/commit", methods=["POST"])
+    def generate_commit():
+        """Store a streamed story (signed by /generate/stream) in the session."""
+        state = serving.streamed_state(app.secret_key, request.form.get("token", ""))
+        if isinstance(state, tuple):
+            return notify(state)
+        deliver(state)
         return redirect(url_for("index"))
 
     @app.route("/tweak", methods=["POST"])
     def tweak():
-        state = session.get("state")
-        if not state:
-            flash("Please generate a story first.", "warning")
-            return redirect(url_for("index"))
-
-        tweak_text = request.form.get("tweak", "").strip()
-        if not tweak_text:
-            flash("Type any tweak to apply.", "warning")
-            return redirect(url_for("index"))
-
-        try:
-            if state.get("mode") == "arc":
-                # If the final chapter was already created, don't allow tweaks (user should End Now)
-                if state.get("arc_ready_to_end"):
-                    flash(
-                        "The final chapter is ready. Click 'End Now' to finish.", "info")
-                    return redirect(url_for("index"))
-
-                brief = state["brief"]
-                chapters = state["chapters"]
-                last = chapters[-1]
-
-                new_chapter, new_verdict = apply_tweak(
-                    brief, last, tweak_text, rounds=2)
-                chapters[-1] = new_chapter
-                state["history"].append(
-                    {"round": f"tweak-ch{len(chapters)}", "verdict": new_verdict})
-                session["state"] = state
-            else:
-                brief = state["brief"]
-                story = state["story"]
-                new_story, new_verdict = apply_tweak(
-                    brief, story, tweak_text, rounds=2)
-                state["story"] = new_story
-                state["history"].append(
-                    {"round": f"tweak-{len(state['history'])+1}", "verdict": new_verdict})
-                session["state"] = state
-
-        except Exception as e:
-            flash(f"Error applying tweak: {e}", "danger")
-
-        return redirect(url_for("index"))
+        return enqueue(serving.tweak_job(session.get("state"), request.form))
 
     @app.route("/arc/next", methods=["POST"])
     def arc_next():
-        state = session.get("state")
-        if not state or state.get("mode") != "arc":
-            flash("Start a multi-arc story first.", "warning")
-            return redirect(url_for("index"))
-        if state.get("arc_ready_to_end"):
-            flash(
-                "The final chapter is already created. Click 'End Now' to finish.", "info")
-            return redirect(url_for("index"))
-
-        try:
-            brief = state["brief"]
-            chapters = state["chapters"]
-            chapter, verdict = generate_next_chapter(
-                brief, chapters, end_now=False)
-            chapters.append(chapter)
-            state["history"].append(
-                {"round": f"chapter-{len(chapters)}", "verdict": verdict})
-            session["state"] = state
-
-        except Exception as e:
-            flash(f"Error creating next chapter: {e}", "danger")
-
-        return redirect(url_for("index"))
+        return enqueue(serving.chapter_job(session.get("state"), end_now=False))
 
     @app.route("/arc/end_next", methods=["POST"])
     def arc_end_next():
         """
         Generate the FINAL chapter now, then show only 'End Now' on the page.
         """
-        state = session.get("state")
-        if not state or state.get("mode") != "arc":
-            flash("Start a multi-arc story first.", "warning")
-            return redirect(url_for("index"))
-
-        if state.get("arc_ready_to_end"):
-            # Already produced the final chapter; just show End Now on UI
-            return redirect(url_for("index"))
-
-        try:
-            brief = state["brief"]
-            chapters = state["chapters"]
-            # Produce the final chapter immediately
-            chapter, verdict = generate_next_chapter(
-                brief, chapters, end_now=True)
-            chapters.append(chapter)
-            state["history"].append(
-                {"round": f"chapter-{len(chapters)} (final)", "verdict": verdict})
-            state["arc_ready_to_end"] = True  # UI will only show End Now
-            session["state"] = state
-
-        except Exception as e:
-            flash(f"Error creating final chapter: {e}", "danger")
-
-        return redirect(url_for("index"))
+        return enqueue(serving.chapter_job(session.get("state"), end_now=True))
 
     @app.route("/arc/end_now", methods=["POST"])
     def arc_end_now():
@@ -172,15 +168,51 @@ def create_app():
         When End Now is clicked, immediately reset the session and return to start.
         (We assume the final chapter has already been generated by /arc/end_next.)
         """
-        session.pop("state", None)
-        flash("Story ended. Start a new one!", "info")
-        return redirect(url_for("index"))
+        return end_story(("Story ended. Start a new one!", "info"))
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        """Poll a background job (the result itself is only handed out via /finish)."""
+        job = job_queue.get(job_id)
+        return serving.job_view(job_id, job), 404 if job is None else 200
+
+    @app.route("/jobs/<job_id>/finish", methods=["POST"])
+    def job_finish(job_id):
+        """Move a finished job's result into this user's session."""
+        pending = session.get("job")
+        if not pending or pending.get("id") != job_id:
+            return redirect(url_for("index"))
+        state, notice = serving.job_finished(session, job_id, job_queue.get(job_id))
+        if state is not None:
+            deliver(state)
+        return notify(notice)
+
+    @app.route("/jobs/<job_id>/retry", methods=["POST"])
+    def job_retry(job_id):
+        """Re-run a failed job under the same id, skipping its completed stages."""
+        try:
+            retried = job_queue.retry(job_id)
+        except jobs.QueueFull as e:
+            if wants_json():
+                return {"error": str(e)}, 429
+            return notify((str(e), "warning"))
+        if wants_json():
+            return serving.retry_json(job_id, retried, url_for("job_status", job_id=job_id))
+        return notify(serving.job_retried(session, job_id, retried))
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        """Prometheus text-format metrics for this worker process."""
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/cache/stats", methods=["GET"])
+    def cache_stats():
+        """LLM response cache, request index and story pool counters for this worker."""
+        return serving.cache_stats()
 
     @app.route("/reset", methods=["POST"])
     def reset():
-        session.pop("state", None)
-        flash("Cleared session. Start fresh!", "info")
-        return redirect(url_for("index"))
+        return end_story(("Cleared session. Start fresh!", "info"), "failed_job")
 
     return app
 